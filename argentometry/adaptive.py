@@ -0,0 +1,76 @@
+"""Bayesian adaptive estimation of digit span.
+
+The subject is modelled as recalling a sequence of length L correctly with
+probability
+
+    (1 - lapse) / (1 + exp((L - span) / slope))
+
+SpanEstimator keeps a posterior over `span` on a grid. Each trial it picks
+the length whose outcome, in expectation, leaves the smallest posterior
+variance, and it updates the posterior with the outcome. Its estimate is the
+posterior mean and its uncertainty the posterior sd. It tracks any number of
+subjects at once (one row each), so the same code drives a live session
+(n=1) and the simulator.
+"""
+import numpy
+
+GRID = numpy.arange(0.5, 20.0001, 0.1)
+
+
+def p_correct(length, span, lapse, slope):
+    with numpy.errstate(over='ignore'):
+        return (1 - lapse) / (1 + numpy.exp((length - span) / slope))
+
+
+class SpanEstimator(object):
+
+    def __init__(self, n=1, prior_mean=6.0, prior_sd=2.0, min_length=2, max_length=15,
+                 lapse=0.05, slope=0.5, grid=GRID):
+        self.grid = grid
+        self.lengths = numpy.arange(min_length, max_length + 1)
+        prior = numpy.exp(-0.5 * ((grid - prior_mean) / float(prior_sd)) ** 2)
+        # kept normalized, one row per subject
+        self.post = numpy.tile(prior / prior.sum(), (n, 1))
+        # p[i, j]: P(correct | length i, span j)
+        self.p = p_correct(self.lengths[:, None], grid[None, :], lapse, slope)
+        # the likelihoods of a correct and a wrong answer, for update()
+        self.likelihood = (numpy.maximum(self.p, 1e-12), numpy.maximum(1 - self.p, 1e-12))
+        self.trials = numpy.zeros(n, dtype=numpy.int32)
+
+    def posterior(self, subjects=None):
+        return self.post if subjects is None else self.post[subjects]
+
+    def estimate(self, subjects=None):
+        """Returns (mean, sd) of the posterior, one entry per subject (or per
+        given row of subjects)."""
+        post = self.posterior(subjects)
+        mean = post.dot(self.grid)
+        sd = numpy.sqrt(numpy.maximum(post.dot(self.grid ** 2) - mean ** 2, 0))
+        return mean, sd
+
+    def next_length(self, subjects=None):
+        """The most informative sequence length for each subject (or for the
+        given rows of subjects)."""
+        post = self.posterior(subjects)
+        weighted = post * self.grid
+        weighted2 = weighted * self.grid
+        # probability of a correct answer at each length, and the (unnormalized)
+        # posterior moments after it; those after an error are what is left
+        correct = (post.dot(self.p.T), weighted.dot(self.p.T), weighted2.dot(self.p.T))
+        wrong = (1 - correct[0], weighted.sum(axis=1)[:, None] - correct[1],
+                 weighted2.sum(axis=1)[:, None] - correct[2])
+        # P(outcome) * posterior variance after it, summed over both outcomes
+        expected_var = 0
+        for outcome, m1, m2 in (correct, wrong):
+            expected_var = expected_var + m2 - m1 ** 2 / outcome
+        return self.lengths[numpy.argmin(expected_var, axis=1)]
+
+    def update(self, length, correct, subjects=None):
+        """Adds one trial per subject (or for the given rows of subjects)."""
+        if subjects is None:
+            subjects = numpy.arange(len(self.post))
+        rows = numpy.searchsorted(self.lengths, length)
+        post = self.post[subjects] * numpy.where(numpy.asarray(correct)[..., None],
+                                                 self.likelihood[0][rows], self.likelihood[1][rows])
+        self.post[subjects] = post / post.sum(axis=1)[:, None]
+        self.trials[subjects] += 1
@@ -0,0 +1,424 @@
+"""Batch scoring of DigitSpan and SART data directories.
+
+A directory of session CSVs is read into NumPy arrays, one row per trial with
+a `file` column saying which session it came from, and every metric is then
+computed for all sessions at once with grouped array operations. Large
+directories are split into chunks that are scored in a process pool.
+
+    python -m argentometry.analysis digitspan_data -o digitspan_scores.csv
+
+Per-file results are cached in '<data_dir>/.scores_cache', keyed by file
+name, mtime, size and content hash, so a rerun only parses and scores files
+that are new or changed. The cache is thrown away whenever the scoring code
+itself changes.
+
+DigitSpan metrics, per direction (forward/reverse), over main trials:
+    max_span        longest sequence recalled exactly
+    correct         number of trials recalled exactly
+    trials          number of trials
+    partial_credit  mean fraction of digits recalled in the right position
+and total_correct over both directions.
+
+SART metrics, over main trials:
+    accuracy            fraction of trials answered correctly
+    commission_errors   clicks on the target digit
+    omission_errors     no click on a non-target digit
+    mean_rt, rt_cv      mean and coefficient of variation of the RT of
+                        correct clicks
+    post_error_slowing  mean RT of correct clicks right after an error minus
+                        that right after a correct trial
+    dropped_frames      frames dropped during digits and masks (0 for files
+                        without frame timing)
+"""
+import argparse
+import csv
+import hashlib
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+from argentometry.schema import DIGITSPAN_DIRECTIONS, SART_PHASES, detect_task, split_name
+
+MISSING = -1  # padding at the end of a digit sequence
+X = 10  # an 'x' typed for a digit the subject didn't remember
+
+CHUNK_SIZE = 250  # files per worker task
+CACHE_FILE = '.scores_cache'
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def read_rows(path):
+    with open(path) as f:
+        return [row for row in csv.reader(f) if row]
+
+
+def parse_sequence(text):
+    return [X if d == 'x' else int(d) for d in text.split('-')] if text else []
+
+
+def sequence_matrix(sequences, width=None):
+    """Packs sequences into an (n, width) int8 matrix padded with MISSING.
+
+    Returns (matrix, lengths).
+    """
+    lengths = numpy.array([len(s) for s in sequences], dtype=numpy.int16)
+    if width is None:
+        width = lengths.max() if len(lengths) else 0
+    matrix = numpy.empty((len(sequences), width), dtype=numpy.int8)
+    matrix.fill(MISSING)
+
+    total = lengths.sum()
+    if total:
+        flat = numpy.fromiter((d for s in sequences for d in s), dtype=numpy.int8, count=total)
+        rows = numpy.repeat(numpy.arange(len(sequences)), lengths)
+        starts = numpy.cumsum(lengths) - lengths
+        cols = numpy.arange(total) - numpy.repeat(starts, lengths)
+        matrix[rows, cols] = flat
+    return matrix, lengths
+
+
+def load_digitspan(paths):
+    """Reads DigitSpan files into a dict of per-trial arrays."""
+    rows = []
+    files = []
+    for i, path in enumerate(paths):
+        r = read_rows(path)
+        rows.extend(r)
+        files.extend([i] * len(r))
+
+    expected = [parse_sequence(row[2]) for row in rows]
+    actual = [parse_sequence(row[3]) for row in rows]
+    width = max([len(s) for s in expected + actual] or [0])
+    expected, expected_len = sequence_matrix(expected, width)
+    actual, actual_len = sequence_matrix(actual, width)
+
+    return {
+        'file': numpy.array(files, dtype=numpy.int32),
+        'direction': numpy.array([DIGITSPAN_DIRECTIONS.index(row[0]) for row in rows], dtype=numpy.int8),
+        'trial': numpy.array([int(row[1]) for row in rows], dtype=numpy.int16),
+        'expected': expected,
+        'expected_len': expected_len,
+        'actual': actual,
+        'actual_len': actual_len,
+        'timestamp': numpy.array([float(row[4]) for row in rows], dtype=numpy.float64),
+    }
+
+
+def load_sart(paths):
+    """Reads SART files into a dict of per-trial arrays."""
+    rows = []
+    files = []
+    for i, path in enumerate(paths):
+        r = read_rows(path)
+        rows.extend(r)
+        files.extend([i] * len(r))
+
+    return {
+        'file': numpy.array(files, dtype=numpy.int32),
+        'phase': numpy.array([SART_PHASES.index(row[0]) for row in rows], dtype=numpy.int8),
+        'target': numpy.array([int(row[1]) for row in rows], dtype=numpy.int8),
+        'digit': numpy.array([int(row[2]) for row in rows], dtype=numpy.int8),
+        'success': numpy.array([row[3] == 'True' for row in rows], dtype=bool),
+        'rt': numpy.array([float(row[4]) for row in rows], dtype=numpy.float64),
+        'pressed': numpy.array([row[5] != 'nopress' for row in rows], dtype=bool),
+        'dropped': numpy.array([int(row[9]) if len(row) > 9 else 0 for row in rows], dtype=numpy.int32),
+    }
+
+
+def group_mean(groups, values, n):
+    count = numpy.bincount(groups, minlength=n).astype(numpy.float64)
+    total = numpy.bincount(groups, weights=values, minlength=n)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+
+def score_digitspan(data, n):
+    """Metrics for n sessions; every value is an array of length n."""
+    file = data['file']
+    expected = data['expected']
+    actual = data['actual']
+    length = data['expected_len']
+
+    same = expected == actual
+    correct = (length == data['actual_len']) & same.all(axis=1)
+    in_place = (same & (expected != MISSING)).sum(axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        partial = in_place / length.astype(numpy.float64)
+
+    scores = {}
+    for direction in ('forward', 'reverse'):
+        m = data['direction'] == DIGITSPAN_DIRECTIONS.index(direction)
+        hit = m & correct
+
+        max_span = numpy.zeros(n, dtype=numpy.int16)
+        numpy.maximum.at(max_span, file[hit], length[hit])
+        scores[direction + '_max_span'] = max_span
+        scores[direction + '_correct'] = numpy.bincount(file[hit], minlength=n)
+        scores[direction + '_trials'] = numpy.bincount(file[m], minlength=n)
+        scores[direction + '_partial_credit'] = group_mean(file[m], partial[m], n)
+
+    scores['total_correct'] = scores['forward_correct'] + scores['reverse_correct']
+    return scores
+
+
+def score_sart(data, n):
+    """Metrics for n sessions; every value is an array of length n."""
+    m = data['phase'] == SART_PHASES.index('main')
+    file = data['file'][m]
+    pressed = data['pressed'][m]
+    rt = data['rt'][m]
+    go = data['digit'][m] != data['target'][m]
+
+    commission = pressed & ~go
+    omission = ~pressed & go
+    hit = pressed & go
+    error = commission | omission
+
+    scores = {
+        'trials': numpy.bincount(file, minlength=n),
+        'accuracy': group_mean(file, data['success'][m].astype(numpy.float64), n),
+        'commission_errors': numpy.bincount(file[commission], minlength=n),
+        'omission_errors': numpy.bincount(file[omission], minlength=n),
+        # frames dropped while a digit or mask was on screen
+        'dropped_frames': numpy.bincount(file, weights=data['dropped'][m], minlength=n).astype(numpy.int64),
+    }
+
+    count = numpy.bincount(file[hit], minlength=n).astype(numpy.float64)
+    total = numpy.bincount(file[hit], weights=rt[hit], minlength=n)
+    squares = numpy.bincount(file[hit], weights=rt[hit] ** 2, minlength=n)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        sd = numpy.sqrt(numpy.maximum(squares - total * mean, 0) / (count - 1))
+    scores['mean_rt'] = mean
+    scores['rt_cv'] = sd / mean
+
+    # the trial before, if it belongs to the same session
+    has_prev = numpy.r_[False, file[1:] == file[:-1]]
+    after_error = has_prev & numpy.r_[False, error[:-1]]
+    after_correct = has_prev & ~numpy.r_[False, error[:-1]]
+    scores['post_error_slowing'] = group_mean(file[hit & after_error], rt[hit & after_error], n) - \
+        group_mean(file[hit & after_correct], rt[hit & after_correct], n)
+
+    return scores
+
+
+LOADERS = {'digitspan': load_digitspan, 'sart': load_sart}
+SCORERS = {'digitspan': score_digitspan, 'sart': score_sart}
+
+
+def score_chunk(args):
+    task, paths = args
+    return SCORERS[task](LOADERS[task](paths), len(paths))
+
+
+def score_files(paths, task, processes=None, chunk_size=CHUNK_SIZE):
+    """Scores every file in `paths` (all from `task`).
+
+    Returns a dict of arrays, one entry per file: 'subject', 'test' and 'path',
+    plus every metric.
+    """
+    chunks = [(task, paths[i:i + chunk_size]) for i in range(0, len(paths), chunk_size)]
+    if processes == 1 or len(chunks) <= 1:
+        results = [score_chunk(chunk) for chunk in chunks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(score_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    scores = {}
+    if results:
+        for name in results[0]:
+            scores[name] = numpy.concatenate([r[name] for r in results])
+    names = [split_name(path) for path in paths]
+    scores['subject'] = numpy.array([subject for subject, test in names])
+    scores['test'] = numpy.array([test for subject, test in names])
+    scores['path'] = numpy.array(paths)
+    return scores
+
+
+def session_files(data_dir):
+    return sorted(os.path.join(data_dir, fn) for fn in os.listdir(data_dir) if fn.endswith('.csv'))
+
+
+def guess_task(paths):
+    for path in paths:
+        with open(path) as f:
+            for row in csv.reader(f):
+                if row:
+                    return detect_task(row)
+    return None
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scoring_version():
+    """A hash of the code that parses and scores files."""
+    import argentometry.schema
+    digest = hashlib.sha1()
+    for module in (sys.modules[__name__], argentometry.schema):
+        source = os.path.splitext(module.__file__)[0] + '.py'
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ScoreCache(object):
+    """Per-file scores for one data directory, persisted between runs.
+
+    entries maps a file name to a dict with its 'mtime', 'size', 'hash',
+    'task' and 'scores' (metric name -> value).
+    """
+
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, CACHE_FILE)
+        self.version = scoring_version()
+        self.entries = {}
+
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    version, entries = pickle.load(f)
+                if version == self.version:
+                    self.entries = entries
+            except Exception:
+                pass  # unreadable cache, start over
+
+    def lookup(self, path, task):
+        """Cached scores for `path`, or None if it is new or has changed."""
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None or entry['task'] != task:
+            return None
+
+        st = os.stat(path)
+        if (entry['mtime'], entry['size']) == (st.st_mtime, st.st_size):
+            return entry['scores']
+        if entry['size'] == st.st_size and entry['hash'] == file_hash(path):
+            # touched but not changed
+            entry['mtime'] = st.st_mtime
+            return entry['scores']
+        return None
+
+    def store(self, path, task, scores):
+        st = os.stat(path)
+        self.entries[os.path.basename(path)] = {
+            'mtime': st.st_mtime, 'size': st.st_size, 'hash': file_hash(path),
+            'task': task, 'scores': scores}
+
+    def prune(self, paths):
+        names = set(os.path.basename(path) for path in paths)
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((self.version, self.entries), f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+
+
+def score_directory(data_dir, task=None, processes=None, cache=True):
+    """Scores every session CSV in `data_dir`.
+
+    A data directory holds one task's files; `task` is 'digitspan' or 'sart',
+    and is guessed from the first row found if not given. With `cache`, only
+    files that are new or changed since the last run are scored.
+    """
+    paths = session_files(data_dir)
+    task = task or guess_task(paths) or 'digitspan'
+    if not cache:
+        return score_files(paths, task, processes)
+
+    cache = ScoreCache(data_dir)
+    cache.prune(paths)
+    stale = [path for path in paths if cache.lookup(path, task) is None]
+
+    if stale:
+        fresh = score_files(stale, task, processes)
+        metrics = [name for name in fresh if name not in ('subject', 'test', 'path')]
+        for i, path in enumerate(stale):
+            cache.store(path, task, dict((name, fresh[name][i].item()) for name in metrics))
+    cache.save()
+
+    # merge the cached and the freshly scored files into one table
+    per_file = [cache.lookup(path, task) for path in paths]
+    scores = {}
+    if per_file:
+        for name in per_file[0]:
+            scores[name] = numpy.array([s[name] for s in per_file])
+    names = [split_name(path) for path in paths]
+    scores['subject'] = numpy.array([subject for subject, test in names])
+    scores['test'] = numpy.array([test for subject, test in names])
+    scores['path'] = numpy.array(paths)
+    return scores
+
+
+def summarize(scores):
+    """Cohort aggregate: metric name -> (sessions, mean, sd), ignoring NaNs."""
+    summary = {}
+    for name, values in scores.items():
+        if name in ('subject', 'test', 'path'):
+            continue
+        values = values.astype(numpy.float64)
+        values = values[~numpy.isnan(values)]
+        sd = values.std(ddof=1) if len(values) > 1 else numpy.nan
+        summary[name] = (len(values), values.mean() if len(values) else numpy.nan, sd)
+    return summary
+
+
+def write_scores(scores, f):
+    metrics = sorted(name for name in scores if name not in ('subject', 'test', 'path'))
+    writer = csv.writer(f)
+    writer.writerow(['subject', 'test'] + metrics)
+    for i in range(len(scores['path'])):
+        writer.writerow([scores['subject'][i], scores['test'][i]] + [scores[name][i] for name in metrics])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score a DigitSpan or SART data directory.')
+    parser.add_argument('data_dir')
+    parser.add_argument('--task', choices=sorted(LOADERS), help='default: guessed from the data')
+    parser.add_argument('-o', '--output', help='CSV file to write (default: stdout)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='rescore every file and leave the cache alone')
+    parser.add_argument('--summary', action='store_true',
+                        help='write the cohort mean and sd of each metric instead')
+    args = parser.parse_args(argv)
+
+    scores = score_directory(args.data_dir, args.task, args.processes, args.cache)
+    f = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.summary:
+            writer = csv.writer(f)
+            writer.writerow(['metric', 'sessions', 'mean', 'sd'])
+            for name, row in sorted(summarize(scores).items()):
+                writer.writerow([name] + list(row))
+        else:
+            write_scores(scores, f)
+    finally:
+        if args.output:
+            f.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""Columnar, memory-mappable session archives.
+
+pack() turns a directory of one task's session CSVs into an archive
+directory holding one .npy file per column. Digit sequences are stored as
+fixed-width int8 matrices (padded with analysis.MISSING, with 'x' stored as
+analysis.X) plus a length column, text fields as small integer codes,
+DigitSpan keystrokes as flat key/time arrays indexed by per-trial start and
+count columns, and DigitSpan digit onsets as an int64 matrix like the
+sequences.
+
+Trial rows are sorted by a grouping key -- (direction, sequence length) for
+DigitSpan, (phase, digit) for SART -- so that a cohort-wide query such as
+"all reverse trials of length 7" is a contiguous slice of memory-mapped
+arrays and needs no parsing or copying:
+
+    archive = Archive('digitspan.archive')
+    trials = archive.group('reverse', 7)
+    trials['actual'], trials['session'], ...
+
+The `by_session` column restores each session's original row order, and
+unpack() writes every session back out as '<subject>_<test>.csv',
+byte-identical to the file it was packed from. pack() checks this for every
+file and refuses to pack one that would not round-trip.
+
+    python -m argentometry.archive pack digitspan_data digitspan.archive
+    python -m argentometry.archive unpack digitspan.archive restored_data
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from argentometry.analysis import MISSING, X, guess_task, read_rows, session_files, sequence_matrix, parse_sequence
+from argentometry.schema import DIGITSPAN_DIRECTIONS, DIGITSPAN_FIELDS, SART_FIELDS, SART_NOTES, SART_PHASES, split_name
+
+ARCHIVE_VERSION = 1
+
+
+def render_csv(rows):
+    out = StringIO()
+    csv.writer(out, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL).writerows(rows)
+    return out.getvalue()
+
+
+def format_sequence(digits):
+    return '-'.join('x' if d == X else str(d) for d in digits if d != MISSING)
+
+
+# DigitSpan
+
+def digitspan_columns(sessions):
+    """Columns (in session order) for a list of per-session row lists."""
+    rows = [row for session in sessions for row in session]
+
+    keys = []
+    times = []
+    ks_count = []
+    for row in rows:
+        strokes = row[5].split(' ') if len(row) > 5 and row[5] else []
+        for stroke in strokes:
+            key, _, t = stroke.rpartition(':')
+            keys.append(key)
+            times.append(float(t))
+        ks_count.append(len(strokes))
+
+    key_names = sorted(set(keys))
+    key_codes = dict((key, i) for i, key in enumerate(key_names))
+    ks_count = numpy.array(ks_count, dtype=numpy.int16)
+
+    expected = [parse_sequence(row[2]) for row in rows]
+    actual = [parse_sequence(row[3]) for row in rows]
+    width = max([len(s) for s in expected + actual] or [0])
+    expected, expected_len = sequence_matrix(expected, width)
+    actual, actual_len = sequence_matrix(actual, width)
+    onsets = numpy.empty((len(rows), width), dtype=numpy.int64)
+    onsets.fill(MISSING)
+    for i, row in enumerate(rows):
+        if len(row) > 6 and row[6]:
+            values = [int(v) for v in row[6].split('-')]
+            onsets[i, :len(values)] = values
+
+    columns = {
+        'direction': numpy.array([DIGITSPAN_DIRECTIONS.index(row[0]) for row in rows], dtype=numpy.int8),
+        'trial': numpy.array([int(row[1]) for row in rows], dtype=numpy.int32),
+        'expected': expected,
+        'expected_len': expected_len,
+        'actual': actual,
+        'actual_len': actual_len,
+        'onsets': onsets,
+        'timestamp': numpy.array([float(row[4]) for row in rows], dtype=numpy.float64),
+        'ks_start': numpy.cumsum(ks_count, dtype=numpy.int64) - ks_count,
+        'ks_count': ks_count,
+    }
+    extra = {
+        'ks_key': numpy.array([key_codes[key] for key in keys], dtype=numpy.int16),
+        'ks_time': numpy.array(times, dtype=numpy.float64),
+        'key_names': numpy.array(key_names or [''], dtype='S'),
+    }
+    return columns, extra, ('direction', 'expected_len')
+
+
+def digitspan_rows(archive, rows, fields):
+    key_names = archive['key_names']
+    ks_key = archive['ks_key']
+    ks_time = archive['ks_time']
+
+    out = []
+    for i in rows:
+        row = [DIGITSPAN_DIRECTIONS[archive['direction'][i]],
+               int(archive['trial'][i]),
+               format_sequence(archive['expected'][i]),
+               format_sequence(archive['actual'][i]),
+               float(archive['timestamp'][i])]
+        if fields > 5:
+            start = archive['ks_start'][i]
+            stop = start + archive['ks_count'][i]
+            row.append(' '.join('{0}:{1:.4f}'.format(key_names[k], t)
+                                for k, t in zip(ks_key[start:stop], ks_time[start:stop])))
+        if fields > 6:
+            row.append('-'.join(str(v) for v in archive['onsets'][i] if v != MISSING))
+        out.append(row)
+    return out
+
+
+# SART
+
+def sart_columns(sessions):
+    rows = [row for session in sessions for row in session]
+    columns = {
+        'phase': numpy.array([SART_PHASES.index(row[0]) for row in rows], dtype=numpy.int8),
+        'target': numpy.array([int(row[1]) for row in rows], dtype=numpy.int8),
+        'digit': numpy.array([int(row[2]) for row in rows], dtype=numpy.int8),
+        'success': numpy.array([row[3] == 'True' for row in rows], dtype=bool),
+        'rt': numpy.array([float(row[4]) for row in rows], dtype=numpy.float64),
+        'note': numpy.array([SART_NOTES.index(row[5]) for row in rows], dtype=numpy.int8),
+        'mask_rt': numpy.array([float(row[6]) if len(row) > 6 and row[6] else numpy.nan for row in rows],
+                               dtype=numpy.float64),
+        'onset': numpy.array([float(row[7]) if len(row) > 9 else numpy.nan for row in rows],
+                             dtype=numpy.float64),
+        'mask_onset': numpy.array([float(row[8]) if len(row) > 9 else numpy.nan for row in rows],
+                                  dtype=numpy.float64),
+        'dropped': numpy.array([int(row[9]) if len(row) > 9 else 0 for row in rows], dtype=numpy.int32),
+    }
+    return columns, {}, ('phase', 'digit')
+
+
+def sart_rows(archive, rows, fields):
+    out = []
+    for i in rows:
+        row = [SART_PHASES[archive['phase'][i]],
+               int(archive['target'][i]),
+               int(archive['digit'][i]),
+               bool(archive['success'][i]),
+               float(archive['rt'][i]),
+               SART_NOTES[archive['note'][i]]]
+        if fields > 6:
+            row.append(float(archive['mask_rt'][i]))
+        if fields > 9:
+            row.extend([float(archive['onset'][i]), float(archive['mask_onset'][i]), int(archive['dropped'][i])])
+        out.append(row)
+    return out
+
+
+COLUMNS = {'digitspan': digitspan_columns, 'sart': sart_columns}
+ROWS = {'digitspan': digitspan_rows, 'sart': sart_rows}
+FIELDS = {'digitspan': DIGITSPAN_FIELDS, 'sart': SART_FIELDS}
+
+
+def pack(paths, archive_dir, task=None):
+    """Packs the session CSVs in `paths` (all from one task) into `archive_dir`."""
+    task = task or guess_task(paths) or 'digitspan'
+    sessions = [read_rows(path) for path in paths]
+    columns, extra, key = COLUMNS[task](sessions)
+
+    n = sum(len(s) for s in sessions)
+    counts = numpy.array([len(s) for s in sessions], dtype=numpy.int64)
+    columns['session'] = numpy.repeat(numpy.arange(len(sessions), dtype=numpy.int32), counts)
+
+    # sort trials by the grouping key; by_session maps session order -> row
+    order = numpy.lexsort((numpy.arange(n),) + tuple(columns[k] for k in reversed(key)))
+    by_session = numpy.empty(n, dtype=numpy.int64)
+    by_session[order] = numpy.arange(n)
+    trial_columns = sorted(columns)
+    for name in columns:
+        columns[name] = columns[name][order]
+
+    names = [split_name(path) for path in paths]
+    index = numpy.zeros(len(sessions), dtype=[
+        ('subject', 'S{0}'.format(max([len(s) for s, t in names] or [1]))),
+        ('test', 'S{0}'.format(max([len(t) for s, t in names] or [1]))),
+        ('fields', numpy.int8), ('start', numpy.int64), ('stop', numpy.int64)])
+    index['subject'] = [s for s, t in names]
+    index['test'] = [t for s, t in names]
+    index['fields'] = [max([len(row) for row in s] or [len(FIELDS[task])]) for s in sessions]
+    index['stop'] = numpy.cumsum(counts)
+    index['start'] = index['stop'] - counts
+
+    # group ranges over the sorted rows
+    keys = numpy.column_stack([columns[k] for k in key]).astype(numpy.int64).reshape(n, len(key))
+    boundaries = numpy.r_[0, numpy.flatnonzero((keys[1:] != keys[:-1]).any(axis=1)) + 1, n] if n else numpy.array([0])
+    groups = numpy.zeros(len(boundaries) - 1, dtype=[(k, numpy.int64) for k in key] +
+                         [('start', numpy.int64), ('stop', numpy.int64)])
+    for j, k in enumerate(key):
+        groups[k] = keys[boundaries[:-1], j]
+    groups['start'] = boundaries[:-1]
+    groups['stop'] = boundaries[1:]
+
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+    arrays = dict(columns, by_session=by_session, sessions=index, groups=groups, **extra)
+    for name, array in arrays.items():
+        numpy.save(os.path.join(archive_dir, name + '.npy'), array)
+    with open(os.path.join(archive_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': ARCHIVE_VERSION, 'task': task, 'key': list(key),
+                   'columns': sorted(arrays), 'trial_columns': trial_columns}, f)
+
+    # refuse to keep an archive that would not give the same files back
+    archive = Archive(archive_dir)
+    for i, path in enumerate(paths):
+        with open(path, 'rb') as f:
+            if archive.session_csv(i) != f.read():
+                raise ValueError("{0} does not round-trip through the archive".format(path))
+    return archive
+
+
+class Archive(object):
+    """A packed archive, opened read-only with every column memory-mapped."""
+
+    def __init__(self, archive_dir):
+        with open(os.path.join(archive_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != ARCHIVE_VERSION:
+            raise ValueError("unsupported archive version {0}".format(meta['version']))
+
+        self.task = meta['task']
+        self.key = meta['key']
+        self.trial_columns = meta['trial_columns']
+        self.columns = {}
+        for name in meta['columns']:
+            self.columns[name] = numpy.load(os.path.join(archive_dir, name + '.npy'), mmap_mode='r')
+        self.sessions = self.columns['sessions']
+        self.groups = self.columns['groups']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def group(self, *key):
+        """Every trial with the given key values, as zero-copy column views.
+
+        Key values are the grouping columns in order: for DigitSpan the
+        direction (name or code) and sequence length, for SART the phase
+        (name or code) and digit.
+        """
+        names = DIGITSPAN_DIRECTIONS if self.task == 'digitspan' else SART_PHASES
+        key = list(key)
+        if key and not isinstance(key[0], (int, numpy.integer)):
+            key[0] = names.index(key[0])
+
+        start = stop = 0
+        match = numpy.ones(len(self.groups), dtype=bool)
+        for name, value in zip(self.key, key):
+            match &= self.groups[name] == value
+        hits = numpy.flatnonzero(match)
+        if len(hits):
+            # groups are sorted, so matching groups are adjacent
+            start, stop = self.groups['start'][hits[0]], self.groups['stop'][hits[-1]]
+        return dict((name, self.columns[name][start:stop]) for name in self.trial_columns)
+
+    def session_rows(self, i):
+        """Row numbers of session i's trials, in their original order."""
+        s = self.sessions[i]
+        return self.columns['by_session'][s['start']:s['stop']]
+
+    def session_csv(self, i):
+        rows = ROWS[self.task](self.columns, self.session_rows(i), self.sessions['fields'][i])
+        return render_csv(rows)
+
+    def unpack(self, out_dir):
+        """Writes every session back out as '<subject>_<test>.csv'."""
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        for i, s in enumerate(self.sessions):
+            path = os.path.join(out_dir, '{0}_{1}.csv'.format(s['subject'], s['test']))
+            with open(path, 'wb') as f:
+                f.write(self.session_csv(i))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pack session CSVs into a columnar archive, or unpack one.')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('pack')
+    p.add_argument('data_dir')
+    p.add_argument('archive_dir')
+    p.add_argument('--task', choices=sorted(COLUMNS))
+    u = sub.add_parser('unpack')
+    u.add_argument('archive_dir')
+    u.add_argument('out_dir')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        pack(session_files(args.data_dir), args.archive_dir, args.task)
+    else:
+        Archive(args.archive_dir).unpack(args.out_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
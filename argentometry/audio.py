@@ -0,0 +1,163 @@
+"""Sample-accurate digit sequences for DigitSpan.
+
+Instead of playing one sound per digit and timing the gaps with core.wait,
+SequenceMixer lays a whole trial's digits out in a single PCM buffer with
+the gaps as exact runs of silent samples, so it plays as one sound. The
+interval between digits is then fixed by the sample rate alone, with no
+per-digit scheduling jitter or drift from audio latency, and the onset of
+each digit is known exactly (in samples from the start of the buffer).
+
+SoundBank holds the decoded digit clips of one voice ('<gender>_<digit>.wav')
+at one sample rate, keyed by the digit in each file name. The first time a
+voice is used at a rate its clips are decoded, resampled and cached on disk
+as .npy files; after that they are memory-mapped, so starting a task (or
+switching voices) needs no decoding.
+"""
+import hashlib
+import os
+import re
+import wave
+
+import numpy
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.argentometry', 'sounds')
+
+
+def read_wav(path):
+    """Returns (samples, rate): mono float32 samples in [-1, 1]."""
+    f = wave.open(path, 'rb')
+    try:
+        channels, width, rate, frames = f.getnchannels(), f.getsampwidth(), f.getframerate(), f.getnframes()
+        data = f.readframes(frames)
+    finally:
+        f.close()
+
+    if width == 1:
+        samples = (numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.float32) - 128) / 128
+    elif width in (2, 4):
+        dtype = numpy.int16 if width == 2 else numpy.int32
+        samples = numpy.frombuffer(data, dtype='<' + numpy.dtype(dtype).str[1:]).astype(numpy.float32)
+        samples /= -float(numpy.iinfo(dtype).min)
+    else:
+        raise ValueError("{0}: unsupported sample width {1}".format(path, width))
+    return samples.reshape(-1, channels).mean(axis=1), rate
+
+
+def resample(samples, rate, new_rate):
+    """Linear-interpolation resampling."""
+    if rate == new_rate or not len(samples):
+        return samples
+    n = int(round(len(samples) * float(new_rate) / rate))
+    t = numpy.arange(n) * (float(rate) / new_rate)
+    return numpy.interp(t, numpy.arange(len(samples)), samples).astype(numpy.float32)
+
+
+class SequenceMixer(object):
+    """Mixes digit sequences from per-digit clips, all at `rate`."""
+
+    def __init__(self, clips, rate):
+        self.clips = clips
+        self.rate = rate
+
+    def onsets(self, sequence, gap):
+        """Onset sample of each digit, with `gap` seconds of silence between
+        the end of one digit and the start of the next."""
+        silence = int(round(gap * self.rate))
+        lengths = numpy.array([len(self.clips[d]) for d in sequence], dtype=numpy.int64)
+        return numpy.r_[0, numpy.cumsum(lengths[:-1] + silence)].astype(numpy.int64)[:len(sequence)]
+
+    def mix(self, sequence, gap):
+        """Returns (buffer, onsets) for the sequence."""
+        onsets = self.onsets(sequence, gap)
+        size = onsets[-1] + len(self.clips[sequence[-1]]) if len(sequence) else 0
+        buffer = numpy.zeros(size, dtype=numpy.float32)
+        for digit, onset in zip(sequence, onsets):
+            clip = self.clips[digit]
+            buffer[onset:onset + len(clip)] = clip
+        return buffer, onsets
+
+
+class SoundBank(object):
+    """The ten digit clips of one voice, as float32 samples at `rate`."""
+
+    def __init__(self, sound_path, gender, rate, cache_dir=DEFAULT_CACHE_DIR):
+        self.sound_path = sound_path
+        self.gender = gender
+        self.rate = rate
+
+        pattern = re.compile(r'^{0}_(\d)\.wav$'.format(re.escape(gender)))
+        self.files = {}
+        for fn in sorted(os.listdir(sound_path)):
+            match = pattern.match(fn)
+            if match:
+                self.files[int(match.group(1))] = os.path.join(sound_path, fn)
+        missing = sorted(set(range(10)) - set(self.files))
+        if missing:
+            raise ValueError("no '{0}' sound for digit(s) {1} in {2}".format(
+                gender, ', '.join(str(d) for d in missing), sound_path))
+
+        self.clips = None
+        if cache_dir:
+            self.clips = self.load(cache_dir)
+        if self.clips is None:
+            self.clips = self.decode()
+            if cache_dir:
+                self.save(cache_dir)
+
+    def cache_name(self, cache_dir):
+        # sound directories are told apart by path, and stale caches by the
+        # size and mtime of every source file
+        where = hashlib.sha1(os.path.realpath(self.sound_path).encode('utf-8')).hexdigest()[:8]
+        return os.path.join(cache_dir, '{0}_{1}_{2}'.format(self.gender, self.rate, where))
+
+    def sources(self):
+        index = numpy.zeros(10, dtype=[('start', numpy.int64), ('stop', numpy.int64),
+                                       ('size', numpy.int64), ('mtime', numpy.float64)])
+        for digit, path in self.files.items():
+            st = os.stat(path)
+            index['size'][digit] = st.st_size
+            index['mtime'][digit] = st.st_mtime
+        return index
+
+    def decode(self):
+        clips = {}
+        for digit, path in self.files.items():
+            samples, rate = read_wav(path)
+            clips[digit] = resample(samples, rate, self.rate)
+        return clips
+
+    def load(self, cache_dir):
+        name = self.cache_name(cache_dir)
+        try:
+            index = numpy.load(name + '.index.npy')
+            pcm = numpy.load(name + '.pcm.npy', mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        current = self.sources()
+        if len(index) != 10 or (index['size'] != current['size']).any() or \
+                (index['mtime'] != current['mtime']).any():
+            return None
+        return dict((digit, pcm[index['start'][digit]:index['stop'][digit]]) for digit in range(10))
+
+    def save(self, cache_dir):
+        index = self.sources()
+        lengths = numpy.array([len(self.clips[d]) for d in range(10)], dtype=numpy.int64)
+        index['stop'] = numpy.cumsum(lengths)
+        index['start'] = index['stop'] - lengths
+        pcm = numpy.concatenate([self.clips[d] for d in range(10)]).astype(numpy.float32)
+
+        name = self.cache_name(cache_dir)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # written under temporary names and renamed, pcm first, so a
+            # reader never sees an index without its samples
+            for suffix, array in (('.pcm.npy', pcm), ('.index.npy', index)):
+                tmp = name + '.tmp' + suffix
+                numpy.save(tmp, array)
+                if os.path.exists(name + suffix):
+                    os.remove(name + suffix)
+                os.rename(tmp, name + suffix)
+        except (IOError, OSError):
+            # no writable cache; the clips just aren't cached
+            pass
@@ -0,0 +1,460 @@
+"""Display, audio and input backends for the tasks.
+
+A backend exposes the five PsychoPy modules the tasks use -- `visual`, `core`,
+`event`, `sound` and `gui` -- as attributes. PsychoPyBackend hands out the
+real modules. HeadlessBackend hands out stand-ins that draw nothing, play
+nothing and take their keystrokes and clicks from a SyntheticParticipant, so a
+full session can run on a machine with no display or sound card:
+
+    backend = HeadlessBackend(SyntheticParticipant(rt_mean=0.35, seed=1))
+    task = SART(backend=backend, subject_info=('SIM1', '1'), data_dir='sim')
+    task.run()
+
+The tasks tell the backend what the participant is being asked to respond to
+through cue(). The real backend ignores cues.
+
+PsychoPy is only imported when a task first uses one of its modules, so the
+rest of the package (analysis, schedules, simulation) never loads it. A task
+asks for `core` and `gui` before the subject dialog and for the display and
+audio modules after it. Those imports stay on the main thread: they load the
+windowing and audio libraries, which are not safe to initialize from another
+thread on macOS, and Python 2's import lock would serialize them anyway. Only
+pure Python and numpy work (such as decoding the DigitSpan sounds) is done in
+a Background thread while the dialog is up.
+"""
+import heapq
+import importlib
+import math
+import os
+import random
+import sys
+import threading
+import time
+import wave
+
+
+class Background(threading.Thread):
+    """Calls function(*args, **kwargs) in a daemon thread. result() waits for
+    it and returns what it returned, or raises what it raised."""
+
+    def __init__(self, function, *args, **kwargs):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.call = function, args, kwargs
+        self.value = self.error = None
+        self.start()
+
+    def run(self):
+        function, args, kwargs = self.call
+        try:
+            self.value = function(*args, **kwargs)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+
+class PsychoPyBackend(object):
+
+    MODULES = ('visual', 'core', 'event', 'gui', 'sound')
+    # whether the hardware is calibrated and its profile saved (hardware.py)
+    profiles = True
+
+    def __getattr__(self, name):
+        # psychopy.<name>, imported on first use
+        if name not in self.MODULES:
+            raise AttributeError(name)
+        module = importlib.import_module('psychopy.' + name)
+        setattr(self, name, module)
+        return module
+
+    def cue(self, kind, **info):
+        pass
+
+    def skip_frames(self, window, frames):
+        # a real display shows every frame, and input has to be polled after each
+        return 0
+
+
+class RealTimeSource(object):
+    """Wall-clock time for the headless backend."""
+
+    def now(self):
+        return time.time()
+
+    def sleep(self, secs):
+        if secs > 0:
+            time.sleep(secs)
+
+
+class VirtualTimeSource(object):
+    """Discrete-event virtual time for the headless backend.
+
+    Nothing ever actually waits. Every wait in the task -- core.wait, a flip
+    blocking until the next frame, waitKeys blocking until the participant's
+    next keypress -- is a sleep() until the time of that next event, and
+    sleep() simply jumps the clock there. A session then runs as fast as its
+    Python code does, and the times it logs are exactly the times it would have
+    logged in real time with the same participant.
+    """
+
+    def __init__(self, start=0.0):
+        self.t = start
+
+    def now(self):
+        return self.t
+
+    def sleep(self, secs):
+        if secs > 0:
+            self.t += secs
+
+
+class SyntheticParticipant(object):
+    """A stand-in participant for headless runs.
+
+    Responses are either drawn at random or taken from `script`:
+
+    - SART digits: click after a normally distributed RT (`rt_mean`, `rt_sd`,
+      never below `rt_min`). Withhold on the target digit except with
+      probability `commission_rate`; miss a non-target with probability
+      `omission_rate`.
+    - DigitSpan recall: type back every digit heard since the last recall, one
+      key every `keystroke_interval` seconds after the first RT. Sequences
+      longer than `span` are recalled wrong, and shorter ones with probability
+      `error_rate`.
+    - Instruction screens: press space or click (`device` is 'key' or
+      'mouse') after one RT.
+
+    A scripted participant takes the next entry of `script` for every digit or
+    recall cue instead: for a SART digit, an RT in seconds or None to withhold;
+    for a recall, the keys to type (e.g. '3x1' or [3, 'x', 1]).
+    """
+
+    def __init__(self, rt_mean=0.400, rt_sd=0.100, rt_min=0.100, omission_rate=0.02,
+                 commission_rate=0.30, span=7, error_rate=0.05, keystroke_interval=0.250,
+                 script=None, seed=None):
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.rt_min = rt_min
+        self.omission_rate = omission_rate
+        self.commission_rate = commission_rate
+        self.span = span
+        self.error_rate = error_rate
+        self.keystroke_interval = keystroke_interval
+        self.script = iter(script) if script is not None else None
+        self.random = random.Random(seed)
+        self.heard = []
+
+    def rt(self):
+        return max(self.rt_min, self.random.gauss(self.rt_mean, self.rt_sd))
+
+    def respond(self, kind, **info):
+        """Returns a list of (delay, device, name) responses to a cue."""
+        if kind == 'continue':
+            if info.get('device') == 'mouse':
+                return [(self.rt(), 'mouse', 0)]
+            return [(self.rt(), 'key', 'space')]
+
+        if kind == 'heard':
+            self.heard.append(info['digit'])
+            return []
+
+        if kind == 'digit':
+            if self.script is not None:
+                rt = next(self.script)
+            else:
+                p_click = self.commission_rate if info['digit'] == info['target'] \
+                    else 1 - self.omission_rate
+                rt = self.rt() if self.random.random() < p_click else None
+            return [] if rt is None else [(rt, 'mouse', 0)]
+
+        if kind == 'recall':
+            heard, self.heard = self.heard, []
+            if self.script is not None:
+                typed = list(next(self.script))
+            else:
+                typed = list(reversed(heard)) if info.get('reverse') else list(heard)
+                if typed and (len(typed) > self.span or self.random.random() < self.error_rate):
+                    i = self.random.randrange(len(typed))
+                    typed[i] = self.random.choice([d for d in range(10) if d != typed[i]] + ['x'])
+
+            responses = []
+            t = self.rt()
+            for key in typed + ['return']:
+                responses.append((t, 'key', str(key)))
+                t += self.keystroke_interval
+            return responses
+
+        return []
+
+
+class HeadlessBackend(object):
+    """No-op rendering, silent audio and synthetic input.
+
+    `participant` answers the cues (see SyntheticParticipant), `subject_info`
+    is what the subject dialog returns, `overwrite` is the answer to the
+    "log file exists" dialog and `refresh_rate` sets the simulated frame rate.
+    Time is virtual unless a RealTimeSource is passed as `time_source`.
+    """
+
+    # nothing real to calibrate, and a station's profile mustn't be
+    # overwritten by a simulated run
+    profiles = False
+
+    def __init__(self, participant=None, subject_info=('SIM', '1'), overwrite=True,
+                 refresh_rate=60.0, time_source=None):
+        self.participant = participant or SyntheticParticipant()
+        self.subject_info = subject_info
+        self.overwrite = overwrite
+        self.frame_interval = 1.0 / refresh_rate
+        self.time = time_source or VirtualTimeSource()
+
+        self.keys = []  # (time, key) on their way to the key buffer
+        self.key_buffer = []  # (key, time) arrived but not read by getKeys yet
+        self.clicks = []  # (time, button) waiting to be read by a Mouse
+
+        self.visual = _Namespace(Window=lambda *args, **kwargs: HeadlessWindow(self, *args, **kwargs),
+                                 TextStim=HeadlessStim, Circle=HeadlessStim)
+        self.core = _Namespace(Clock=lambda: HeadlessClock(self.time),
+                               wait=lambda secs, hogCPUperiod=0.2: self.time.sleep(secs),
+                               getTime=self.time.now,
+                               quit=lambda: sys.exit(0))
+        self.event = _Namespace(getKeys=self.getKeys, waitKeys=self.waitKeys,
+                                clearEvents=self.clearEvents,
+                                Mouse=lambda *args, **kwargs: HeadlessMouse(self))
+        self.sound = _Namespace(init=lambda rate=48000, buffer=128: None,
+                                Sound=lambda *args, **kwargs: HeadlessSound(self, *args, **kwargs))
+        self.gui = _Namespace(Dlg=lambda *args, **kwargs: HeadlessDlg(self.overwrite),
+                              DlgFromDict=lambda *args, **kwargs: HeadlessDlg(True, list(self.subject_info)))
+
+    def cue(self, kind, **info):
+        now = self.time.now()
+        for delay, device, name in self.participant.respond(kind, **info):
+            if device == 'key':
+                heapq.heappush(self.keys, (now + delay, name))
+            else:
+                heapq.heappush(self.clicks, (now + delay, name))
+
+    def skip_frames(self, window, frames):
+        """Flips up to `frames` frames at once, all on time, and returns how
+        many. A task polls for input after every flip, so this stops short of
+        the first flip after which there is input to find; nothing is skipped
+        while a callOnFlip() is pending."""
+        if window.on_flip:
+            return 0
+        pending = [queue[0][0] for queue in (self.keys, self.clicks) if queue]
+        if pending:
+            frames = min(frames, max(0, int(math.ceil((min(pending) - window.last_flip) / self.frame_interval - 1e-9))))
+        if frames > 0:
+            last_flip = window.last_flip + self.frame_interval * frames
+            self.time.sleep(last_flip - self.time.now())
+            window.last_flip = last_flip
+        return max(0, frames)
+
+    def arrived(self, queue):
+        now = self.time.now()
+        events = []
+        while queue and queue[0][0] <= now:
+            events.append(heapq.heappop(queue))
+        return events
+
+    def getKeys(self, keyList=None, timeStamped=False):
+        for t, key in self.arrived(self.keys):
+            self.key_buffer.append((key, t))
+
+        targets = [k for k in self.key_buffer if keyList is None or k[0] in keyList]
+        self.key_buffer = [k for k in self.key_buffer if k not in targets]
+
+        if timeStamped is True:
+            return targets
+        if timeStamped:
+            return [(key, t - timeStamped.getLastResetTime()) for key, t in targets]
+        return [key for key, t in targets]
+
+    def waitKeys(self, maxWait=float('inf'), keyList=None, timeStamped=False):
+        # the participant reads the screen and presses a key
+        self.cue('continue', device='key')
+        while True:
+            keys = self.getKeys(keyList=keyList, timeStamped=timeStamped)
+            if keys:
+                return keys
+            if not self.keys:
+                return None
+            self.time.sleep(self.keys[0][0] - self.time.now())
+
+    def clearEvents(self, eventType=None):
+        if eventType in (None, 'keyboard'):
+            self.arrived(self.keys)
+            self.key_buffer = []
+        if eventType in (None, 'mouse'):
+            self.arrived(self.clicks)
+
+
+class HeadlessClock(object):
+
+    def __init__(self, time_source):
+        self.time = time_source
+        self.last_reset = time_source.now()
+
+    def getTime(self):
+        return self.time.now() - self.last_reset
+
+    def getLastResetTime(self):
+        return self.last_reset
+
+    def reset(self, newT=0.0):
+        self.last_reset = self.time.now() + newT
+
+
+class HeadlessWindow(object):
+
+    def __init__(self, backend, size=(800, 600), **kwargs):
+        self.backend = backend
+        self.size = size
+        self.on_flip = []
+        self.last_flip = backend.time.now()
+
+    def flip(self, clearBuffer=True):
+        # block until the next (simulated) vertical blank, like a real flip
+        frame = self.backend.frame_interval
+        now = self.backend.time.now()
+        frames = max(1, int(math.ceil((now - self.last_flip) / frame - 1e-9)))
+        next_flip = self.last_flip + frame * frames
+        self.backend.time.sleep(next_flip - now)
+        self.last_flip = next_flip
+
+        callbacks, self.on_flip = self.on_flip, []
+        for function, args, kwargs in callbacks:
+            function(*args, **kwargs)
+        return next_flip
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.on_flip.append((function, args, kwargs))
+
+    def clearBuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HeadlessStim(object):
+
+    def __init__(self, win, text='', **kwargs):
+        self.win = win
+        self.text = text
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        pass
+
+    def setAutoDraw(self, value):
+        self.autoDraw = value
+
+    def setText(self, text):
+        self.text = text
+
+    def setHeight(self, height):
+        self.height = height
+
+
+class HeadlessMouse(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.clock = HeadlessClock(backend.time)
+        self.buttons = [0, 0, 0]
+        self.times = [0.0, 0.0, 0.0]
+
+    def getPressed(self, getTime=False):
+        for t, button in self.backend.arrived(self.backend.clicks):
+            self.buttons[button] = 1
+            self.times[button] = t - self.clock.last_reset
+        if getTime:
+            return list(self.buttons), list(self.times)
+        return list(self.buttons)
+
+    def clickReset(self, buttons=(0, 1, 2)):
+        self.clock.reset()
+        for b in buttons:
+            self.buttons[b] = 0
+            self.times[b] = 0.0
+
+    def getPos(self):
+        return (0, 0)
+
+
+class HeadlessSound(object):
+
+    def __init__(self, backend, value='C', secs=0.5, **kwargs):
+        self.backend = backend
+        self.value = value
+        self.secs = secs
+
+        if isinstance(value, str):
+            if os.path.isfile(value):
+                f = wave.open(value)
+                self.secs = f.getnframes() / float(f.getframerate())
+                f.close()
+        elif hasattr(value, '__len__'):
+            # a buffer of samples
+            self.secs = len(value) / float(kwargs.get('sampleRate', 44100))
+
+    def play(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def getDuration(self):
+        return self.secs
+
+
+class HeadlessDlg(object):
+
+    def __init__(self, ok, data=None):
+        self.OK = ok
+        self.data = data
+
+    def addText(self, text):
+        pass
+
+    def addField(self, label, initial=''):
+        pass
+
+    def show(self):
+        return self.data
+
+
+class _Namespace(object):
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def run_headless(task_class, sessions, participant=None, seed=0, **kwargs):
+    """Run `sessions` complete sessions of `task_class` headlessly.
+
+    `participant(i)` builds the SyntheticParticipant for session i (by default
+    an unscripted one seeded with seed + i). Session i is subject 'SIM<i>', so
+    its schedule (see schedule.py) is the same on every run and, with the
+    default virtual clock, so is its log, byte for byte. The remaining keyword
+    arguments go to the task. No hardware profile is used (or written), and
+    unless `sound_cache_dir` is given no sound cache either. Returns the paths
+    of the log files written.
+    """
+    if participant is None:
+        participant = lambda i: SyntheticParticipant(seed=seed + i)
+    kwargs.setdefault('sound_cache_dir', None)
+
+    logs = []
+    for i in range(sessions):
+        backend = HeadlessBackend(participant(i))
+        task = task_class(backend=backend, subject_info=('SIM{0}'.format(i), '1'), **kwargs)
+        task.run()
+        logs.append(task.log_file)
+    return logs
@@ -0,0 +1,106 @@
+"""Several tasks in one process.
+
+Running each task as its own script means importing PsychoPy, starting the
+audio backend, opening a window and asking for the subject all over again
+between tasks. A Battery does those once and hands the results to every task
+it runs:
+
+    battery = Battery(['digitspan', ('sart', {'data_dir': 'sart_data'})],
+                      monitor_resolution=(1600, 900), fullscreen=True)
+    battery.run()
+
+Each entry is a task name (see TASKS), a task class, or a (task, kwargs)
+pair; keyword arguments given to the Battery itself go to every task. Tasks
+also share a dict of resources, so the digit sounds and stimuli built by one
+session are reused by the next one that asks for the same thing.
+
+If the participant quits a task (q), the battery stops after saving it.
+"""
+import importlib
+import sys
+
+from argentometry.backends import PsychoPyBackend
+from argentometry.errors import TaskAborted
+from argentometry import hardware
+
+TASKS = {
+    'digitspan': 'argentometry.digitspan.DigitSpan',
+    'sart': 'argentometry.sart.SART',
+}
+
+
+def task_class(task):
+    if not isinstance(task, basestring):
+        return task
+    module, _, name = TASKS.get(task, task).rpartition('.')
+    return getattr(importlib.import_module(module), name)
+
+
+class Battery(object):
+
+    def __init__(self, tasks, **kwargs):
+        self.tasks = []
+        for task in tasks:
+            task, task_kwargs = task if isinstance(task, tuple) else (task, {})
+            self.tasks.append((task_class(task), task_kwargs))
+        self.kwargs = kwargs
+
+        self.backend = kwargs.get('backend') or PsychoPyBackend()
+        self.core = self.backend.core
+        self.gui = self.backend.gui
+        self.MONITOR = kwargs.get('monitor', 'testMonitor')
+        self.MONITOR_RESOLUTION = kwargs.get('monitor_resolution', (1024, 768))
+        self.FULLSCREEN = kwargs.get('fullscreen', True)
+        self.SOUND_INIT_SAMPLES = kwargs.get('sound_init_samples', None)
+        self.SOUND_BUFFER = kwargs.get('sound_buffer', None)
+
+        # asked for once, for every task
+        self.subject_info = self.get_subject_info(kwargs.get('subject_info', None) or sys.argv[1:])
+        self.visual = self.backend.visual
+        self.event = self.backend.event
+        self.sound = self.backend.sound
+
+        # audio has to be started before the window is created
+        self.calibration = hardware.calibration(
+            self.backend, self.MONITOR, self.MONITOR_RESOLUTION, self.FULLSCREEN,
+            kwargs.get('hardware_profile_dir', hardware.PROFILE_DIR), kwargs.get('recalibrate', False))
+        self.calibration.init_sound(self.sound, self.SOUND_INIT_SAMPLES, self.SOUND_BUFFER)
+
+        self.window = self.visual.Window(
+            self.MONITOR_RESOLUTION, monitor=self.MONITOR, units='deg', fullscr=self.FULLSCREEN)
+        self.mouse = self.event.Mouse(win=self.window)
+        self.calibration.measure_display(self.window, self.core)
+
+        # (task, name, ...) -> whatever a task built and is willing to share
+        self.resources = {}
+
+    def get_subject_info(self, args=()):
+        if len(args) == 0:
+            dialog = self.gui.DlgFromDict(
+                dictionary={'Subject ID': '', 'Test Number': '1'},
+                title='Test Battery')
+            if not dialog.OK:
+                sys.exit(1)
+            return dialog.data[0].upper(), dialog.data[1]
+        elif len(args) == 2:
+            return args[0].upper(), args[1]
+        else:
+            print "Usage: battery.py [subject_id] [subject_test_number]"
+            sys.exit(1)
+
+    def run(self):
+        """Runs the tasks in order. Returns the tasks that were run and
+        whether the last one was completed."""
+        results = []
+        completed = True
+        for cls, task_kwargs in self.tasks:
+            kwargs = dict(self.kwargs, **task_kwargs)
+            kwargs.update(backend=self.backend, subject_info=self.subject_info, window=self.window,
+                          mouse=self.mouse, calibration=self.calibration, resources=self.resources)
+            task = cls(**kwargs)
+            completed = task.run()
+            results.append(task)
+            if not completed:
+                break
+        self.window.close()
+        return results, completed
@@ -0,0 +1,92 @@
+"""Mid-session checkpoints.
+
+After every trial a task passes where it is to a CheckpointWriter: its phase,
+block and trial, the state of the staircase, and the log rows that haven't
+been synced to disk yet. A background thread writes the latest state to
+'<subject>_<test>.checkpoint.json' (to a temporary file, which is then
+renamed), so a trial never waits on the write. The file is removed when the
+session ends or the participant quits.
+
+If the task is killed, relaunching it with the same subject ID and test
+number offers to resume. recover() rebuilds the log from the rows the
+partial log had synced plus the unsynced rows saved in the checkpoint. The
+task then continues with the trial after the last one logged.
+"""
+import csv
+import json
+import os
+import threading
+
+
+def checkpoint_path(log_file):
+    return os.path.splitext(log_file)[0] + '.checkpoint.json'
+
+
+def write(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+def load(path):
+    """The saved state, or None if there is none (or it can't be read)."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def recover(log_file, state):
+    """The rows the interrupted session had logged, up to its checkpoint."""
+    rows = []
+    for path in (log_file + '.partial', log_file):
+        if os.path.isfile(path):
+            with open(path) as f:
+                rows = [row for row in csv.reader(f) if row]
+            break
+    # the log may have been synced after the checkpoint was written; the rows
+    # past it belong to a trial that will be run again
+    return rows[:state['synced']] + state['pending']
+
+
+class CheckpointWriter(threading.Thread):
+    """Writes the latest state passed to update() in the background."""
+
+    def __init__(self, path):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.latest = None
+        self.changed = threading.Event()
+        self.stopped = False
+        self.start()
+
+    def update(self, state, log):
+        # only a reference swap on this thread; run() serializes it
+        self.latest = dict(state, synced=log.rows - len(log.pending), pending=list(log.pending))
+        self.changed.set()
+
+    def run(self):
+        while not self.stopped:
+            self.changed.wait()
+            self.changed.clear()
+            state = self.latest
+            if state is not None and not self.stopped:
+                try:
+                    write(self.path, state)
+                except (IOError, OSError):
+                    # no checkpoint this time; the log itself is unaffected
+                    pass
+
+    def close(self):
+        """Stops writing and removes the checkpoint: nothing to resume."""
+        self.stopped = True
+        self.changed.set()
+        self.join()
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
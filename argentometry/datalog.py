@@ -0,0 +1,75 @@
+import csv
+import os
+import time
+
+
+class TrialLog(object):
+    """Append-only, crash-safe trial log.
+
+    Rows are appended to '<log_file>.partial' as trials complete. append() only
+    queues the row in memory; the rows are written and fsync'd by sync(), which
+    the task calls at points where no trial is being timed (between trials, at
+    the end of a block). maybe_sync() does the same, but only once `sync_rows`
+    rows are queued or `sync_interval` seconds have passed since the last sync;
+    with neither set it never syncs and only block boundaries do.
+
+    close() syncs what is left and renames the partial file to `path`, which
+    then has exactly the usual CSV layout. If the task dies before that, the
+    partial file holds every row up to the last sync. Only the rows queued
+    since the last sync are ever held in memory.
+
+    `rows` are written first, e.g. those recovered from an interrupted session
+    (see checkpoint.py).
+    """
+
+    def __init__(self, path, sync_rows=None, sync_interval=None, rows=()):
+        self.path = path
+        self.partial_path = path + '.partial'
+        self.sync_rows = sync_rows
+        self.sync_interval = sync_interval
+
+        self.pending = []
+        self.rows = 0
+        self.file = open(self.partial_path, 'w')
+        self.writer = csv.writer(self.file, delimiter=',',
+                                 quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.last_sync = time.time()
+        if rows:
+            self.pending = list(rows)
+            self.rows = len(rows)
+            self.sync()
+
+    def append(self, row):
+        self.pending.append(row)
+        self.rows += 1
+
+    def due(self):
+        if not self.pending:
+            return False
+        if self.sync_rows is not None and len(self.pending) >= self.sync_rows:
+            return True
+        if self.sync_interval is not None and time.time() - self.last_sync >= self.sync_interval:
+            return True
+        return False
+
+    def maybe_sync(self):
+        if self.due():
+            self.sync()
+
+    def sync(self):
+        self.writer.writerows(self.pending)
+        self.pending = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.time()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
+
+        # reconcile: the partial file becomes <subject>_<test>.csv
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.partial_path, self.path)
@@ -1,24 +1,68 @@
-from psychopy import visual, core, event, gui, sound
-from datetime import datetime
-import random
-import numpy
 import sys
 import os
-import csv
-from collections import defaultdict
 import json
-from pprint import pprint
+from argentometry.adaptive import SpanEstimator
+from argentometry.audio import DEFAULT_CACHE_DIR, SequenceMixer, SoundBank
+from argentometry.backends import Background, PsychoPyBackend
+from argentometry.errors import TaskAborted
+from argentometry import checkpoint
+from argentometry.checkpoint import CheckpointWriter
+from argentometry.datalog import TrialLog
+from argentometry.monitor import Publisher, SessionStats
+from argentometry import hardware
+from argentometry.index import SessionIndex
+from argentometry import schedule
+from argentometry.schema import DIGITSPAN_DIRECTIONS
+from argentometry.trace import NullTracer, Tracer
+
+
+def pools_used(block, pools):
+    # how many sequences of each length have been taken from a block's pools
+    return dict((length, len(pool) - len(pools[int(length)])) for length, pool in block['random'].items())
 
 
 class DigitSpan(object):
 
     def __init__(self, **kwargs):
+        # display, audio and input all go through the backend (see backends.py)
+        self.backend = kwargs.get('backend') or PsychoPyBackend()
+        # the subject dialog only needs these; the display and audio modules are
+        # imported after it, on this thread (see backends.py)
+        self.core = self.backend.core
+        self.gui = self.backend.gui
+        # (subject_id, test_number); asked for in a dialog if not given
+        self.SUBJECT_INFO = kwargs.get('subject_info', None)
+        # record a timing trace, written next to the log (see trace.py)
+        self.TRACE = kwargs.get('trace', False)
+        self.TRACE_CAPACITY = kwargs.get('trace_capacity', 200000)
+        # shared by the tasks of a battery (see battery.py): an open window and
+        # its mouse, a Calibration whose audio is already started, and a dict
+        # of reusable resources (decoded sounds, stimuli)
+        self.shared_window = kwargs.get('window', None)
+        self.shared_mouse = kwargs.get('mouse', None)
+        self.shared_calibration = kwargs.get('calibration', None)
+        self.resources = kwargs.get('resources', {})
+        # 'host:port' to send live statistics to (see monitor.py), or None
+        self.MONITOR_ADDRESS = kwargs.get('monitor_address', None)
+        self.MONITOR_INTERVAL = kwargs.get('monitor_interval', 1.0)
+        self.tracer = Tracer(self.core.Clock().getTime, self.TRACE_CAPACITY) if self.TRACE else NullTracer()
+
         self.DATA_DIR = kwargs.get('data_dir', 'digitspan_data')
         self.MONITOR = kwargs.get('monitor', 'testMonitor')
         self.MONITOR_RESOLUTION = kwargs.get('monitor_resolution', (1024, 768))
         self.SOUND_GENDER = kwargs.get('sound_gender', 'female')
         self.SOUND_PATH = kwargs.get('sound_path', os.path.join(os.path.dirname(os.path.realpath(__file__)), 'sounds'))
-        self.SOUND_INIT_SAMPLES = kwargs.get('sound_init_samples', 48000)
+        # None: from this machine's hardware profile (see hardware.py)
+        self.SOUND_INIT_SAMPLES = kwargs.get('sound_init_samples', None)
+        self.SOUND_BUFFER = kwargs.get('sound_buffer', None)
+        # None: no profile; audio defaults and durations as given
+        self.HARDWARE_PROFILE_DIR = kwargs.get('hardware_profile_dir', hardware.PROFILE_DIR)
+        self.RECALIBRATE = kwargs.get('recalibrate', False)
+        # None: decode the sounds on every launch
+        self.SOUND_CACHE_DIR = kwargs.get('sound_cache_dir', DEFAULT_CACHE_DIR)
+        # play each trial's digits as one pre-mixed sound, with the gaps timed
+        # in samples (see audio.py), and log each digit's onset sample
+        self.GAPLESS_AUDIO = kwargs.get('gapless_audio', False)
         self.N_PRACTICE_TRIALS = kwargs.get('practice_trials', 2)
         self.LEN_PRACTICE_TRIAL = kwargs.get('practice_trial_len', 3)
         self.DIGIT_DISPLAY_TIME = kwargs.get('digit_display_time', 0.500)
@@ -37,7 +81,38 @@ class DigitSpan(object):
             }
         }
         self.MAX_TRIALS_WRONG = kwargs.get('max_wrong_trials', 2)
+        # 'standard' walks the preset sequences and then random ones up to the
+        # max; 'adaptive' places each sequence length to estimate span in as
+        # few trials as possible (see adaptive.py)
+        self.PROCEDURE = kwargs.get('procedure', 'standard')
+        self.ADAPTIVE_MIN_TRIALS = kwargs.get('adaptive_min_trials', 4)
+        self.ADAPTIVE_MAX_TRIALS = kwargs.get('adaptive_max_trials', 14)
+        self.ADAPTIVE_STOP_SD = kwargs.get('adaptive_stop_sd', 0.6)
+        self.ADAPTIVE_PRIOR = kwargs.get('adaptive_prior', {'forward': 6.0, 'reverse': 4.5})
+        # every sequence is drawn up front from a schedule seeded by subject and
+        # test number (see schedule.py), or read from schedule_file if given
+        self.SCHEDULE_FILE = kwargs.get('schedule_file', None)
+        self.SCHEDULE_SEED = kwargs.get('schedule_seed', None)
+        self.SEQUENCE_NO_REPEATS = kwargs.get('sequence_no_repeats', False)
+        # whether to resume an interrupted session (see checkpoint.py); None: ask
+        self.RESUME = kwargs.get('resume', None)
         self.FULLSCREEN = kwargs.get('fullscreen', True)
+        # the log is fsync'd in the gap after every N trials and at the end of
+        # each block (see datalog.py)
+        self.LOG_SYNC_ROWS = kwargs.get('log_sync_rows', 1)
+        self.LOG_SYNC_INTERVAL = kwargs.get('log_sync_interval', None)
+
+        # the hardware profile is read before the subject dialog goes up
+        self.calibration = self.shared_calibration or hardware.calibration(
+            self.backend, self.MONITOR, self.MONITOR_RESOLUTION, self.FULLSCREEN,
+            self.HARDWARE_PROFILE_DIR, self.RECALIBRATE)
+        # and the digit sounds are decoded while it is up, if the sample rate
+        # is already known
+        self.sound_bank_loader = None
+        rate = self.calibration.expected_rate(self.SOUND_INIT_SAMPLES)
+        if rate and ('digitspan.sounds', self.SOUND_PATH, self.SOUND_GENDER, rate) not in self.resources:
+            self.sound_bank_loader = Background(
+                SoundBank, self.SOUND_PATH, self.SOUND_GENDER, rate, self.SOUND_CACHE_DIR)
 
         if not os.path.isdir(self.DATA_DIR):
             try:
@@ -47,146 +122,276 @@ class DigitSpan(object):
                 print "Error: cannot create data directory: " + self.DATA_DIR
                 sys.exit(1)
 
-        while True:
-            # tuple of form: (subject_id, test_number)
-            subject_info = self.get_subject_info(sys.argv[1:])
-            self.log_file = os.path.join(
-                self.DATA_DIR, '_'.join(subject_info) + '.csv')
-
-            if os.path.isfile(self.log_file):
-                rename_dialog = gui.Dlg(title='Error: Log File Exists')
-                rename_dialog.addText("A log file with the subject ID " + subject_info[0] +
-                                      " and test number " + subject_info[1] + " already exists. Overwrite?")
-                rename_dialog.show()
-
-                if rename_dialog.OK:
-                    self.log_file = open(self.log_file, "w")
-                    break
-                else:
-                    # not exactly necessary but w/e
-                    continue
-            else:
-                self.log_file = open(self.log_file, "w")
-                break
-
-        # now log_file is a proper file
-        self.data = []
+        # sessions already recorded in the data directory (see index.py)
+        self.index = SessionIndex(self.DATA_DIR)
+
+        # then, collect the subject's ID and test number. An interrupted session
+        # can be resumed; otherwise, if the session already exists, either
+        # overwrite it or move on to the next free test number
+        # tuple of form: (subject_id, test_number)
+        subject_info = self.get_subject_info(self.SUBJECT_INFO or sys.argv[1:])
+        self.resume = self.offer_resume(subject_info)
+        if self.resume is None and self.index.exists(*subject_info):
+            next_test = self.index.next_test(subject_info[0])
+            rename_dialog = self.gui.Dlg(title='Error: Log File Exists')
+            rename_dialog.addText("A log file with the subject ID " + subject_info[0] +
+                                  " and test number " + subject_info[1] + " already exists. Overwrite?\n\n" +
+                                  "Cancel to use the next free test number, " + str(next_test) + ", instead.")
+            rename_dialog.show()
+
+            if not rename_dialog.OK:
+                subject_info = subject_info[0], str(next_test)
+        self.subject_info = subject_info
+        self.log_file = os.path.join(
+            self.DATA_DIR, '_'.join(subject_info) + '.csv')
+
+        self.visual = self.backend.visual
+        self.event = self.backend.event
+        self.sound = self.backend.sound
+
+        with self.tracer.span('schedule', 'startup'):
+            self.schedule = self.make_schedule(subject_info)
+
+        # rows are streamed to <log_file>.partial, which becomes log_file in quit()
+        self.log = TrialLog(self.log_file, sync_rows=self.LOG_SYNC_ROWS,
+                            sync_interval=self.LOG_SYNC_INTERVAL,
+                            rows=checkpoint.recover(self.log_file, self.resume) if self.resume else ())
+        self.index.start(subject_info[0], subject_info[1], 'digitspan')
+        # where the session is, saved after every trial from a background thread
+        self.checkpoint = CheckpointWriter(checkpoint.checkpoint_path(self.log_file))
+
+        # running statistics, updated as trials are logged and published from
+        # a background thread
+        self.stats = SessionStats('digitspan', *subject_info)
+        self.publisher = None
+        if self.MONITOR_ADDRESS:
+            self.publisher = Publisher(self.stats, self.MONITOR_ADDRESS, self.MONITOR_INTERVAL)
+            self.publisher.start()
 
         # this should load Pyo. However, it may require manually symlinking in
         # the newest liblo.
-        sound.init(self.SOUND_INIT_SAMPLES, buffer=128)
-
-        self.sound_correct = sound.Sound(value=440, secs=0.4)
-        self.sound_incorrect = sound.Sound(value=330, secs=0.4)
-        self.sound_files = [sound.Sound(value=os.path.join(self.SOUND_PATH, fn)) for fn in os.listdir(self.SOUND_PATH)
-                            if fn.startswith(self.SOUND_GENDER) and fn.endswith('.wav')]
-
-        # this is a bad way of doing this. Should load from a file.
-        self.sequences = {
-            'forward':  [(9, 7),
-                         (6, 3),
-                         (5, 8, 2),
-                         (6, 9, 4),
-                         (7, 2, 8, 6),
-                         (6, 4, 3, 9),
-                         (4, 2, 7, 3, 1),
-                         (7, 5, 8, 3, 6),
-                         (3, 9, 2, 4, 8, 7),
-                         (6, 1, 9, 4, 7, 3),
-                         (4, 1, 7, 9, 3, 8, 6),
-                         (6, 9, 1, 7, 4, 2, 8),
-                         (3, 8, 2, 9, 6, 1, 7, 4),
-                         (5, 8, 1, 3, 2, 6, 4, 7),
-                         (2, 7, 5, 8, 6, 3, 1, 9, 4),
-                         (7, 1, 3, 9, 4, 2, 5, 6, 8)],
-            'reverse':  [(3, 1),
-                         (2, 4),
-                         (4, 6),
-                         (5, 7),
-                         (6, 2, 9),
-                         (4, 7, 5),
-                         (8, 2, 7, 9),
-                         (4, 9, 6, 8),
-                         (6, 5, 8, 4, 3),
-                         (1, 5, 4, 8, 6),
-                         (5, 3, 7, 4, 1, 8),
-                         (7, 2, 4, 8, 5, 6),
-                         (8, 1, 4, 9, 3, 6, 2),
-                         (4, 7, 3, 9, 6, 2, 8),
-                         (9, 4, 3, 7, 6, 2, 1, 8),
-                         (7, 2, 8, 1, 5, 6, 4, 3)]
-        }
+        # audio settings and the refresh interval come from this machine's
+        # hardware profile, which is calibrated on first launch
+        with self.tracer.span('sound.init', 'startup'):
+            self.SOUND_INIT_SAMPLES, self.SOUND_BUFFER = self.calibration.init_sound(
+                self.sound, self.SOUND_INIT_SAMPLES, self.SOUND_BUFFER)
+
+        with self.tracer.span('sounds', 'startup'):
+            self.sound_correct = self.sound.Sound(value=440, secs=0.4)
+            self.sound_incorrect = self.sound.Sound(value=330, secs=0.4)
+            # decoded digit clips, keyed by the digit in each file name and cached
+            # on disk (see audio.py); a battery keeps them for its next session
+            key = ('digitspan.sounds', self.SOUND_PATH, self.SOUND_GENDER, self.SOUND_INIT_SAMPLES)
+            if key not in self.resources:
+                bank = self.sound_bank_loader.result() if self.sound_bank_loader else None
+                if bank is None or bank.rate != self.SOUND_INIT_SAMPLES:
+                    bank = SoundBank(self.SOUND_PATH, self.SOUND_GENDER, self.SOUND_INIT_SAMPLES,
+                                     self.SOUND_CACHE_DIR)
+                self.resources[key] = bank, [self.sound.Sound(value=bank.clips[digit], sampleRate=bank.rate)
+                                             for digit in range(10)]
+            self.sound_bank, self.sound_files = self.resources[key]
+            if self.GAPLESS_AUDIO:
+                self.mixer = SequenceMixer(self.sound_bank.clips, self.sound_bank.rate)
+
+        # direction -> (estimate, sd) for each adaptive block
+        self.span_estimates = self.resume['span_estimates'] if self.resume else {'forward': [], 'reverse': []}
 
         # after this line executes, the window is showing.
-        self.window = visual.Window(
-            self.MONITOR_RESOLUTION, monitor=self.MONITOR, units='deg', fullscr=self.FULLSCREEN)
-        self.mouse = event.Mouse(win=self.window)
+        with self.tracer.span('window', 'startup'):
+            if self.shared_window is not None:
+                self.window = self.shared_window
+                self.window.units = 'deg'
+                self.mouse = self.shared_mouse or self.event.Mouse(win=self.window)
+            else:
+                self.window = self.visual.Window(
+                    self.MONITOR_RESOLUTION, monitor=self.MONITOR, units='deg', fullscr=self.FULLSCREEN)
+                self.mouse = self.event.Mouse(win=self.window)
+
+            # measured on first launch; durations are then whole frames
+            self.hardware = self.calibration.measure_display(self.window, self.core)
+            if self.hardware is not None:
+                self.DIGIT_DISPLAY_TIME = self.hardware.quantize(self.DIGIT_DISPLAY_TIME)
+                self.DIGIT_DISPLAY_GAP = self.hardware.quantize(self.DIGIT_DISPLAY_GAP)
+                self.INTER_TRIAL_DELAY = self.hardware.quantize(self.INTER_TRIAL_DELAY)
+
+        # key -> action table for accept_sequence. An action is either a digit
+        # or one of 'x', 'delete', 'enter' and 'quit'.
+        self.key_actions = {'q': 'quit', 'escape': 'quit',
+                            'backspace': 'delete', 'delete': 'delete', '[.]': 'delete',
+                            'period': 'delete', '.': 'delete',
+                            'num_enter': 'enter', 'return': 'enter',
+                            'x': 'x'}
+        for i in range(10):  # nums 0..9, on both the main row and the keypad
+            for key in "{0},num_{0},[{0}]".format(i).split(','):
+                self.key_actions[key] = i
+        self.key_list = list(self.key_actions)
+
+        # the instructions and one glyph per digit slot are created once and
+        # reused, instead of building a TextStim for every keypress
+        with self.tracer.span('stimuli', 'startup'):
+            self.input_instructions = {}
+            for reverse in (False, True):
+                self.input_instructions[reverse] = self.visual.TextStim(self.window,
+                    text="Type the digits in the {0}".format('reverse ' if reverse else '') +
+                    "order in which they were recited. " +
+                    "Press the delete button if you want to erase the last letter " +
+                    "you typed. For any digits you do not remember, press the letter x " +
+                    "instead of guessing. Press enter when you are done.",
+                    pos=(0, 6),
+                    wrapWidth=30)
+            n_slots = max(self.LEN_PRACTICE_TRIAL,
+                          self.sequence_range['forward']['max'],
+                          self.sequence_range['reverse']['max']) + 1
+            self.glyphs = [self.make_glyph(slot) for slot in range(n_slots)]
+
+        self.trace_session()
+
+    def trace_session(self):
+        # the parts of a session that get a span every time they run
+        self.tracer.wrap(self.window, 'flip', 'flip', 'frame')
+        for sound in [self.sound_correct, self.sound_incorrect] + self.sound_files:
+            self.tracer.wrap(sound, 'play', 'sound.play', 'sound')
+        for method in ('practice_trial', 'main_trial', 'adaptive_block', 'present_sequence',
+                       'display_digit', 'accept_sequence'):
+            self.tracer.wrap(self, method)
+        self.tracer.wrap(self.log, 'sync', 'log.sync', 'io')
+        self.tracer.wrap(self.log, 'close', 'log.close', 'io')
+
+    def offer_resume(self, subject_info):
+        # a checkpoint is left behind only by a session that was interrupted
+        log_file = os.path.join(self.DATA_DIR, '_'.join(subject_info) + '.csv')
+        state = checkpoint.load(checkpoint.checkpoint_path(log_file))
+        if state is None or state.get('task') != 'digitspan' or self.RESUME is False:
+            return None
+        if self.RESUME is None:
+            resume_dialog = self.gui.Dlg(title='Resume Session')
+            resume_dialog.addText("The session with the subject ID " + subject_info[0] +
+                                  " and test number " + subject_info[1] + " was interrupted during the " +
+                                  state['phase'] + " section. Resume it?")
+            resume_dialog.show()
+            if not resume_dialog.OK:
+                return None
+        return state
+
+    def skip_phase(self, phase):
+        # a resumed session skips the phases it had finished
+        return self.resume is not None and \
+            DIGITSPAN_DIRECTIONS.index(phase) < DIGITSPAN_DIRECTIONS.index(self.resume['phase'])
+
+    def resume_state(self, phase):
+        # the checkpoint, if the session resumes in this phase
+        if self.resume is not None and self.resume['phase'] == phase:
+            state, self.resume = self.resume, None
+            return state
+        return None
+
+    def save_checkpoint(self, phase, block=0, progress=None):
+        # progress: where in the block, or None to start it from the beginning
+        span_estimates = dict((direction, list(estimates)) for direction, estimates in self.span_estimates.items())
+        self.checkpoint.update({'task': 'digitspan', 'phase': phase, 'block': block, 'progress': progress,
+                                'span_estimates': span_estimates}, self.log)
+
+    def make_schedule(self, subject_info):
+        saved = os.path.splitext(self.log_file)[0] + '.schedule.json'
+        if self.resume is not None and os.path.isfile(saved):
+            # the interrupted session's own schedule
+            session = schedule.load(saved, 'digitspan')
+        elif self.SCHEDULE_FILE:
+            session = schedule.load(self.SCHEDULE_FILE, 'digitspan')
+        else:
+            seed = self.SCHEDULE_SEED
+            if seed is None:
+                seed = schedule.session_seed('digitspan', *subject_info)
+            # the adaptive procedure may give the same length every trial
+            per_length = max(3, self.ADAPTIVE_MAX_TRIALS) if self.PROCEDURE == 'adaptive' else 3
+            session = schedule.digitspan_schedule(
+                seed, self.N_PRACTICE_TRIALS, self.LEN_PRACTICE_TRIAL, self.NUM_TRIAL_BLOCKS,
+                self.sequence_range, per_length, self.SEQUENCE_NO_REPEATS)
+        schedule.save(session, os.path.splitext(self.log_file)[0] + '.schedule.json')
+        return session
 
     def run(self):
-        # initialization
-        visual.TextStim(self.window,
-                        text="Practice" + "\n\n" +
-                        "In this task, you will hear a sequence of numbers. When the " +
-                        "audio has finished, enter all of the numbers in the same " +
-                        "order as they were recited. " + "\n\n" +
-                        "Press any key to continue.",
-                        wrapWidth=30).draw()
+        # returns True when the session was completed, False when the
+        # participant quit early
+        try:
+            self.run_session()
+        except TaskAborted:
+            return False
+        self.quit()
+        return True
+
+    def run_session(self):
+        if not self.skip_phase('practice'):
+            # initialization
+            self.visual.TextStim(self.window,
+                            text="Practice" + "\n\n" +
+                            "In this task, you will hear a sequence of numbers. When the " +
+                            "audio has finished, enter all of the numbers in the same " +
+                            "order as they were recited. " + "\n\n" +
+                            "Press any key to continue.",
+                            wrapWidth=30).draw()
 
-        self.window.flip()
-        event.waitKeys()
-        visual.TextStim(
-            self.window, text="This is the sound of a correct response.").draw()
-        self.window.flip()
-        self.sound_correct.play()
-        core.wait(2)
-        visual.TextStim(
-            self.window, text="This is the sound of an incorrect response.").draw()
-        self.window.flip()
-        self.sound_incorrect.play()
-        core.wait(2)
+            self.window.flip()
+            self.event.waitKeys()
+            self.visual.TextStim(
+                self.window, text="This is the sound of a correct response.").draw()
+            self.window.flip()
+            self.sound_correct.play()
+            self.core.wait(2)
+            self.visual.TextStim(
+                self.window, text="This is the sound of an incorrect response.").draw()
+            self.window.flip()
+            self.sound_incorrect.play()
+            self.core.wait(2)
 
-        # now we start section 1, practice trials
-        self.practice_trial()
+            # now we start section 1, practice trials
+            self.practice_trial()
 
         # begin section 2
-        self.main_trial('forward')
+        if not self.skip_phase('forward'):
+            self.main_trial('forward')
 
         # start section 3 - reverse digit span
         self.main_trial('reverse')
 
         # we can show the user some additonal things, but we prefer to end.
-        self.quit()
-        
-
-    def quit(self):
 
-        csvwriter = csv.writer(self.log_file, delimiter=',',
-                               quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        for row in self.data:
-            csvwriter.writerow(row)
-
-        visual.TextStim(
+    def quit(self, status='complete'):
+        self.log.close()
+        self.checkpoint.close()
+        self.index.finish(self.subject_info[0], self.subject_info[1], self.log.rows, status)
+        self.index.close()
+        self.tracer.dump(os.path.splitext(self.log_file)[0] + '.trace.json')
+        # the window and sounds may outlive this task (see battery.py)
+        self.tracer.unwrap()
+        if self.publisher is not None:
+            self.publisher.stop()
+
+        self.visual.TextStim(
             self.window, "Thank you for your participation.").draw()
         self.window.flip()
-        core.wait(3)
+        self.core.wait(3)
 
-        # print self.data
+        # a shared window belongs to the battery
+        if self.shared_window is None:
+            self.window.close()
 
-        # self.log_file.write(json.dumps(self.data))
-        self.log_file.close()
-        self.window.close()
-        sys.exit(0)
+    def abort(self):
+        # the participant pressed q: save everything, then unwind to run()
+        self.quit('aborted')
+        raise TaskAborted()
 
 
     def practice_trial(self):
-        for trial_num in range(self.N_PRACTICE_TRIALS):
-            expected = random.sample(xrange(10), self.LEN_PRACTICE_TRIAL)
-            for num in expected:
-                self.display_digit(num)
+        self.stats.start_phase('practice')
+        state = self.resume_state('practice')
+        start = state['progress']['trial'] if state and state['progress'] else 0
+        for trial_num, expected in enumerate(self.schedule['practice'][start:], start):
+            onsets = self.play_sequence(expected, 0)
             self.window.flip()
-            core.wait(self.DIGIT_DISPLAY_GAP)
+            self.core.wait(self.DIGIT_DISPLAY_GAP)
 
-            actual, timestamp = self.accept_sequence()
+            actual, timestamp, keystrokes = self.accept_sequence()
             if actual == expected:
                 self.sound_correct.play()
             else:
@@ -194,10 +399,16 @@ class DigitSpan(object):
 
             # we're going to offload ALL analysis to later stages. Task only records data.
             # new data format is [trial_type, trial_num, expected, actual,
-            # timestamp]
-            self.write_data('practice', trial_num, expected, actual, timestamp)
+            # timestamp, keystrokes, onsets]
+            self.write_data('practice', trial_num, expected, actual, timestamp, keystrokes, onsets)
+            self.stats.add_digitspan(len(expected), actual == expected, timestamp)
+            self.log.maybe_sync()
+            self.save_checkpoint('practice', progress={'trial': trial_num + 1})
+
+            self.core.wait(self.INTER_TRIAL_DELAY)  # between trials
 
-            core.wait(self.INTER_TRIAL_DELAY)  # between trials
+        self.log.sync()
+        self.save_checkpoint('forward')
 
     def main_trial(self, direction):
         intro_text = """In this section, listen to the sequence of numbers, \
@@ -209,30 +420,51 @@ as they were recited.""".format('same' if direction is 'forward' else 'REVERSE')
 
         intro_text += '\nPress any key to continue.'
 
-        visual.TextStim(self.window, text=intro_text, wrapWidth=30).draw()
+        self.visual.TextStim(self.window, text=intro_text, wrapWidth=30).draw()
 
         self.window.flip()
-        event.waitKeys()
-
-        for block_num in range(self.NUM_TRIAL_BLOCKS):
+        self.event.waitKeys()
+
+        state = self.resume_state(direction)
+        first_block = state['block'] if state else 0
+        for block_num in range(first_block, self.NUM_TRIAL_BLOCKS):
+            self.stats.start_phase(direction)
+            block = self.schedule['blocks'][direction][block_num]
+            pools = schedule.sequence_pools(block)
+            # where a resumed block stopped; the sequences it used are gone
+            progress = state['progress'] if state and block_num == first_block else None
+            if progress:
+                for length, used in progress['used'].items():
+                    del pools[int(length)][:used]
+
+            if self.PROCEDURE == 'adaptive':
+                self.adaptive_block(direction, block_num, block, pools, progress)
+                self.save_checkpoint(direction, block_num + 1)
+                continue
+
+            presets = block['preset']
             trials_wrong = 0
             max_span = 0
             sequence = []
             sequence_index = 0
             sequence_size = len(sequence)
             repeat = 0
+            if progress:
+                sequence_index, sequence_size, repeat, trials_wrong, max_span = [progress[name] for name in (
+                    'sequence_index', 'sequence_size', 'repeat', 'trials_wrong', 'max_span')]
 
             def bye(self):
-                visual.TextStim(self.window,
+                self.log.sync()
+                self.visual.TextStim(self.window,
                                 text="This block is over. Your max {0} digitspan was {1}.".format(direction, max_span)).draw()
                 self.window.flip()
-                core.wait(5)
+                self.core.wait(5)
 
             # while true is a bad habit
             while True:
                 # if there's a pre-defined seq we can use, use it
-                if sequence_index < len(self.sequences[direction]):
-                    sequence = self.sequences[direction][sequence_index]
+                if sequence_index < len(presets):
+                    sequence = presets[sequence_index]
                     sequence_size = len(sequence)
                     sequence_index += 1
                 else:
@@ -250,49 +482,104 @@ as they were recited.""".format('same' if direction is 'forward' else 'REVERSE')
 
                     # this functionality differs a little from 3.0: repetitions in line are allowed
                     # whereas 3.0 specifically does not allow the same number
-                    # to occur twice in series
-                    sequence = numpy.random.choice(
-                        10, size=sequence_size, replace=True)
+                    # to occur twice in series (sequence_no_repeats=True)
+                    sequence = pools[sequence_size].pop(0)
 
                 # at this point sequence and sequence_size are defined
-
-                # read out all the digits in the sequence
-                for digit in sequence:
-                    self.display_digit(digit)
-                    self.window.flip()
-                    core.wait(self.DIGIT_DISPLAY_GAP)
-
-                # take user input and log immediately -> this is the function
-                # that actually reads in the data from the user
-                actual, timestamp = self.accept_sequence(
-                    direction is 'reverse')
-
-                # write data...
-                self.write_data(direction, block_num,
-                                sequence, actual, timestamp)
-                #self.data.append([direction, block_num, '-'.join(sequence), '-'.join(user_sequence[0]), user_sequence[1]])
-
-                if all(map(lambda x, y: x == y, actual, sequence)):
-                    self.sound_correct.play()
+                if self.present_sequence(direction, block_num, sequence):
                     max_span = max(max_span, sequence_size)
                     trials_wrong = 0
                 else:
-                    self.sound_incorrect.play()
                     trials_wrong += 1
 
                 # if you fail N times (2 default) in a row, you're done
                 if trials_wrong >= self.MAX_TRIALS_WRONG:
-                    core.wait(0.5)  # ?
+                    self.core.wait(0.5)  # ?
                     bye(self)
                     break
 
+                self.log.maybe_sync()
+                self.save_checkpoint(direction, block_num, {
+                    'sequence_index': sequence_index, 'sequence_size': sequence_size, 'repeat': repeat,
+                    'trials_wrong': trials_wrong, 'max_span': max_span, 'used': pools_used(block, pools)})
                 self.window.flip()
-                core.wait(0.5)
+                self.core.wait(0.5)
+
+            self.save_checkpoint(direction, block_num + 1)
+
+        if direction == 'forward':
+            self.save_checkpoint('reverse')
+
+    def adaptive_block(self, direction, block_num, block, pools, progress=None):
+        estimator = SpanEstimator(prior_mean=self.ADAPTIVE_PRIOR[direction],
+                                  min_length=self.sequence_range[direction]['min'],
+                                  max_length=self.sequence_range[direction]['max'])
+        # a resumed block replays its answers so far
+        history = progress['history'] if progress else []
+        for sequence_size, correct in history:
+            estimator.update(sequence_size, correct)
+        mean, sd = estimator.estimate()
+
+        for trial in range(len(history), self.ADAPTIVE_MAX_TRIALS):
+            sequence_size = estimator.next_length()[0]
+            sequence = pools[sequence_size].pop(0)
+            correct = self.present_sequence(direction, block_num, sequence)
+            estimator.update(sequence_size, correct)
+            history.append((sequence_size, correct))
+
+            mean, sd = estimator.estimate()
+            if trial + 1 >= self.ADAPTIVE_MIN_TRIALS and sd[0] <= self.ADAPTIVE_STOP_SD:
+                break
+
+            self.log.maybe_sync()
+            self.save_checkpoint(direction, block_num, {'history': list(history), 'used': pools_used(block, pools)})
+            self.window.flip()
+            self.core.wait(0.5)
+
+        estimate = (round(mean[0], 2), round(sd[0], 2))
+        self.span_estimates[direction].append(estimate)
+        self.write_estimates()
+
+        self.core.wait(0.5)
+        self.log.sync()
+        self.visual.TextStim(self.window,
+                        text="This block is over. Your estimated {0} digitspan was {1:.1f} (+/- {2:.1f}).".format(
+                            direction, *estimate)).draw()
+        self.window.flip()
+        self.core.wait(5)
+
+    def write_estimates(self):
+        # next to the log, as JSON so that analysis doesn't take it for a session
+        with open(os.path.splitext(self.log_file)[0] + '.estimates.json', 'w') as f:
+            json.dump({'procedure': self.PROCEDURE, 'span_estimates': self.span_estimates}, f)
+
+    # reads out sequence, takes the response and logs it. Returns whether it
+    # was recalled correctly.
+    def present_sequence(self, direction, block_num, sequence):
+        # read out all the digits in the sequence
+        onsets = self.play_sequence(sequence, self.DIGIT_DISPLAY_GAP)
+
+        # take user input and log immediately -> this is the function
+        # that actually reads in the data from the user
+        actual, timestamp, keystrokes = self.accept_sequence(
+            direction is 'reverse')
+
+        # write data...
+        self.write_data(direction, block_num,
+                        sequence, actual, timestamp, keystrokes, onsets)
+
+        correct = all(map(lambda x, y: x == y, actual, sequence))
+        self.stats.add_digitspan(len(sequence), correct, timestamp)
+        if correct:
+            self.sound_correct.play()
+        else:
+            self.sound_incorrect.play()
+        return correct
 
     def get_subject_info(self, args=[]):
         # no cli args
         if len(args) == 0:
-            subject_info = gui.DlgFromDict(
+            subject_info = self.gui.DlgFromDict(
                 dictionary={'Subject ID': '', 'Test Number': '1'},
                 title='Digit-Span Task')
 
@@ -311,90 +598,103 @@ as they were recited.""".format('same' if direction is 'forward' else 'REVERSE')
 
         return subject_id, subject_test_number
 
+    # reads out the sequence with `gap` seconds (after DIGIT_DISPLAY_TIME)
+    # between digits. Returns the onset sample of each digit when gapless.
+    def play_sequence(self, sequence, gap):
+        if not self.GAPLESS_AUDIO:
+            for digit in sequence:
+                self.display_digit(digit)
+                if gap:
+                    self.window.flip()
+                    self.core.wait(gap)
+            return ()
+
+        buffer, onsets = self.mixer.mix(sequence, self.DIGIT_DISPLAY_TIME + gap)
+        sequence_sound = self.sound.Sound(value=buffer, sampleRate=self.mixer.rate)
+        self.window.flip()
+        # traced inline: wrap() would keep every trial's sound (and its
+        # buffer) alive until the end of the session
+        with self.tracer.span('sound.play', 'sound'):
+            sequence_sound.play()
+        for digit in sequence:
+            self.backend.cue('heard', digit=digit)
+        self.core.wait(sequence_sound.getDuration() + self.DIGIT_DISPLAY_TIME)
+        if gap:
+            self.window.flip()
+            self.core.wait(gap)
+        return onsets
+
     def display_digit(self, digit):
         self.window.flip()
         self.sound_files[digit].play()
-        core.wait(self.DIGIT_DISPLAY_TIME +
+        self.backend.cue('heard', digit=digit)
+        self.core.wait(self.DIGIT_DISPLAY_TIME +
                   self.sound_files[digit].getDuration())
 
-    # returns (<list: clicked>, <timestemp: time_elapsed>)
+    # returns (<list: clicked>, <timestamp: time_elapsed>, <list: (key, time) per keystroke>)
     def accept_sequence(self, reverse=False):
-        instructions = visual.TextStim(self.window,
-                                       text="Type the digits in the {0}".format('reverse ' if reverse else '') +
-                                       "order in which they were recited. " +
-                                       "Press the delete button if you want to erase the last letter " +
-                                       "you typed. For any digits you do not remember, press the letter x " +
-                                       "instead of guessing. Press enter when you are done.",
-                                       pos=(0, 6),
-                                       wrapWidth=30)
+        instructions = self.input_instructions[reverse]
         instructions.setAutoDraw(True)  # auto-rerender on each windowflip
-        instructions.draw()
+
+        # all times are relative to the flip that shows the instructions
+        timer = self.core.Clock()
+        self.window.callOnFlip(timer.reset)
+        self.window.callOnFlip(self.event.clearEvents)
+        self.window.callOnFlip(self.backend.cue, 'recall', reverse=reverse)
         self.window.flip()
 
-        # NUMBERS = ramge(10)
-        timer = core.Clock()
         clicked = []  # list for return to user
-        numbers = []  # list to hold pointers for display
-        event.clearEvents()
-
-        # my thinking for this loop was:
-        #   1. get the current keybuffer.
-        #   2. loop through several possibilities and act accordingly
-        #   3. repeat until the user hits enter, then break the loop and return.
-        # However, this doesn't work apparently, and the documentation for how getKeys()
-        # works is rather limited, even in Pygame
+        keystrokes = []  # every key accepted, with its event timestamp
 
+        # once per frame: drain the whole key buffer in one call and dispatch
+        # each key through the key -> action table. Keys are timestamped when
+        # they arrive, so nothing typed between two frames is lost.
         while True:
-            if event.getKeys(keyList=['q', 'escape']):
-                # self.log_file.write(json.dumps(self.data))
-                self.quit()
-
-            if event.getKeys(keyList=['backspace', 'delete', '[.]', 'period', '.']) and len(clicked) > 0:
-                clicked = clicked[:-1]
-                # I don't think this is necessary before the next step.
-                numbers[-1].setAutoDraw(False)
-                # ...[-1] should get GC'd and autoremoved from the window. I think.
-                numbers = numbers[:-1]
-                self.window.flip()
-                core.wait(0.200)
-
-            if event.getKeys(keyList=['num_enter', 'return']):
-                # I highly doubt these two are necessary. But apparently they
-                # are.
-                map(lambda n: n.setAutoDraw(False), numbers)
-                instructions.setAutoDraw(False)
-                if reverse:
-                    clicked.reverse()
-                return (clicked, timer.getTime())
-                # this is where it returns out from the while true loop!
-
-            if event.getKeys(keyList=['x']):
-                clicked.append('x')
-                ast = visual.TextStim(self.window, text="x", color="DarkMagenta",
-                                      pos=(-10 + 2 * len(numbers), 0))
-                ast.setAutoDraw(True)
-                ast.draw()
-                numbers.append(ast)
-                self.window.flip()
-                core.wait(0.200)
-
-            for i in range(10):  # we're looking for nums 0..9
-                capture_list = "{0},num_{0},[{0}]".format(i).split(',')
-                if event.getKeys(keyList=capture_list):
-                    clicked.append(i)
-                    num = visual.TextStim(self.window, text=str(i), color="DarkMagenta",
-                                          pos=(-10 + 2 * len(numbers), 0))
-                    num.setAutoDraw(True)
-                    num.draw()
-                    numbers.append(num)
-                    self.window.flip()
-                    core.wait(0.200)
-                    break
+            for key, t in self.event.getKeys(keyList=self.key_list, timeStamped=timer):
+                action = self.key_actions[key]
+                keystrokes.append((key, t))
+                self.tracer.instant('key', 'input', key=key, t=t)
+
+                if action == 'quit':
+                    self.abort()
+
+                elif action == 'enter':
+                    for glyph in self.glyphs:
+                        glyph.setAutoDraw(False)
+                    instructions.setAutoDraw(False)
+                    if reverse:
+                        clicked.reverse()
+                    return (clicked, t, keystrokes)
+                    # this is where it returns out from the while true loop!
+
+                elif action == 'delete':
+                    if len(clicked) > 0:
+                        clicked.pop()
+                        self.glyphs[len(clicked)].setAutoDraw(False)
+
+                else:
+                    # a digit, or 'x' for a digit the user doesn't remember
+                    if len(clicked) == len(self.glyphs):
+                        self.glyphs.append(self.make_glyph(len(clicked)))
+                    glyph = self.glyphs[len(clicked)]
+                    glyph.setText(str(action))
+                    glyph.setAutoDraw(True)
+                    clicked.append(action)
+
+            self.window.flip()
 
-    def write_data(self, direction, trial_num, expected, actual, timestamp):
-        # '-'.join(...) for csv compat
-        self.data.append([direction, trial_num,
-                          '-'.join(str(i) for i in expected), '-'.join(str(i) for i in actual), timestamp])
+    def make_glyph(self, slot):
+        return self.visual.TextStim(self.window, text="", color="DarkMagenta",
+                               pos=(-10 + 2 * slot, 0))
+
+    def write_data(self, direction, trial_num, expected, actual, timestamp, keystrokes=(), onsets=()):
+        # '-'.join(...) for csv compat. keystrokes are written as
+        # space-separated "key:time" pairs, onsets (empty unless gapless) as
+        # sample numbers like the sequences.
+        self.log.append([direction, trial_num,
+                          '-'.join(str(i) for i in expected), '-'.join(str(i) for i in actual), timestamp,
+                          ' '.join('{0}:{1:.4f}'.format(key, t) for key, t in keystrokes),
+                          '-'.join(str(i) for i in onsets)])
 
 # if __name__ == '__main__':
 #     ds = DigitSpan(data_dir = "kelly_data_digitspan", monitor_resolution=(1600, 900))
@@ -0,0 +1,5 @@
+"""Exceptions shared by the tasks and the battery."""
+
+
+class TaskAborted(Exception):
+    """Raised by a task's abort() once it has saved what it had."""
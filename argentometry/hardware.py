@@ -0,0 +1,241 @@
+"""Per-machine hardware profiles.
+
+The first time a task starts on a machine it calibrates: it starts the audio
+backend at the first sample rate and buffer size that work, then flips the
+window for a couple of seconds to measure the actual refresh interval and
+how often frames are dropped. The results are saved to the host's profile,
+'~/.argentometry/hardware/<hostname>.json', and later launches load them
+instead of calibrating again.
+
+The audio settings are kept once per host. The display is measured once for
+each display configuration (backend, monitor, resolution and display mode),
+so a station that alternates between two resolutions keeps both:
+
+    {
+      "audio_rate": 44100,
+      "audio_buffer": 128,
+      "displays": {
+        "PsychoPyBackend testMonitor 1024x768 fullscreen": {
+          "refresh_interval": 0.01667, "frame_drop_rate": 0.0, ...
+        }
+      }
+    }
+
+The file is plain JSON, so a machine that needs a particular audio setting
+can have it written in once. recalibrate=True measures the display again but
+keeps the audio settings; delete them from the file to find new ones. Only a
+real display and sound card are calibrated: a headless backend never reads
+or writes a profile.
+
+Durations are then scheduled in whole frames of the measured refresh
+interval (see HardwareProfile.frames and quantize).
+"""
+import json
+import os
+import platform
+import socket
+import time
+
+PROFILE_DIR = os.path.join(os.path.expanduser('~'), '.argentometry', 'hardware')
+AUDIO_RATES = (48000, 44100)
+AUDIO_BUFFERS = (128, 256, 512)
+
+
+def fingerprint(backend, monitor, resolution, fullscreen):
+    return {
+        'host': socket.gethostname(),
+        'backend': type(backend).__name__,
+        'monitor': monitor,
+        'resolution': list(resolution),
+        'fullscreen': bool(fullscreen),
+    }
+
+
+def display_key(fingerprint):
+    return '{0} {1} {2}x{3} {4}'.format(fingerprint['backend'], fingerprint['monitor'],
+                                        fingerprint['resolution'][0], fingerprint['resolution'][1],
+                                        'fullscreen' if fingerprint['fullscreen'] else 'windowed')
+
+
+def profile_path(profile_dir):
+    return os.path.join(profile_dir, socket.gethostname() + '.json')
+
+
+def load_profiles(path):
+    """The host's saved settings, or empty ones if there are none (or they
+    can't be read)."""
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        saved = {}
+    if not isinstance(saved, dict):
+        saved = {}
+    if 'refresh_interval' in saved:
+        # a single profile, as written before displays were kept apart
+        saved = {
+            'audio_rate': saved.get('audio_rate'),
+            'audio_buffer': saved.get('audio_buffer'),
+            'displays': {display_key(saved['fingerprint']): dict(
+                (name, saved.get(name)) for name in ('refresh_interval', 'frame_drop_rate', 'calibrated'))},
+        }
+    saved.setdefault('displays', {})
+    return saved
+
+
+def save_profiles(path, saved):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(saved, f, indent=2, sort_keys=True)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+class HardwareProfile(object):
+
+    def __init__(self, fingerprint, refresh_interval, frame_drop_rate, audio_rate, audio_buffer, calibrated=None):
+        self.fingerprint = fingerprint
+        self.refresh_interval = refresh_interval
+        self.frame_drop_rate = frame_drop_rate
+        self.audio_rate = audio_rate
+        self.audio_buffer = audio_buffer
+        self.calibrated = calibrated or time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def frames(self, secs):
+        """The whole number of frames (at least one) closest to `secs`."""
+        return max(1, int(round(secs / self.refresh_interval)))
+
+    def quantize(self, secs):
+        """`secs` rounded to a whole number of frames."""
+        return self.frames(secs) * self.refresh_interval
+
+
+def calibrate_audio(sound, rates=AUDIO_RATES, buffers=AUDIO_BUFFERS):
+    """Starts `sound` at the first (rate, buffer) that works and returns it."""
+    for rate in rates:
+        for buffer in buffers:
+            try:
+                sound.init(rate, buffer=buffer)
+                sound.Sound(value=440, secs=0.01, volume=0).play()
+                return rate, buffer
+            except Exception:
+                continue
+    raise RuntimeError("no audio sample rate/buffer size in {0}/{1} works".format(rates, buffers))
+
+
+def calibrate_display(window, core, frames=120, warmup=10):
+    """Returns (refresh_interval, frame_drop_rate) measured over `frames` flips."""
+    for i in range(warmup):
+        window.flip()
+    clock = core.Clock()
+    times = []
+    for i in range(frames + 1):
+        window.flip()
+        times.append(clock.getTime())
+    intervals = sorted(b - a for a, b in zip(times, times[1:]))
+    refresh = intervals[len(intervals) // 2]
+    # an interval of two or more frames means at least one was dropped
+    dropped = sum(1 for t in intervals if t > 1.5 * refresh)
+    return refresh, dropped / float(len(intervals))
+
+
+def calibration(backend, monitor, resolution, fullscreen, profile_dir=PROFILE_DIR, recalibrate=False):
+    """The Calibration for a task's display settings."""
+    if not backend.profiles:
+        profile_dir = None
+    return Calibration(fingerprint(backend, monitor, resolution, fullscreen), profile_dir, recalibrate)
+
+
+class Calibration(object):
+    """Loads the host's profile, or calibrates the hardware and saves one.
+
+    Calibration happens in two steps because audio has to be started before
+    the window is created and the display can only be measured after:
+
+        calibration = Calibration(fingerprint(...))
+        calibration.init_sound(sound)
+        window = visual.Window(...)
+        profile = calibration.measure_display(window, core)
+
+    With profile_dir=None nothing is loaded, calibrated or saved: audio is
+    started with the given (or default) settings and there is no profile.
+    """
+
+    def __init__(self, fingerprint, profile_dir=PROFILE_DIR, recalibrate=False):
+        self.fingerprint = fingerprint
+        self.path = profile_path(profile_dir) if profile_dir else None
+        self.profile = None
+        self.saved_audio = None
+        if self.path:
+            saved = load_profiles(self.path)
+            if saved.get('audio_rate') and saved.get('audio_buffer'):
+                self.saved_audio = (saved['audio_rate'], saved['audio_buffer'])
+            display = None if recalibrate else saved['displays'].get(display_key(fingerprint))
+            if display and self.saved_audio:
+                try:
+                    self.profile = HardwareProfile(fingerprint, display['refresh_interval'],
+                                                   display['frame_drop_rate'], *self.saved_audio,
+                                                   calibrated=display.get('calibrated'))
+                except (KeyError, TypeError):
+                    self.profile = None
+        self.audio = None
+
+    def init_sound(self, sound, rate=None, buffer=None):
+        """Starts the audio backend. Explicit values override the profile.
+
+        The backend is started once; later calls (the next task of a battery)
+        return the settings it is already running with.
+        """
+        if self.audio is not None:
+            return self.audio
+        if self.saved_audio is not None:
+            rate = rate or self.saved_audio[0]
+            buffer = buffer or self.saved_audio[1]
+        if not self.path:
+            rate, buffer = rate or AUDIO_RATES[0], buffer or AUDIO_BUFFERS[0]
+        if rate and buffer:
+            sound.init(rate, buffer=buffer)
+            self.audio = (rate, buffer)
+        else:
+            self.audio = calibrate_audio(sound, [rate] if rate else AUDIO_RATES,
+                                         [buffer] if buffer else AUDIO_BUFFERS)
+        return self.audio
+
+    def expected_rate(self, rate=None):
+        """The sample rate init_sound(sound, rate) will start audio at, or None
+        if that will only be known after calibrating."""
+        if self.audio is not None:
+            return self.audio[0]
+        if rate:
+            return rate
+        if self.saved_audio is not None:
+            return self.saved_audio[0]
+        if not self.path:
+            return AUDIO_RATES[0]
+        return None
+
+    def measure_display(self, window, core):
+        if self.profile is None and self.path:
+            refresh, drops = calibrate_display(window, core)
+            audio = self.saved_audio or self.audio
+            self.profile = HardwareProfile(self.fingerprint, refresh, drops, *audio)
+            try:
+                # read again: another configuration may have been saved since
+                saved = load_profiles(self.path)
+                if self.saved_audio is None:
+                    saved['audio_rate'], saved['audio_buffer'] = audio
+                saved['platform'] = platform.platform()
+                saved['displays'][display_key(self.fingerprint)] = {
+                    'fingerprint': self.fingerprint,
+                    'refresh_interval': refresh,
+                    'frame_drop_rate': drops,
+                    'calibrated': self.profile.calibrated,
+                }
+                save_profiles(self.path, saved)
+            except (IOError, OSError):
+                pass
+        return self.profile
@@ -0,0 +1,189 @@
+"""SQLite index of the sessions in a data directory.
+
+Each data directory gets a '.sessions.db' with one row per session: subject,
+test number, task, start and end time, number of rows, status and the SHA-1
+of the finished CSV. Tasks record a session when its log is opened and
+complete it when the log is closed, so checking for a duplicate, finding a
+subject's next free test number or listing a cohort is an indexed lookup
+instead of a scan of the directory.
+
+The first time a directory is opened, every CSV (and .partial file) already
+in it is indexed in one pass. To index files that are not indexed yet, such
+as ones copied in by hand, run:
+
+    python -m argentometry.index <data_dir> --rescan
+
+and to look things up:
+
+    python -m argentometry.index <data_dir> --list [--task sart]
+    python -m argentometry.index <data_dir> --next <subject_id>
+"""
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+from argentometry.schema import detect_task, split_name
+
+INDEX_FILE = '.sessions.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    subject TEXT NOT NULL,
+    test TEXT NOT NULL,
+    task TEXT,
+    started REAL,
+    ended REAL,
+    rows INTEGER,
+    status TEXT NOT NULL,
+    checksum TEXT,
+    PRIMARY KEY (subject, test)
+);
+CREATE INDEX IF NOT EXISTS sessions_task ON sessions (task, subject, test);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+COLUMNS = ['subject', 'test', 'task', 'started', 'ended', 'rows', 'status', 'checksum']
+
+
+def file_checksum(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_rows(path):
+    """(task, number of rows) of a session CSV; task is None if it is empty."""
+    task = None
+    rows = 0
+    with open(path) as f:
+        for row in csv.reader(f):
+            if row:
+                if task is None:
+                    task = detect_task(row)
+                rows += 1
+    return task, rows
+
+
+class SessionIndex(object):
+    """The index of `data_dir`; backfilled from the CSVs on first use."""
+
+    def __init__(self, data_dir, name=INDEX_FILE, timeout=30.0):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, name)
+        # several stations may share one data directory
+        self.db = sqlite3.connect(self.path, timeout=timeout)
+        self.db.executescript(SCHEMA)
+        if self.meta('backfilled') is None:
+            self.backfill()
+
+    def meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def backfill(self):
+        """Indexes every session file in the directory that isn't indexed
+        yet. Returns the number of sessions added."""
+        names = set(os.listdir(self.data_dir))
+        added = 0
+        with self.db:
+            for fn in sorted(names):
+                if fn.endswith('.csv'):
+                    status, path = 'complete', os.path.join(self.data_dir, fn)
+                elif fn.endswith('.csv.partial') and fn[:-len('.partial')] not in names:
+                    status, path = 'partial', os.path.join(self.data_dir, fn)
+                else:
+                    continue
+                subject, test = split_name(path[:-len('.partial')] if status == 'partial' else path)
+                if not subject or self.get(subject, test) is not None:
+                    continue
+                task, rows = count_rows(path)
+                self.db.execute('INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (subject, test, task, None, os.path.getmtime(path), rows, status,
+                                 file_checksum(path) if status == 'complete' else None))
+                added += 1
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                            ('backfilled', time.strftime('%Y-%m-%dT%H:%M:%S')))
+        return added
+
+    def get(self, subject, test):
+        """The session as a dict, or None."""
+        row = self.db.execute('SELECT * FROM sessions WHERE subject = ? AND test = ?',
+                              (subject, str(test))).fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def exists(self, subject, test):
+        """Whether the session is indexed or has a file in the directory."""
+        path = os.path.join(self.data_dir, '{0}_{1}.csv'.format(subject, test))
+        return self.get(subject, test) is not None or os.path.exists(path) or os.path.exists(path + '.partial')
+
+    def next_test(self, subject):
+        """The lowest free test number above the subject's highest one."""
+        highest, = self.db.execute('SELECT MAX(CAST(test AS INTEGER)) FROM sessions WHERE subject = ?',
+                                   (subject,)).fetchone()
+        test = (highest or 0) + 1
+        while self.exists(subject, test):
+            test += 1
+        return test
+
+    def start(self, subject, test, task):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, NULL, 0, ?, NULL)',
+                            (subject, str(test), task, time.time(), 'running'))
+
+    def finish(self, subject, test, rows, status='complete'):
+        path = os.path.join(self.data_dir, '{0}_{1}.csv'.format(subject, test))
+        with self.db:
+            self.db.execute('UPDATE sessions SET ended = ?, rows = ?, status = ?, checksum = ? '
+                            'WHERE subject = ? AND test = ?',
+                            (time.time(), rows, status, file_checksum(path) if os.path.isfile(path) else None,
+                             subject, str(test)))
+
+    def sessions(self, task=None, subject=None):
+        """Every session (as dicts), optionally of one task or subject."""
+        query, args = 'SELECT * FROM sessions', []
+        conditions = []
+        if task is not None:
+            conditions.append('task = ?')
+            args.append(task)
+        if subject is not None:
+            conditions.append('subject = ?')
+            args.append(subject)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return [dict(zip(COLUMNS, row)) for row in self.db.execute(query + ' ORDER BY subject, test', args)]
+
+    def close(self):
+        self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Look up sessions in a data directory.')
+    parser.add_argument('data_dir')
+    parser.add_argument('--rescan', action='store_true', help='index files that are not indexed yet')
+    parser.add_argument('--list', action='store_true', help='list the sessions')
+    parser.add_argument('--task', help='only list sessions of this task')
+    parser.add_argument('--next', metavar='SUBJECT_ID', help="print the subject's next free test number")
+    args = parser.parse_args(argv)
+
+    index = SessionIndex(args.data_dir)
+    if args.rescan:
+        print >> sys.stderr, '{0} sessions added'.format(index.backfill())
+    if args.next:
+        print index.next_test(args.next.upper())
+    if args.list:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(COLUMNS)
+        for session in index.sessions(args.task):
+            writer.writerow([session[c] for c in COLUMNS])
+    index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
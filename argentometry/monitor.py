@@ -0,0 +1,244 @@
+"""Live session statistics for the operator.
+
+Each task keeps a SessionStats up to date as it logs trials: a running
+(Welford) mean and variance of the RT, overall and rolling accuracy,
+commission and omission counts for SART, and the current span for
+DigitSpan. Every update is O(1) and happens between trials, next to the
+log append, never in the frame loop.
+
+With monitor_address='host:port' a background thread also sends the latest
+statistics as a JSON datagram (UDP) every `monitor_interval` seconds. The
+render thread does no socket work. Several stations can report to one
+listener:
+
+    python -m argentometry.monitor --port 9999
+
+prints a table with one row per station, so a disengaged participant or a
+station that has stopped reporting stands out.
+"""
+import argparse
+import json
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+DEFAULT_PORT = 9999
+
+
+class RunningMean(object):
+    """Welford's online mean and variance."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def sd(self):
+        return (self.m2 / (self.n - 1)) ** 0.5 if self.n > 1 else None
+
+
+class RollingAccuracy(object):
+    """Fraction correct over the last `window` trials."""
+
+    def __init__(self, window=20):
+        self.outcomes = deque(maxlen=window)
+        self.correct = 0
+
+    def add(self, success):
+        if len(self.outcomes) == self.outcomes.maxlen:
+            self.correct -= self.outcomes[0]
+        self.outcomes.append(bool(success))
+        self.correct += bool(success)
+
+    @property
+    def value(self):
+        return self.correct / float(len(self.outcomes)) if self.outcomes else None
+
+
+class SessionStats(object):
+    """Statistics of the current phase of one session.
+
+    `latest` is a snapshot (a plain dict) rebuilt after every trial; that is
+    all the publisher thread ever reads.
+    """
+
+    def __init__(self, task, subject_id, test_number, rolling_window=20):
+        self.task = task
+        self.subject_id = subject_id
+        self.test_number = test_number
+        self.rolling_window = rolling_window
+        self.station = socket.gethostname()
+        self.start_phase('setup')
+
+    def start_phase(self, phase):
+        self.phase = phase
+        self.trials = 0
+        self.correct = 0
+        self.rt = RunningMean()
+        self.rolling = RollingAccuracy(self.rolling_window)
+        self.commission = 0
+        self.omission = 0
+        self.span = 0
+        self.latest = self.snapshot()
+
+    def add(self, success, rt=None):
+        self.trials += 1
+        self.correct += bool(success)
+        self.rolling.add(success)
+        if rt is not None:
+            self.rt.add(rt)
+
+    def add_sart(self, d):
+        """Adds a SART Datum."""
+        pressed = d.note != 'nopress'
+        if d.digit == d.target:
+            self.commission += pressed
+        else:
+            self.omission += not pressed
+        # RTs of correct clicks only
+        self.add(d.success, d.rt if pressed and d.success else None)
+        self.latest = self.snapshot()
+
+    def add_digitspan(self, length, success, rt):
+        """Adds a DigitSpan trial; rt is the time to enter the response."""
+        if success:
+            self.span = max(self.span, length)
+        self.add(success, rt)
+        self.latest = self.snapshot()
+
+    @property
+    def accuracy(self):
+        return self.correct / float(self.trials) if self.trials else None
+
+    def snapshot(self):
+        snapshot = {
+            'station': self.station,
+            'task': self.task,
+            'subject': self.subject_id,
+            'test': self.test_number,
+            'phase': self.phase,
+            'trials': self.trials,
+            'accuracy': self.accuracy,
+            'rolling_accuracy': self.rolling.value,
+            'rt_mean': self.rt.mean if self.rt.n else None,
+            'rt_sd': self.rt.sd,
+        }
+        if self.task == 'sart':
+            snapshot.update(commission=self.commission, omission=self.omission)
+        else:
+            snapshot.update(span=self.span)
+        return snapshot
+
+
+def parse_address(address):
+    """'host:port' (or a (host, port) tuple) -> (host, port)."""
+    if isinstance(address, basestring):
+        host, _, port = address.rpartition(':')
+        return host or '127.0.0.1', int(port)
+    return tuple(address)
+
+
+class Publisher(threading.Thread):
+    """Sends stats.latest to `address` over UDP every `interval` seconds."""
+
+    def __init__(self, stats, address, interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stats = stats
+        self.address = parse_address(address)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    def send(self, **extra):
+        message = dict(self.stats.latest, sent=time.time(), **extra)
+        try:
+            self.socket.sendto(json.dumps(message).encode('utf-8'), self.address)
+        except socket.error:
+            # nobody listening, or no network: the session goes on regardless
+            pass
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.send()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.send(done=True)
+
+
+def format_value(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def format_table(stations, now):
+    lines = ['{0:<16} {1:<12} {2:<9} {3:<8} {4:>6} {5:>6} {6:>7} {7:>13} {8:>10} {9:>6}'.format(
+        'station', 'subject', 'task', 'phase', 'trials', 'acc', 'rolling', 'rt', 'errors/span', 'age')]
+    for key in sorted(stations):
+        s = stations[key]
+        if s['task'] == 'sart':
+            extra = '{0}c {1}o'.format(s.get('commission'), s.get('omission'))
+        else:
+            extra = str(s.get('span'))
+        rt = '-' if s['rt_mean'] is None else '{0:.3f}+/-{1}'.format(s['rt_mean'], format_value(s['rt_sd'], '.3f'))
+        age = 'done' if s.get('done') else '{0:.0f}s'.format(now - s['received'])
+        lines.append('{0:<16} {1:<12} {2:<9} {3:<8} {4:>6} {5:>6} {6:>7} {7:>13} {8:>10} {9:>6}'.format(
+            s['station'][:16], '{0}_{1}'.format(s['subject'], s['test'])[:12], s['task'], s['phase'][:8],
+            s['trials'], format_value(s['accuracy'], '.0%'), format_value(s['rolling_accuracy'], '.0%'),
+            rt, extra, age))
+    return '\n'.join(lines)
+
+
+def listen(port=DEFAULT_PORT, host='', f=sys.stdout):
+    """Prints the latest statistics of every station that reports to `port`."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.settimeout(1.0)
+
+    # on a terminal the table is redrawn every second, so ages keep
+    # counting; otherwise it is printed after each message
+    tty = f.isatty()
+    stations = {}
+    while True:
+        try:
+            data, sender = sock.recvfrom(65536)
+            message = json.loads(data.decode('utf-8'))
+            message['received'] = time.time()
+            stations[(message['station'], message['subject'], message['test'])] = message
+        except socket.timeout:
+            if not tty:
+                continue
+        except ValueError:
+            continue
+        if tty:
+            f.write('\x1b[2J\x1b[H')
+        f.write(format_table(stations, time.time()) + '\n')
+        f.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the live statistics sent by running tasks.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--host', default='')
+    args = parser.parse_args(argv)
+    try:
+        listen(args.port, args.host)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
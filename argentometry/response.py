@@ -0,0 +1,100 @@
+class ResponseCollector(object):
+    """Frame-locked response collection.
+
+    Instead of spinning on mouse.getPressed(), the task redraws and flips once
+    per frame (which blocks on the vertical blank) and calls poll() after each
+    flip. PsychoPy's event handlers stamp clicks and keypresses with the time
+    they are dispatched, which happens when the window pumps its events during
+    a flip, so RTs are only resolved to about one frame. A click that is
+    released again before the next poll is still counted.
+
+    All times are relative to the flip that showed the stimulus (the onset
+    flip). The flip that showed the mask is recorded too, so the RT can also be
+    reported relative to mask onset.
+
+    `event` is the backend's event module (see backends.py).
+    """
+
+    def __init__(self, window, mouse, clock, event, response_keys=(), quit_keys=('q', 'escape')):
+        self.window = window
+        self.mouse = mouse
+        self.clock = clock
+        self.event = event
+        self.response_keys = list(response_keys)
+        self.quit_keys = list(quit_keys)
+        self.key_list = self.response_keys + self.quit_keys
+
+        self.quit_requested = False
+        self.reset()
+
+    def reset(self):
+        self.rt = None
+        self.source = None
+        self.mask_onset = None
+
+    def start(self):
+        # called right before the flip that shows the stimulus. The clocks are
+        # reset from inside that flip, so t=0 is the onset frame.
+        self.reset()
+        self.window.callOnFlip(self._on_onset)
+
+    def mark_mask(self):
+        # called right before the flip that shows the mask.
+        self.window.callOnFlip(self._on_mask)
+
+    def _on_onset(self):
+        self.clock.reset()
+        self.mouse.clickReset()
+        self.event.clearEvents()
+
+    def _on_mask(self):
+        self.mask_onset = self.clock.getTime()
+
+    def elapsed(self):
+        return self.clock.getTime()
+
+    def poll(self):
+        # drain everything that arrived since the last flip. Returns True only
+        # the first time a response is seen for the current stimulus.
+        responded = self.rt is not None
+
+        for key, t in self.event.getKeys(keyList=self.key_list, timeStamped=self.clock):
+            if key in self.quit_keys:
+                self.quit_requested = True
+            elif self.rt is None:
+                self.rt = t
+                self.source = key
+
+        if self.rt is None:
+            times = [t for t in self.mouse.getPressed(getTime=True)[1] if t > 0]
+            if times:
+                self.rt = min(times)
+                self.source = 'mouse'
+
+        return not responded and self.rt is not None
+
+    def mask_rt(self, t=None):
+        # time relative to mask onset; negative if it happened before the mask
+        if t is None:
+            t = self.rt
+        if t is None or self.mask_onset is None:
+            return None
+        return t - self.mask_onset
+
+    def before_mask(self):
+        return self.mask_onset is None or self.rt < self.mask_onset
+
+    def wait_for_click(self, *stims):
+        # redraw `stims` every frame until a mouse click arrives
+        self.mouse.clickReset()
+        self.event.clearEvents()
+        while True:
+            for stim in stims:
+                stim.draw()
+            self.window.flip()
+
+            if self.event.getKeys(keyList=self.quit_keys):
+                self.quit_requested = True
+                return
+            if any(t > 0 for t in self.mouse.getPressed(getTime=True)[1]):
+                return
@@ -1,33 +1,91 @@
-from psychopy import visual, core, event, gui, sound
-import random
-import numpy
 import sys
 import os
-import csv
-from datetime import datetime
 from collections import namedtuple
+from argentometry.backends import PsychoPyBackend
+from argentometry.errors import TaskAborted
+from argentometry import checkpoint
+from argentometry.checkpoint import CheckpointWriter
+from argentometry.datalog import TrialLog
+from argentometry.monitor import Publisher, SessionStats
+from argentometry import hardware
+from argentometry.index import SessionIndex
+from argentometry import schedule
+from argentometry.response import ResponseCollector
+from argentometry.schema import SART_FIELDS
+from argentometry.stimuli import StimulusCache
+from argentometry.trace import NullTracer, Tracer
+
+# how long before the end of a trial's last frame its responses are read back
+LAST_POLL_MARGIN = 0.002
 
 
 class SART(object):
 
     def __init__(self, **kwargs):
+        # display, audio and input all go through the backend (see backends.py)
+        self.backend = kwargs.get('backend') or PsychoPyBackend()
+        # the subject dialog only needs these; the display and audio modules are
+        # imported after it, on this thread (see backends.py)
+        self.core = self.backend.core
+        self.gui = self.backend.gui
+        # (subject_id, test_number); asked for in a dialog if not given
+        self.SUBJECT_INFO = kwargs.get('subject_info', None)
+        # record a timing trace, written next to the log (see trace.py)
+        self.TRACE = kwargs.get('trace', False)
+        self.TRACE_CAPACITY = kwargs.get('trace_capacity', 200000)
+        # shared by the tasks of a battery (see battery.py): an open window and
+        # its mouse, a Calibration whose audio is already started, and a dict
+        # of reusable resources (decoded sounds, stimuli)
+        self.shared_window = kwargs.get('window', None)
+        self.shared_mouse = kwargs.get('mouse', None)
+        self.shared_calibration = kwargs.get('calibration', None)
+        self.resources = kwargs.get('resources', {})
+        # 'host:port' to send live statistics to (see monitor.py), or None
+        self.MONITOR_ADDRESS = kwargs.get('monitor_address', None)
+        self.MONITOR_INTERVAL = kwargs.get('monitor_interval', 1.0)
+        self.tracer = Tracer(self.core.Clock().getTime, self.TRACE_CAPACITY) if self.TRACE else NullTracer()
+
         self.DIGIT_DISPLAY_TIME = kwargs.get('digit_display_time', 0.250)
         self.DIGIT_RANGE = kwargs.get('digit_range', (0, 9))
         self.DIGIT_SIZES = kwargs.get('digit_sizes', [1.8, 2.7, 3.5, 3.8, 4.5])
-        self.TARGET_DIGIT = kwargs.get(
-            'target_digit', random.randint(*self.DIGIT_RANGE))
+        # None: taken from the schedule
+        self.TARGET_DIGIT = kwargs.get('target_digit', None)
         self.NUM_DIGIT_SETS = kwargs.get('num_digit_sets', 25)
         self.MASK_TIME = kwargs.get('mask_time', 0.900)
+        # None: as measured (see hardware.py), or 60 Hz without a hardware profile
+        self.REFRESH_RATE = kwargs.get('refresh_rate', None)
         self.MASK_DIAMETER = kwargs.get('mask_diameter', 3.0)
         self.MAX_FAILS = kwargs.get('max_fails', 3)
         self.CORRECT_FREQ = kwargs.get('correct_freq', 440)
         self.WRONG_FREQ = kwargs.get('wrong_freq', 330)
         self.TONE_LENGTH = kwargs.get('tone_length', 0.5)
-        self.SOUND_INIT_SAMPLES = kwargs.get('sound_init_samples', 48000)
+        # None: from this machine's hardware profile (see hardware.py)
+        self.SOUND_INIT_SAMPLES = kwargs.get('sound_init_samples', None)
+        self.SOUND_BUFFER = kwargs.get('sound_buffer', None)
+        # None: no profile; audio defaults and durations as given
+        self.HARDWARE_PROFILE_DIR = kwargs.get('hardware_profile_dir', hardware.PROFILE_DIR)
+        self.RECALIBRATE = kwargs.get('recalibrate', False)
         self.PRACTICE_DIGIT_SETS = kwargs.get('practice_digit_sets', 2)
         self.DATA_DIR = kwargs.get('data_dir', 'sart_data')
+        self.MONITOR = kwargs.get('monitor', 'testMonitor')
         self.MONITOR_RESOLUTION = kwargs.get('monitor_resolution', (1024, 768))
         self.FULLSCREEN = kwargs.get('fullscreen', True)
+        # keys that count as a response in addition to a mouse click
+        self.RESPONSE_KEYS = kwargs.get('response_keys', [])
+        # digit orders, sizes and the target are drawn up front from a schedule
+        # seeded by subject and test number (see schedule.py), or read from
+        # schedule_file if given
+        self.SCHEDULE_FILE = kwargs.get('schedule_file', None)
+        self.SCHEDULE_SEED = kwargs.get('schedule_seed', None)
+        self.NO_REPEATS = kwargs.get('no_repeats', False)
+        self.MIN_TARGET_GAP = kwargs.get('min_target_gap', 0)
+        # whether to resume an interrupted session (see checkpoint.py); None: ask
+        self.RESUME = kwargs.get('resume', None)
+
+        # the hardware profile is read before the subject dialog goes up
+        self.calibration = self.shared_calibration or hardware.calibration(
+            self.backend, self.MONITOR, self.MONITOR_RESOLUTION, self.FULLSCREEN,
+            self.HARDWARE_PROFILE_DIR, self.RECALIBRATE)
 
         # if the datadir doesn't exist, create it. 
         if not os.path.isdir(self.DATA_DIR):
@@ -38,104 +96,243 @@ class SART(object):
                 print "Error: cannot create data directory: " + self.DATA_DIR
                 sys.exit(1)
 
-        # then, collect the subject's ID and text number. If the file already exists, prompt to confirm overwrite
-        while True:
-            subject_info = self.get_subject_info(sys.argv[1:])
-            self.log_file = os.path.join(
-                self.DATA_DIR, '_'.join(subject_info) + '.csv')
-
-            if os.path.isfile(self.log_file):
-                rename_dialog = gui.Dlg(title='Error: Log File Exists')
-                rename_dialog.addText(
-                    'A log file with this subject id ({0}) and test number {1} already exists. Overwrite?'.format(*subject_info))
-                rename_dialog.show()
-
-                if rename_dialog.OK:
-                    break
-                else:
-                    break
-            else:
-                break
-
-        #self.log_file = open(self.log_file, "w")
-
-        self.data = []
+        # sessions already recorded in the data directory (see index.py)
+        self.index = SessionIndex(self.DATA_DIR)
+
+        # then, collect the subject's ID and test number. An interrupted session
+        # can be resumed; otherwise, if the session already exists, either
+        # overwrite it or move on to the next free test number
+        subject_info = self.get_subject_info(self.SUBJECT_INFO or sys.argv[1:])
+        self.resume = self.offer_resume(subject_info)
+        if self.resume is None and self.index.exists(*subject_info):
+            next_test = self.index.next_test(subject_info[0])
+            rename_dialog = self.gui.Dlg(title='Error: Log File Exists')
+            rename_dialog.addText(
+                'A log file with this subject id ({0}) and test number {1} already exists. Overwrite?\n\n'
+                'Cancel to use the next free test number, {2}, instead.'.format(subject_info[0], subject_info[1], next_test))
+            rename_dialog.show()
+
+            if not rename_dialog.OK:
+                subject_info = subject_info[0], str(next_test)
+        self.subject_info = subject_info
+        self.log_file = os.path.join(
+            self.DATA_DIR, '_'.join(subject_info) + '.csv')
+
+        self.visual = self.backend.visual
+        self.event = self.backend.event
+        self.sound = self.backend.sound
+
+        with self.tracer.span('schedule', 'startup'):
+            self.schedule = self.make_schedule(subject_info)
+            self.TARGET_DIGIT = self.schedule['target']
+
+        # rows are streamed to <log_file>.partial, which becomes log_file in quit()
+        # the log is only fsync'd at the end of each block: one trial's mask
+        # runs straight into the next digit, so there is no untimed gap to
+        # sync in. Until then the unsynced rows are kept in the checkpoint.
+        self.log = TrialLog(self.log_file, rows=checkpoint.recover(self.log_file, self.resume) if self.resume else ())
+        self.index.start(subject_info[0], subject_info[1], 'sart')
+        # where the session is, saved after every trial from a background thread
+        self.checkpoint = CheckpointWriter(checkpoint.checkpoint_path(self.log_file))
+
+        # running statistics, updated as trials are logged and published from
+        # a background thread
+        self.stats = SessionStats('sart', *subject_info)
+        self.publisher = None
+        if self.MONITOR_ADDRESS:
+            self.publisher = Publisher(self.stats, self.MONITOR_ADDRESS, self.MONITOR_INTERVAL)
+            self.publisher.start()
 
         # this is the basic data output format (to CSV)
-        self.Datum = namedtuple(
-            'Datum', ['trial', 'target', 'digit', 'success', 'rt', 'note'])
-
-        sound.init(self.SOUND_INIT_SAMPLES, buffer=128)
+        # rt is relative to digit onset, mask_rt to mask onset (negative if the
+        # response came before the mask was shown). onset and mask_onset are
+        # the flip times on the session clock, and dropped the number of
+        # frames dropped during the trial.
+        self.Datum = namedtuple('Datum', SART_FIELDS)
+
+        # audio settings and the refresh interval come from this machine's
+        # hardware profile, which is calibrated on first launch
+        with self.tracer.span('sound.init', 'startup'):
+            self.SOUND_INIT_SAMPLES, self.SOUND_BUFFER = self.calibration.init_sound(
+                self.sound, self.SOUND_INIT_SAMPLES, self.SOUND_BUFFER)
 
         # init components for rest of experiment
-        self.sound_correct = sound.Sound(
-            value=self.CORRECT_FREQ, secs=self.TONE_LENGTH)
-        self.sound_incorrect = sound.Sound(
-            value=self.WRONG_FREQ, secs=self.TONE_LENGTH)
-
-        self.window = visual.Window(
-            self.MONITOR_RESOLUTION, monitor='testMonitor', units='cm', fullscr=self.FULLSCREEN)
-        self.mouse = event.Mouse(win=self.window)
-
-        self.MASTER_CLOCK = core.Clock() # this is never used, holdover from original code
-        self.TIMER = core.Clock() 
+        with self.tracer.span('sounds', 'startup'):
+            self.sound_correct = self.sound.Sound(
+                value=self.CORRECT_FREQ, secs=self.TONE_LENGTH)
+            self.sound_incorrect = self.sound.Sound(
+                value=self.WRONG_FREQ, secs=self.TONE_LENGTH)
+
+        with self.tracer.span('window', 'startup'):
+            if self.shared_window is not None:
+                self.window = self.shared_window
+                self.window.units = 'cm'
+                self.mouse = self.shared_mouse or self.event.Mouse(win=self.window)
+            else:
+                self.window = self.visual.Window(
+                    self.MONITOR_RESOLUTION, monitor=self.MONITOR, units='cm', fullscr=self.FULLSCREEN)
+                self.mouse = self.event.Mouse(win=self.window)
+
+            # measured on first launch; durations are then whole frames
+            self.hardware = self.calibration.measure_display(self.window, self.core)
+        if self.REFRESH_RATE:
+            self.FRAME_INTERVAL = 1.0 / self.REFRESH_RATE
+        elif self.hardware is not None:
+            self.FRAME_INTERVAL = self.hardware.refresh_interval
+        else:
+            self.FRAME_INTERVAL = 1.0 / 60
+        # the digit and the mask are shown for whole numbers of frames
+        self.DIGIT_DISPLAY_FRAMES = max(1, int(round(self.DIGIT_DISPLAY_TIME / self.FRAME_INTERVAL)))
+        self.MASK_FRAMES = max(1, int(round(self.MASK_TIME / self.FRAME_INTERVAL)))
+
+        # session clock; every flip of a trial is timestamped on it
+        self.MASTER_CLOCK = self.core.Clock()
+        self.TIMER = self.core.Clock()
+
+        # frame-locked, event-timestamped response collection (see response.py)
+        self.responses = ResponseCollector(
+            self.window, self.mouse, self.TIMER, self.event, response_keys=self.RESPONSE_KEYS)
+
+        # every digit at every size, plus the masks, built once up front
+        with self.tracer.span('stimuli', 'startup'):
+            # a battery keeps them, already rendered, for its next session
+            key = ('sart.stimuli', tuple(self.DIGIT_RANGE), tuple(self.DIGIT_SIZES))
+            if key not in self.resources:
+                stimuli = StimulusCache(
+                    self.visual, self.window, range(self.DIGIT_RANGE[0], self.DIGIT_RANGE[1] + 1), self.DIGIT_SIZES)
+                stimuli.add_mask('practice', *self.make_mask([0.05, -0.39]))
+                stimuli.add_mask('main', *self.make_mask([0.01, -0.63]))
+                stimuli.prerender()
+                self.resources[key] = stimuli
+            self.stimuli = self.resources[key]
+
+        self.trace_session()
+
+    def trace_session(self):
+        # the parts of a session that get a span every time they run
+        self.tracer.wrap(self.window, 'flip', 'flip', 'frame')
+        for sound in (self.sound_correct, self.sound_incorrect):
+            self.tracer.wrap(sound, 'play', 'sound.play', 'sound')
+        for method in ('practice_trial', 'main_trial', 'digit_trial', 'displayDigit'):
+            self.tracer.wrap(self, method)
+        self.tracer.wrap(self.log, 'sync', 'log.sync', 'io')
+        self.tracer.wrap(self.log, 'close', 'log.close', 'io')
+
+    def offer_resume(self, subject_info):
+        # a checkpoint is left behind only by a session that was interrupted
+        log_file = os.path.join(self.DATA_DIR, '_'.join(subject_info) + '.csv')
+        state = checkpoint.load(checkpoint.checkpoint_path(log_file))
+        if state is None or state.get('task') != 'sart' or self.RESUME is False:
+            return None
+        if self.RESUME is None:
+            resume_dialog = self.gui.Dlg(title='Resume Session')
+            resume_dialog.addText(
+                'The session with subject id ({0}) and test number {1} was interrupted at trial {2} of the {3} block. '
+                'Resume it?'.format(subject_info[0], subject_info[1], state['trial'] + 1, state['phase']))
+            resume_dialog.show()
+            if not resume_dialog.OK:
+                return None
+        return state
+
+    def resume_state(self, phase):
+        # the checkpoint, if the session resumes in this phase
+        if self.resume is not None and self.resume['phase'] == phase:
+            state, self.resume = self.resume, None
+            return state
+        return None
+
+    def save_checkpoint(self, phase, trial, correct):
+        self.checkpoint.update({'task': 'sart', 'phase': phase, 'trial': trial, 'correct': correct,
+                                'target': self.TARGET_DIGIT}, self.log)
+
+    def make_schedule(self, subject_info):
+        saved = os.path.splitext(self.log_file)[0] + '.schedule.json'
+        if self.resume is not None and os.path.isfile(saved):
+            # the interrupted session's own schedule
+            session = schedule.load(saved, 'sart', self.DIGIT_RANGE, self.DIGIT_SIZES)
+        elif self.SCHEDULE_FILE:
+            session = schedule.load(self.SCHEDULE_FILE, 'sart', self.DIGIT_RANGE, self.DIGIT_SIZES)
+        else:
+            seed = self.SCHEDULE_SEED
+            if seed is None:
+                seed = schedule.session_seed('sart', *subject_info)
+            session = schedule.sart_schedule(
+                seed, self.DIGIT_RANGE, self.DIGIT_SIZES, self.PRACTICE_DIGIT_SETS, self.NUM_DIGIT_SETS,
+                self.TARGET_DIGIT, self.NO_REPEATS, self.MIN_TARGET_GAP)
+        schedule.save(session, os.path.splitext(self.log_file)[0] + '.schedule.json')
+        return session
 
     def run(self):
-        instructions = visual.TextStim(self.window, text="Practice\n\nIn this task, a number will be shown on the screen.\n\n" +
-                                       "If it is not {0}, then click your mouse anywhere on the screen. If it is a {0}, then do not click anywhere.\n\n".format(self.TARGET_DIGIT) +
-                                       "Please give equal importance to accuracy and speed.\n\nClick anywhere to continue.", wrapWidth=30).draw()
-        self.window.flip()
+        # returns True when the session was completed, False when the
+        # participant quit early
+        try:
+            self.run_session()
+        except TaskAborted:
+            return False
+        self.quit()
+        return True
 
-        # wait for a mouseclick to continue
-        while 1 not in self.mouse.getPressed():
-            pass
+    def run_session(self):
+        # a resumed session skips the phases it had finished
+        if self.resume is None or self.resume['phase'] == 'practice':
+            instructions = self.visual.TextStim(self.window, text="Practice\n\nIn this task, a number will be shown on the screen.\n\n" +
+                                           "If it is not {0}, then click your mouse anywhere on the screen. If it is a {0}, then do not click anywhere.\n\n".format(self.TARGET_DIGIT) +
+                                           "Please give equal importance to accuracy and speed.\n\nClick anywhere to continue.", wrapWidth=30)
 
-        visual.TextStim(
-            self.window, text="This is the sound of a correct response.").draw()
-        self.window.flip()
-        self.sound_correct.play()
-        core.wait(2)
-        visual.TextStim(
-            self.window, text="This is the sound of an incorrect response.").draw()
-        self.window.flip()
-        self.sound_incorrect.play()
-        core.wait(2)
+            # wait for a mouseclick to continue
+            self.wait_for_click(instructions)
+
+            self.visual.TextStim(
+                self.window, text="This is the sound of a correct response.").draw()
+            self.window.flip()
+            self.sound_correct.play()
+            self.core.wait(2)
+            self.visual.TextStim(
+                self.window, text="This is the sound of an incorrect response.").draw()
+            self.window.flip()
+            self.sound_incorrect.play()
+            self.core.wait(2)
 
-        # run the practice trial
-        self.practice_trial()
+            # run the practice trial
+            self.practice_trial()
 
-        instructions = visual.TextStim(
+        instructions = self.visual.TextStim(
             self.window,
             text="Sustained Attention\n\n" +
             "In this task, a number will be shown on the screen.\n\n" +
             "If it is not {0}, then click you rmouse anywhere on the screen. If it is {0}, do not click anywhere.\n\n".format(self.TARGET_DIGIT) +
             "Please give equal importance to accuracy and speed.\n\n" +
                  "Click anywhere to continue.",
-            wrapWidth=30).draw()
-
-        self.window.flip()
+            wrapWidth=30)
 
         # wait for mouse click
-        while 1 not in self.mouse.getPressed():
-            pass
+        self.wait_for_click(instructions)
 
         self.main_trial()
 
-        self.quit()
-
-    def quit(self):
-        with open(self.log_file, "w") as output:
-            csvwriter = csv.writer(output, delimiter=',',
-                                   quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            for row in self.data:
-                csvwriter.writerow(row)
-
-        goodbye = visual.TextStim(self.window, "Thank you for your participation.", wrapWidth = 30).draw()
+    def quit(self, status='complete'):
+        self.log.close()
+        self.checkpoint.close()
+        self.index.finish(self.subject_info[0], self.subject_info[1], self.log.rows, status)
+        self.index.close()
+        self.tracer.dump(os.path.splitext(self.log_file)[0] + '.trace.json')
+        # the window and sounds may outlive this task (see battery.py)
+        self.tracer.unwrap()
+        if self.publisher is not None:
+            self.publisher.stop()
+
+        goodbye = self.visual.TextStim(self.window, "Thank you for your participation.", wrapWidth = 30).draw()
         self.window.flip()
-        core.wait(2)
+        self.core.wait(2)
+
+        # a shared window belongs to the battery
+        if self.shared_window is None:
+            self.window.close()
 
-        self.window.close()
-        sys.exit(0)
+    def abort(self):
+        # the participant pressed q: save everything, then unwind to run()
+        self.quit('aborted')
+        raise TaskAborted()
 
 
     def practice_trial(self):
@@ -146,102 +343,37 @@ class SART(object):
         # while 1 in self.mouse.getPressed():
         #     pass
 
-        mask1 = visual.Circle(
-            self.window, radius=self.MASK_DIAMETER / 2, pos=[0.05, -0.39], lineWidth=10)
-        mask2 = visual.TextStim(self.window, text="+",
-                                height=(self.MASK_DIAMETER + 2.4))
-        digitSet = range(self.DIGIT_RANGE[0], self.DIGIT_RANGE[
-                         1] + 1) * self.PRACTICE_DIGIT_SETS
-        random.shuffle(digitSet)
+        self.stats.start_phase('practice')
+        masks = self.stimuli.mask('practice')
+        digitSet = self.schedule['practice']['digits']
+        sizes = self.schedule['practice']['sizes']
 
         correct = 0
+        start = 0
+        state = self.resume_state('practice')
+        if state is not None:
+            start, correct = state['trial'], state['correct']
 
-        for digit in digitSet:
-            pressed = False
-            self.TIMER.reset()
+        for trial_num, (digit, size) in enumerate(zip(digitSet, sizes)[start:], start):
+            # practice trials are shown at half speed
+            d = self.digit_trial('practice', digit, size, masks,
+                                 self.DIGIT_DISPLAY_FRAMES * 2, self.MASK_FRAMES * 2)
+            if d.success:
+                correct += 1
 
-            self.displayDigit(digit)
+            self.log.append(d)
+            self.stats.add_sart(d)
+            self.save_checkpoint('practice', trial_num + 1, correct)
 
-            reactionTime = 0
-            success = False
-            note = ''
-
-            # in this loop the digit is visible
-            while self.TIMER.getTime() < self.DIGIT_DISPLAY_TIME * 2:
-                if 1 in self.mouse.getPressed() and not pressed:
-                    reactionTime = self.TIMER.getTime()
-                    pressed = True
-
-                    success = (digit is not self.TARGET_DIGIT)
-                    note = 'press nomask'
-
-                    # mouseclick was registered before the mask was shown.
-                    # The test was successful if the digit displayed
-                    # was NOT the target digit.
-
-                    if success:
-                        correct += 1
-                        self.sound_correct.play()
-                    else:
-                        self.sound_incorrect.play()
-
-            mask1.draw()
-            mask2.draw()
-            self.window.flip()
-
-            # in this loop the digit is hidden and the mask is visible
-            while self.TIMER.getTime() < (self.DIGIT_DISPLAY_TIME + self.MASK_TIME) * 2:
-                if 1 in self.mouse.getPressed() and not pressed:
-                    reactionTime = self.TIMER.getTime()
-                    pressed = True
-
-                    success = (digit is not self.TARGET_DIGIT)
-                    note = 'press mask'
-
-                    # mouseclick was registered after the mask was shown.
-                    # The test was successful if the digit displayed
-                    # was NOT the target digit.
-
-                    if success:
-                        correct += 1
-                        self.sound_correct.play()
-                    else:
-                        self.sound_incorrect.play()
-
-                if event.getKeys(keyList=['q', 'excape']):
-                    self.quit()
-                    #core.quit()
-
-            if not pressed:
-                reactionTime = self.TIMER.getTime()
-                success = (digit is self.TARGET_DIGIT)
-                note = 'nopress'
-
-                # no mouseclick was registered.
-                # the test was successful if the target digit WAS the digit
-                # displayed.
-
-                if success:
-                    correct += 1
-                    self.sound_correct.play()
-                else:
-                    self.sound_incorrect.play()
-
-            d = self.Datum(trial='practice',
-                           target=self.TARGET_DIGIT,
-                           digit=digit,
-                           success=success,
-                           rt=reactionTime,
-                           note=note)
-
-            self.data.append(d)
+        self.log.sync()
+        self.save_checkpoint('main', 0, 0)
 
         accuracy = (1.0 * correct) / len(digitSet)
-        feedback = visual.TextStim(
+        feedback = self.visual.TextStim(
             self.window, text="You had an accuracy of {:%}".format(accuracy))
         feedback.draw()
         self.window.flip()
-        core.wait(5)
+        self.core.wait(5)
 
     def main_trial(self):
 
@@ -251,101 +383,146 @@ class SART(object):
         # while 1 in self.mouse.getPressed():
         #     pass
 
-        mask1 = visual.Circle(
-            self.window, radius=self.MASK_DIAMETER / 2, pos=[0.01, -0.63], lineWidth=10)
-        mask2 = visual.TextStim(self.window, text="+",
-                                height=self.MASK_DIAMETER + 2.4)
-        digitSet = range(self.DIGIT_RANGE[0], self.DIGIT_RANGE[
-                         1] + 1) * self.NUM_DIGIT_SETS
-        random.shuffle(digitSet)
+        self.stats.start_phase('main')
+        masks = self.stimuli.mask('main')
+        digitSet = self.schedule['main']['digits']
+        sizes = self.schedule['main']['sizes']
 
         correct = 0
+        start = 0
+        state = self.resume_state('main')
+        if state is not None:
+            start, correct = state['trial'], state['correct']
 
-        for digit in digitSet:
-            pressed = False
-            self.TIMER.reset()
-            self.displayDigit(digit)
-
-            reactionTime = 0
-            success = False
-            note = ''
-
-            while self.TIMER.getTime() < self.DIGIT_DISPLAY_TIME:
-                if 1 in self.mouse.getPressed() and not pressed:
-                    pressed = True
-                    reactionTime = self.TIMER.getTime()
-                    success = (digit is not self.TARGET_DIGIT)
-                    note = 'press nomask'
-
-                    if success:
-                        correct += 1
-                        self.sound_correct.play()
-                    else:
-                        self.sound_incorrect.play()
-
-            mask1.draw()
-            mask2.draw()
-            self.window.flip()
-
-            while self.TIMER.getTime() < self.DIGIT_DISPLAY_TIME + self.MASK_TIME:
-                if 1 in self.mouse.getPressed() and not pressed:
-                    pressed = True
-
-                    reactionTime = self.TIMER.getTime()
-                    success = (digit is not self.TARGET_DIGIT)
-                    note = 'press mask'
+        for trial_num, (digit, size) in enumerate(zip(digitSet, sizes)[start:], start):
+            d = self.digit_trial('main', digit, size, masks,
+                                 self.DIGIT_DISPLAY_FRAMES, self.MASK_FRAMES)
+            if d.success:
+                correct += 1
 
-                    if success:
-                        correct += 1
-                        self.sound_correct.play()
-                    else:
-                        self.sound_incorrect.play()
+            self.log.append(d)
+            self.stats.add_sart(d)
+            self.save_checkpoint('main', trial_num + 1, correct)
 
-                if event.getKeys(keyList=['q', 'escape']):
-                    self.quit()
-                    #core.quit()
-
-            if not pressed:
-                reactionTime = self.TIMER.getTime()
-                success = (digit is self.TARGET_DIGIT)
-                note = 'nopress'
-
-                # no mouseclick was registered.
-                # the test was successful if the target digit WAS the digit
-                # displayed.
-
-                if success:
-                    correct += 1
-                    self.sound_correct.play()
-                else:
-                    self.sound_incorrect.play()
-
-            d = self.Datum(trial='main',
-                           target=self.TARGET_DIGIT,
-                           digit=digit,
-                           success=success,
-                           rt=reactionTime,
-                           note=note)
-
-            self.data.append(d)
+        self.log.sync()
 
         accuracy = (1.0 * correct) / len(digitSet)
-        targetaccuracy = (1.0 * 5) / self.NUM_DIGIT_SETS
-        feedback = visual.TextStim(
-            self.window, text="--Disregard-- You had an accuracy of {:%}".format(targetaccuracy))
+        feedback = self.visual.TextStim(
+            self.window, text="You had an accuracy of {:%}".format(accuracy))
         feedback.draw()
         self.window.flip()
 
-    def displayDigit(self, digit):
-        digit = visual.TextStim(self.window, text=str(digit))
-        digit.setHeight(random.choice(self.DIGIT_SIZES))
-        digit.draw()
+    def digit_trial(self, trial, digit, size, masks, display_frames, mask_frames):
+        # One digit for display_frames frames followed by the mask for
+        # mask_frames frames, timed by counting flips. The screen is redrawn
+        # once per frame and responses are read back after every flip (see
+        # response.py). Every flip is timestamped on the session clock so
+        # dropped frames show up.
+        responses = self.responses
+        stim = self.displayDigit(digit, size)
+        onset = last_flip = self.MASTER_CLOCK.getTime()
+        dropped = 0
+
+        frame = 1
+        while frame < display_frames + mask_frames:
+            if responses.poll():
+                self.tracer.instant('response', 'input', rt=responses.rt, source=responses.source)
+                self.feedback(digit != self.TARGET_DIGIT)
+            if responses.quit_requested:
+                self.abort()
+            if frame < display_frames:
+                # the digit is visible
+                stim.draw()
+            else:
+                # the digit is hidden and the mask is visible
+                for mask in masks:
+                    mask.draw()
+                if frame == display_frames:
+                    responses.mark_mask()
+            self.window.flip()
+            now = self.MASTER_CLOCK.getTime()
+            # an interval of n frames between two flips means n - 1 were dropped
+            dropped += max(0, int(round((now - last_flip) / self.FRAME_INTERVAL)) - 1)
+            last_flip = now
+            if frame == display_frames:
+                mask_onset = now
+            frame += 1
+            # a headless backend jumps over the frames in which nothing can
+            # happen (none of them is dropped); the one that shows the mask
+            # always runs
+            end = display_frames if frame <= display_frames else display_frames + mask_frames
+            skipped = self.backend.skip_frames(self.window, end - frame)
+            if skipped:
+                last_flip = self.MASTER_CLOCK.getTime()
+                frame += skipped
+
+        # responses during the last frame. The next trial's onset flip clears
+        # the event buffers, so read them once that frame is nearly over
+        self.core.wait(max(0.0, last_flip + self.FRAME_INTERVAL - LAST_POLL_MARGIN - self.MASTER_CLOCK.getTime()),
+                       hogCPUperiod=1)
+        if responses.poll():
+            self.tracer.instant('response', 'input', rt=responses.rt, source=responses.source)
+            self.feedback(digit != self.TARGET_DIGIT)
+        if responses.quit_requested:
+            self.abort()
+
+        if responses.rt is not None:
+            # a response was registered. The test was successful if the digit
+            # displayed was NOT the target digit.
+            reactionTime = responses.rt
+            success = (digit != self.TARGET_DIGIT)
+            note = 'press nomask' if responses.before_mask() else 'press mask'
+        else:
+            # no response was registered. The test was successful if the
+            # target digit WAS the digit displayed.
+            reactionTime = responses.elapsed()
+            success = (digit == self.TARGET_DIGIT)
+            note = 'nopress'
+            self.feedback(success)
+
+        return self.Datum(trial=trial,
+                          target=self.TARGET_DIGIT,
+                          digit=digit,
+                          success=success,
+                          rt=reactionTime,
+                          note=note,
+                          mask_rt=responses.mask_rt(reactionTime),
+                          onset=onset,
+                          mask_onset=mask_onset,
+                          dropped=dropped)
+
+    def feedback(self, success):
+        if success:
+            self.sound_correct.play()
+        else:
+            self.sound_incorrect.play()
+
+    def wait_for_click(self, *stims):
+        self.backend.cue('continue', device='mouse')
+        self.responses.wait_for_click(*stims)
+        if self.responses.quit_requested:
+            self.abort()
+
+    def make_mask(self, pos):
+        circle = self.visual.Circle(
+            self.window, radius=self.MASK_DIAMETER / 2, pos=pos, lineWidth=10)
+        cross = self.visual.TextStim(self.window, text="+",
+                                height=self.MASK_DIAMETER + 2.4)
+        return circle, cross
+
+    def displayDigit(self, digit, size):
+        stim = self.stimuli.digit(digit, size)
+        stim.draw()
+        # the response clock starts on the flip that shows the digit
+        self.responses.start()
+        self.window.callOnFlip(self.backend.cue, 'digit', digit=digit, target=self.TARGET_DIGIT)
         self.window.flip()
+        return stim
 
     def get_subject_info(self, args=[]):
         # no cli args
         if len(args) == 0:
-            subject_info = gui.DlgFromDict(
+            subject_info = self.gui.DlgFromDict(
                 dictionary={'Subject ID': '', 'Test Number': '1'},
                 title='SART Task')
 
@@ -0,0 +1,214 @@
+"""Pre-generated, seeded trial schedules.
+
+A schedule holds every random choice a session will make -- for DigitSpan
+the practice sequences, the preset sequences and a pool of random sequences
+for every length of every block; for SART the target digit and the digit
+order and font sizes of each phase -- so the tasks only read from it during
+the run. It is generated from a seed derived from the task, subject ID and
+test number (or given explicitly), so the same session can be regenerated
+exactly, and it is saved next to the log as '<subject>_<test>.schedule.json'.
+
+    python -m argentometry.schedule sart S01 1 -o S01_1.schedule.json
+
+Optional constraints:
+    no_repeats       no digit follows itself (within a DigitSpan sequence,
+                     or between consecutive SART trials)
+    min_target_gap   at least this many non-target SART trials between two
+                     targets
+"""
+import argparse
+import hashlib
+import json
+import sys
+
+import numpy
+
+SCHEDULE_VERSION = 1
+
+# the standard preset sequences, given in order before the random phase
+SEQUENCES = {
+    'forward':  [(9, 7),
+                 (6, 3),
+                 (5, 8, 2),
+                 (6, 9, 4),
+                 (7, 2, 8, 6),
+                 (6, 4, 3, 9),
+                 (4, 2, 7, 3, 1),
+                 (7, 5, 8, 3, 6),
+                 (3, 9, 2, 4, 8, 7),
+                 (6, 1, 9, 4, 7, 3),
+                 (4, 1, 7, 9, 3, 8, 6),
+                 (6, 9, 1, 7, 4, 2, 8),
+                 (3, 8, 2, 9, 6, 1, 7, 4),
+                 (5, 8, 1, 3, 2, 6, 4, 7),
+                 (2, 7, 5, 8, 6, 3, 1, 9, 4),
+                 (7, 1, 3, 9, 4, 2, 5, 6, 8)],
+    'reverse':  [(3, 1),
+                 (2, 4),
+                 (4, 6),
+                 (5, 7),
+                 (6, 2, 9),
+                 (4, 7, 5),
+                 (8, 2, 7, 9),
+                 (4, 9, 6, 8),
+                 (6, 5, 8, 4, 3),
+                 (1, 5, 4, 8, 6),
+                 (5, 3, 7, 4, 1, 8),
+                 (7, 2, 4, 8, 5, 6),
+                 (8, 1, 4, 9, 3, 6, 2),
+                 (4, 7, 3, 9, 6, 2, 8),
+                 (9, 4, 3, 7, 6, 2, 1, 8),
+                 (7, 2, 8, 1, 5, 6, 4, 3)]
+}
+
+
+def session_seed(task, subject_id, test_number):
+    """A stable 32-bit seed for one session."""
+    key = '{0}:{1}:{2}'.format(task, subject_id, test_number)
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def random_sequences(rng, n, length, no_repeats=False):
+    """n random digit sequences of the given length, as lists."""
+    if not no_repeats:
+        return rng.randint(10, size=(n, length)).tolist()
+    # each digit is one of the 9 that differ from the one before it
+    steps = numpy.c_[rng.randint(10, size=(n, 1)), 1 + rng.randint(9, size=(n, length - 1))]
+    return (numpy.cumsum(steps, axis=1) % 10).tolist()
+
+
+def digit_order(rng, digits, sets, target, no_repeats=False, min_target_gap=0, attempts=1000):
+    """`sets` copies of `digits` in a random order meeting the constraints."""
+    order = list(digits) * sets
+    if not no_repeats and not min_target_gap:
+        rng.shuffle(order)
+        return order
+
+    # draw one trial at a time, weighted by how many of each digit are left,
+    # and start over on a dead end
+    for attempt in range(attempts):
+        counts = dict((d, sets) for d in digits)
+        order = []
+        since_target = min_target_gap
+        for i in range(len(digits) * sets):
+            candidates = [d for d in digits if counts[d] and
+                          not (no_repeats and order and d == order[-1]) and
+                          not (d == target and since_target < min_target_gap)]
+            if not candidates:
+                break
+            weights = numpy.array([counts[d] for d in candidates], dtype=numpy.float64)
+            d = candidates[rng.choice(len(candidates), p=weights / weights.sum())]
+            counts[d] -= 1
+            since_target = 0 if d == target else since_target + 1
+            order.append(d)
+        else:
+            return order
+    raise ValueError("no digit order satisfies the schedule constraints")
+
+
+def digitspan_schedule(seed, practice_trials=2, practice_len=3, blocks=1, sequence_range=None,
+                       per_length=3, no_repeats=False, sequences=SEQUENCES):
+    """Every sequence a DigitSpan session can present.
+
+    Each block has the preset sequences and, for every length in its
+    direction's range, a pool of `per_length` random sequences that the task
+    takes from in order.
+    """
+    rng = numpy.random.RandomState(seed)
+    sequence_range = sequence_range or {'forward': {'min': 3, 'max': 15}, 'reverse': {'min': 2, 'max': 15}}
+    schedule = {
+        'version': SCHEDULE_VERSION,
+        'task': 'digitspan',
+        'seed': seed,
+        'practice': [rng.permutation(10)[:practice_len].tolist() for i in range(practice_trials)],
+        'blocks': {},
+    }
+    for direction in ('forward', 'reverse'):
+        # the task keeps going from the last preset's length, however short
+        # the configured range is
+        lo = min([sequence_range[direction]['min']] + [len(s) for s in sequences[direction]])
+        hi = max([sequence_range[direction]['max']] + [len(s) for s in sequences[direction]])
+        schedule['blocks'][direction] = [{
+            'preset': [list(s) for s in sequences[direction]],
+            'random': dict((str(length), random_sequences(rng, per_length, length, no_repeats))
+                           for length in range(lo, hi + 1)),
+        } for block in range(blocks)]
+    return schedule
+
+
+def sart_schedule(seed, digit_range=(0, 9), digit_sizes=(1.8, 2.7, 3.5, 3.8, 4.5), practice_sets=2,
+                  main_sets=25, target=None, no_repeats=False, min_target_gap=0):
+    """The target digit, and the digit order and sizes of each SART phase."""
+    rng = numpy.random.RandomState(seed)
+    digits = range(digit_range[0], digit_range[1] + 1)
+    if target is None:
+        target = int(rng.randint(digit_range[0], digit_range[1] + 1))
+    schedule = {'version': SCHEDULE_VERSION, 'task': 'sart', 'seed': seed, 'target': target}
+    for phase, sets in (('practice', practice_sets), ('main', main_sets)):
+        order = digit_order(rng, digits, sets, target, no_repeats, min_target_gap)
+        schedule[phase] = {
+            'digits': [int(d) for d in order],
+            'sizes': [digit_sizes[i] for i in rng.randint(len(digit_sizes), size=len(order))],
+        }
+    return schedule
+
+
+def save(schedule, path):
+    with open(path, 'w') as f:
+        json.dump(schedule, f, sort_keys=True)
+
+
+def load(path, task=None, digit_range=None, digit_sizes=None):
+    """Reads a schedule. Given the task it is for (and for SART the digits
+    and sizes the task can draw), checks that the schedule only asks for
+    those, so a mismatch fails before the session starts rather than
+    partway through it."""
+    with open(path) as f:
+        schedule = json.load(f)
+    if schedule.get('version') != SCHEDULE_VERSION:
+        raise ValueError("unsupported schedule version {0}".format(schedule.get('version')))
+    if task is not None and schedule.get('task') != task:
+        raise ValueError("{0} is a schedule for {1}, not {2}".format(path, schedule.get('task'), task))
+    if schedule.get('task') != 'sart':
+        return schedule
+    phases = [schedule['practice'], schedule['main']]
+    if digit_range is not None:
+        unknown = (set([schedule['target']] + [d for phase in phases for d in phase['digits']]) -
+                   set(range(digit_range[0], digit_range[1] + 1)))
+        if unknown:
+            raise ValueError("{0} has digits outside {1}-{2}: {3}".format(
+                path, digit_range[0], digit_range[1], ', '.join(str(d) for d in sorted(unknown))))
+    if digit_sizes is not None:
+        unknown = set(size for phase in phases for size in phase['sizes']) - set(digit_sizes)
+        if unknown:
+            raise ValueError("{0} has digit sizes that are not in digit_sizes: {1}".format(
+                path, ', '.join(str(size) for size in sorted(unknown))))
+    return schedule
+
+
+def sequence_pools(block):
+    """Copies of a block's random sequence pools, keyed by (int) length."""
+    return dict((int(length), list(pool)) for length, pool in block['random'].items())
+
+
+GENERATORS = {'digitspan': digitspan_schedule, 'sart': sart_schedule}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a session schedule with the default task settings.')
+    parser.add_argument('task', choices=sorted(GENERATORS))
+    parser.add_argument('subject_id')
+    parser.add_argument('test_number')
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    subject_id = args.subject_id.upper()
+    seed = args.seed if args.seed is not None else session_seed(args.task, subject_id, args.test_number)
+    schedule = GENERATORS[args.task](seed)
+    save(schedule, args.output or '{0}_{1}.schedule.json'.format(subject_id, args.test_number))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
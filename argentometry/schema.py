@@ -0,0 +1,29 @@
+"""Column layouts of the CSV files the tasks write.
+
+Files have no header row. Files written before a column was added are
+simply shorter: DigitSpan files without `keystrokes` or `onsets`, SART files
+without `mask_rt` or the frame timing columns (`onset`, `mask_onset`,
+`dropped`).
+"""
+import os
+
+DIGITSPAN_FIELDS = ['direction', 'trial', 'expected', 'actual', 'timestamp', 'keystrokes', 'onsets']
+DIGITSPAN_DIRECTIONS = ['practice', 'forward', 'reverse']
+
+SART_FIELDS = ['trial', 'target', 'digit', 'success', 'rt', 'note', 'mask_rt', 'onset', 'mask_onset', 'dropped']
+SART_PHASES = ['practice', 'main']
+SART_NOTES = ['', 'press nomask', 'press mask', 'nopress']
+
+
+def detect_task(row):
+    """Returns 'digitspan' or 'sart' for a row from either task's CSV."""
+    if len(row) > 3 and row[3] in ('True', 'False'):
+        return 'sart'
+    return 'digitspan'
+
+
+def split_name(path):
+    """'<data_dir>/<subject>_<test>.csv' -> (subject, test)."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    subject, _, test = name.rpartition('_')
+    return subject, test
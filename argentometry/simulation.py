@@ -0,0 +1,198 @@
+"""Monte Carlo simulation of the DigitSpan stopping rule.
+
+simulate_block() replays exactly the procedure in DigitSpan.main_trial for
+one direction -- the preset sequences in order, then random sequences with
+each length given three times (the first random length, which repeats the
+last preset length, twice) up to the `forward_max`/`reverse_max` length,
+stopping early after `max_wrong_trials` consecutive failures -- for every
+synthetic subject at once. Subjects are advanced in lock step, one trial per
+iteration, with NumPy arrays holding each subject's procedure state.
+
+A subject with true span s and lapse rate l recalls a sequence of length L
+correctly with probability
+
+    (1 - l) / (1 + exp((L - s) / slope))
+
+so s is the length recalled correctly half the time (ignoring lapses).
+
+simulate_adaptive_block() does the same for DigitSpan's adaptive procedure
+(procedure='adaptive'), whose estimate is compared against the true span in
+place of the max span. Each subject carries a posterior over a grid of spans,
+so subjects are simulated `chunk_size` at a time to bound memory, and each
+trial only updates the subjects still in their block:
+
+    python -m argentometry.simulation -n 100000 --procedure adaptive
+
+    python -m argentometry.simulation -n 1000000
+
+reports, per direction, the distribution of session length (trials), the
+bias and RMSE of the max span against the true span, and the test-retest
+correlation of the max span between two independent sessions.
+"""
+import argparse
+import math
+import sys
+
+import numpy
+
+from argentometry.adaptive import SpanEstimator, p_correct
+from argentometry.schedule import SEQUENCES
+
+CHUNK_SIZE = 20000  # adaptive subjects simulated at once
+
+
+def simulate_block(span, lapse, direction='forward', slope=0.5, max_wrong_trials=2,
+                   sequence_max=15, sequences=SEQUENCES, rng=numpy.random):
+    """Runs one block of one direction for every subject.
+
+    `span` and `lapse` are arrays with one entry per subject (or scalars for
+    lapse). Returns a dict of per-subject arrays: 'max_span', 'trials'.
+    """
+    span = numpy.asarray(span, dtype=numpy.float64)
+    n = len(span)
+    lapse = numpy.asarray(lapse, dtype=numpy.float64) * numpy.ones(n)
+    preset = numpy.array([len(s) for s in sequences[direction]], dtype=numpy.int16)
+
+    sequence_index = numpy.zeros(n, dtype=numpy.int16)
+    sequence_size = numpy.zeros(n, dtype=numpy.int16)
+    repeat = numpy.zeros(n, dtype=numpy.int16)
+    trials_wrong = numpy.zeros(n, dtype=numpy.int16)
+    max_span = numpy.zeros(n, dtype=numpy.int16)
+    trials = numpy.zeros(n, dtype=numpy.int32)
+    active = numpy.ones(n, dtype=bool)
+
+    while active.any():
+        # pick the next sequence length, as in DigitSpan.main_trial
+        from_preset = active & (sequence_index < len(preset))
+        sequence_size[from_preset] = preset[sequence_index[from_preset]]
+        sequence_index[from_preset] += 1
+
+        random_phase = active & ~from_preset
+        grow = random_phase & (repeat >= 2)
+        finished = grow & (sequence_size >= sequence_max)
+        active &= ~finished
+        grow &= ~finished
+        sequence_size[grow] += 1
+        repeat[grow] = 0
+        repeat[random_phase & ~grow & ~finished] += 1
+
+        # run the trial
+        idx = numpy.flatnonzero(active)
+        size = sequence_size[idx]
+        correct = rng.random_sample(len(idx)) < p_correct(size, span[idx], lapse[idx], slope)
+        trials[idx] += 1
+        max_span[idx[correct]] = numpy.maximum(max_span[idx[correct]], size[correct])
+        trials_wrong[idx[correct]] = 0
+        trials_wrong[idx[~correct]] += 1
+        active[idx[trials_wrong[idx] >= max_wrong_trials]] = False
+
+    return {'max_span': max_span, 'trials': trials}
+
+
+def simulate_adaptive_block(span, lapse, direction='forward', slope=0.5, min_trials=4, max_trials=14,
+                            stop_sd=0.6, prior=None, min_length=2, max_length=15, rng=numpy.random,
+                            chunk_size=CHUNK_SIZE):
+    """Runs one adaptive block (DigitSpan.adaptive_block) for every subject.
+
+    Returns a dict of per-subject arrays: 'max_span' (the span estimate),
+    'sd', 'trials'.
+    """
+    span = numpy.asarray(span, dtype=numpy.float64)
+    n = len(span)
+    lapse = numpy.asarray(lapse, dtype=numpy.float64) * numpy.ones(n)
+    prior = prior or {'forward': 6.0, 'reverse': 4.5}
+    results = {'max_span': numpy.empty(n), 'sd': numpy.empty(n), 'trials': numpy.empty(n, dtype=numpy.int32)}
+
+    for start in range(0, n, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n))
+        chunk_span, chunk_lapse = span[chunk], lapse[chunk]
+        estimator = SpanEstimator(len(chunk_span), prior[direction], min_length=min_length, max_length=max_length)
+        idx = numpy.arange(len(chunk_span))
+        for trial in range(max_trials):
+            size = estimator.next_length(idx)
+            correct = rng.random_sample(len(idx)) < p_correct(size, chunk_span[idx], chunk_lapse[idx], slope)
+            estimator.update(size, correct, idx)
+            if trial + 1 >= min_trials:
+                idx = idx[estimator.estimate(idx)[1] > stop_sd]
+            if not len(idx):
+                break
+        results['max_span'][chunk], results['sd'][chunk] = estimator.estimate()
+        results['trials'][chunk] = estimator.trials
+    return results
+
+
+def simulate(n_subjects, span_mean=None, span_sd=1.0, lapse_a=1.0, lapse_b=19.0, slope=0.5,
+             max_wrong_trials=2, forward_max=15, reverse_max=15, seed=None, procedure='standard'):
+    """Simulates two independent sessions for each of n_subjects subjects.
+
+    True spans are normal with mean span_mean[direction] (default 6.5 forward,
+    5.0 reverse) and sd span_sd; lapse rates are Beta(lapse_a, lapse_b), mean
+    5% by default. Returns {direction: stats} with the stats described in
+    report().
+    """
+    rng = numpy.random.RandomState(seed)
+    span_mean = span_mean or {'forward': 6.5, 'reverse': 5.0}
+    lapse = rng.beta(lapse_a, lapse_b, n_subjects)
+    sequence_max = {'forward': forward_max, 'reverse': reverse_max}
+
+    results = {}
+    for direction in ('forward', 'reverse'):
+        span = rng.normal(span_mean[direction], span_sd, n_subjects)
+        if procedure == 'adaptive':
+            sessions = [simulate_adaptive_block(span, lapse, direction, slope, max_length=sequence_max[direction],
+                                                min_length=2 if direction == 'reverse' else 3, rng=rng)
+                        for test in (1, 2)]
+        else:
+            sessions = [simulate_block(span, lapse, direction, slope, max_wrong_trials,
+                                       sequence_max[direction], rng=rng) for test in (1, 2)]
+        first, second = sessions
+        error = first['max_span'] - span
+        results[direction] = {
+            'trials': first['trials'],
+            'max_span': first['max_span'],
+            'true_span': span,
+            'bias': error.mean(),
+            'rmse': math.sqrt((error ** 2).mean()),
+            'test_retest_r': numpy.corrcoef(first['max_span'], second['max_span'])[0, 1],
+        }
+    return results
+
+
+def report(results, f=sys.stdout):
+    for direction in ('forward', 'reverse'):
+        r = results[direction]
+        trials = r['trials']
+        f.write('{0}\n'.format(direction))
+        f.write('  trials: mean {0:.2f}, sd {1:.2f}, 5/50/95% {2:.0f}/{3:.0f}/{4:.0f}, max {5}\n'.format(
+            trials.mean(), trials.std(), numpy.percentile(trials, 5),
+            numpy.percentile(trials, 50), numpy.percentile(trials, 95), trials.max()))
+        f.write('  max span: mean {0:.2f}, sd {1:.2f}\n'.format(r['max_span'].mean(), r['max_span'].std()))
+        f.write('  bias {0:+.3f}, rmse {1:.3f}, test-retest r {2:.3f}\n'.format(
+            r['bias'], r['rmse'], r['test_retest_r']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate the DigitSpan procedure.')
+    parser.add_argument('-n', '--subjects', type=int, default=100000)
+    parser.add_argument('--forward-span', type=float, default=6.5)
+    parser.add_argument('--reverse-span', type=float, default=5.0)
+    parser.add_argument('--span-sd', type=float, default=1.0)
+    parser.add_argument('--lapse-a', type=float, default=1.0)
+    parser.add_argument('--lapse-b', type=float, default=19.0)
+    parser.add_argument('--slope', type=float, default=0.5)
+    parser.add_argument('--max-wrong-trials', type=int, default=2)
+    parser.add_argument('--forward-max', type=int, default=15)
+    parser.add_argument('--reverse-max', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--procedure', choices=['standard', 'adaptive'], default='standard')
+    args = parser.parse_args(argv)
+
+    results = simulate(args.subjects, {'forward': args.forward_span, 'reverse': args.reverse_span},
+                       args.span_sd, args.lapse_a, args.lapse_b, args.slope, args.max_wrong_trials,
+                       args.forward_max, args.reverse_max, args.seed, args.procedure)
+    report(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+class StimulusCache(object):
+    """Ready-to-draw stimuli, built once at startup.
+
+    Creating a TextStim (or changing its height) lays out the text and uploads
+    a new texture, which is too slow to do inside a timed trial. The cache
+    holds one TextStim per (digit, size) pair plus any named masks, and draws
+    each of them once into the back buffer so that the textures are resident
+    before the first trial. Trials then only pick an object and draw it.
+
+    `visual` is the backend's visual module (see backends.py).
+    """
+
+    def __init__(self, visual, window, digits, sizes):
+        self.window = window
+        self.digits = {}
+        self.masks = {}
+
+        for digit in digits:
+            for size in sizes:
+                self.digits[(digit, size)] = visual.TextStim(
+                    window, text=str(digit), height=size)
+
+    def digit(self, digit, size):
+        return self.digits[(digit, size)]
+
+    def add_mask(self, name, *stims):
+        self.masks[name] = list(stims)
+
+    def mask(self, name):
+        return self.masks[name]
+
+    def prerender(self):
+        # force layout and texture upload now, then throw the frame away
+        for stim in self.digits.values():
+            stim.draw()
+        for stims in self.masks.values():
+            for stim in stims:
+                stim.draw()
+        self.window.clearBuffer()
@@ -0,0 +1,94 @@
+"""Opt-in timing traces in Chrome trace (Perfetto) format.
+
+With trace=True a task records a span for each phase of its startup, each
+block and trial, every window flip and every sound it starts, plus instant
+events for responses. The events go into a fixed-size in-memory ring buffer
+(the oldest are dropped first once it is full), and the buffer is written out
+as '<subject>_<test>.trace.json' next to the log when the task quits. Open it
+in chrome://tracing or https://ui.perfetto.dev.
+
+Times are taken from the backend's clock, so a headless trace shows the
+same (virtual) timeline as its log.
+"""
+import json
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer(object):
+
+    def __init__(self, clock, capacity=200000):
+        # clock() returns seconds
+        self.clock = clock
+        self.events = deque(maxlen=capacity)
+        self.wrapped = []
+
+    def now(self):
+        return self.clock() * 1e6
+
+    @contextmanager
+    def span(self, name, cat='task', **args):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.events.append(('X', name, cat, start, self.now() - start, args or None))
+
+    def instant(self, name, cat='task', **args):
+        self.events.append(('i', name, cat, self.now(), None, args or None))
+
+    def wrap(self, obj, method, name=None, cat='task'):
+        """Replaces obj.method (on this instance only) by a traced version."""
+        function = getattr(obj, method)
+        name = name or method
+        events = self.events
+        now = self.now
+
+        def traced(*args, **kwargs):
+            start = now()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                events.append(('X', name, cat, start, now() - start, None))
+        setattr(obj, method, traced)
+        self.wrapped.append((obj, method))
+
+    def unwrap(self):
+        """Puts back everything wrap() replaced."""
+        while self.wrapped:
+            obj, method = self.wrapped.pop()
+            obj.__dict__.pop(method, None)
+
+    def dump(self, path):
+        trace = []
+        for ph, name, cat, ts, dur, args in self.events:
+            event = {'ph': ph, 'name': name, 'cat': cat, 'ts': ts, 'pid': 1, 'tid': 1}
+            if dur is not None:
+                event['dur'] = dur
+            else:
+                event['s'] = 't'
+            if args:
+                event['args'] = args
+            trace.append(event)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+class NullTracer(object):
+    """What a task uses when tracing is off: every call does nothing."""
+
+    @contextmanager
+    def span(self, name, cat='task', **args):
+        yield
+
+    def instant(self, name, cat='task', **args):
+        pass
+
+    def wrap(self, obj, method, name=None, cat='task'):
+        pass
+
+    def unwrap(self):
+        pass
+
+    def dump(self, path):
+        pass
@@ -0,0 +1,461 @@
+"""Integrity checks for DigitSpan and SART data directories.
+
+Every session CSV (and every .partial file left without its CSV) in the
+given directories is streamed once, row by row, in a process pool, and the
+problems found are written as a JSON report:
+
+    python -m argentometry.validate digitspan_data sart_data -o report.json
+
+The exit status is 1 if anything was found. Checks, by the name used in the
+report:
+
+    unreadable      the file can't be opened or parsed as CSV
+    schema          a row has the wrong number of columns, or a value of the
+                    wrong type (see schema.py)
+    order           rows out of phase order (practice, forward, reverse or
+                    practice, main), or a trial/block number going backwards
+    rt              an impossible response time: a DigitSpan response time
+                    that isn't positive or keystroke times that go backwards,
+                    a SART press that isn't positive or comes after the end
+                    of its trial (--digit-display-time + --mask-time, twice
+                    that in practice), or a mask_rt that contradicts the note
+    consistency     a SART row whose success doesn't follow from its digit,
+                    target and note, or a target that changes mid-session
+    truncated       an incomplete last row, a missing phase, fewer trials
+                    or blocks in a phase than scheduled, a DigitSpan block
+                    that stops before its stopping rule ends it, a .partial
+                    file or a checkpoint left by an interrupted session
+    sequence        a DigitSpan `expected` sequence that isn't the preset
+                    sequence for its place in the block (or isn't in the
+                    session's schedule), or a SART digit that isn't the
+                    scheduled one
+    sound_order     a DigitSpan digit recalled as the same other digit in
+                    most of its presentations, which is what playing the
+                    wrong sound file for it looks like
+    near_duplicate  subject IDs that differ only in case, separators,
+                    leading zeros or O/0 and I/L/1, e.g. 's01' and 'S001'
+                    (get_subject_info upper-cases IDs; older files and files
+                    copied in by hand may not be)
+
+Sessions with a '<subject>_<test>.schedule.json' are checked against it;
+older ones against the standard preset sequences. DigitSpan sessions with a
+'.estimates.json' were run with procedure='adaptive' and only have to use
+sequences from their schedule; pass --adaptive if the estimates are gone.
+"""
+import argparse
+import collections
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from argentometry import schedule
+from argentometry.schema import DIGITSPAN_DIRECTIONS, SART_NOTES, SART_PHASES, detect_task, split_name
+
+REPORT_VERSION = 1
+CHUNK_SIZE = 500  # files per worker task
+
+DIGITSPAN_COLUMNS = (5, 6, 7)
+SART_COLUMNS = (6, 10)
+
+# the tasks' default settings, for sessions without a schedule
+DIGITSPAN_PRACTICE_TRIALS = 2
+DIGITSPAN_BLOCKS = 1
+DIGITSPAN_MAX_TRIALS_WRONG = 2  # wrong answers in a row that end a block
+SART_TRIALS = {'practice': 20, 'main': 250}  # 2 and 25 sets of 10 digits
+SART_DIGIT_DISPLAY_TIME = 0.250
+SART_MASK_TIME = 0.900
+SART_PRACTICE_SLOWDOWN = 2  # practice trials are shown at half speed
+# allowance for rounding the times to whole frames and for dropped frames
+RT_SLACK = 0.1
+
+# a digit recalled as the same wrong digit this often suggests a swapped sound
+SOUND_ORDER_MIN_PRESENTATIONS = 4
+SOUND_ORDER_FRACTION = 0.75
+
+EXPECTED = re.compile(r'^\d(-\d)*$')
+ACTUAL = re.compile(r'^([\dx](-[\dx])*)?$')
+CONFUSABLE = {'O': '0', 'I': '1', 'L': '1'}
+
+
+class Checker(object):
+    """Collects the issues found in one file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.issues = []
+
+    def add(self, check, row, message):
+        # row is 1-based, as in a spreadsheet; None for the whole file
+        self.issues.append({'path': self.path, 'check': check, 'row': row, 'message': message})
+
+
+def to_float(value):
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    return None if value != value else value  # NaN
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def sart_max_rt(digit_display_time=SART_DIGIT_DISPLAY_TIME, mask_time=SART_MASK_TIME):
+    """The slowest possible SART press in each phase: the length of its trials."""
+    trial = digit_display_time + mask_time
+    return {'practice': SART_PRACTICE_SLOWDOWN * trial + RT_SLACK, 'main': trial + RT_SLACK}
+
+
+def check_digitspan(checker, rows, session, adaptive=False):
+    """Checks the rows of a DigitSpan session; `session` is its schedule or None."""
+    phase = 0
+    trial = -1
+    count = 0  # rows of the current block
+    directions = set()
+    counts = collections.defaultdict(int)  # direction -> rows
+    blocks = collections.defaultdict(set)  # direction -> block numbers
+    # the last block so far, its last sequence length and its wrong answers in a row
+    current = None
+    length = wrong = 0
+    # (digit, recalled as) -> times, and digit -> presentations
+    recalled = collections.defaultdict(int)
+    presented = collections.defaultdict(int)
+    pools = {}
+
+    for n, row in rows:
+        if not row:
+            continue
+        if len(row) not in DIGITSPAN_COLUMNS:
+            checker.add('schema', n, '{0} columns, expected {1}'.format(
+                len(row), ' or '.join(str(c) for c in DIGITSPAN_COLUMNS)))
+            continue
+        direction, block, expected, actual, timestamp = row[:5]
+        block = to_int(block)
+        if direction not in DIGITSPAN_DIRECTIONS or block is None or \
+                not EXPECTED.match(expected) or not ACTUAL.match(actual):
+            checker.add('schema', n, 'malformed row {0!r}'.format(','.join(row)))
+            continue
+        directions.add(direction)
+
+        i = DIGITSPAN_DIRECTIONS.index(direction)
+        if i < phase:
+            checker.add('order', n, '{0} after {1}'.format(direction, DIGITSPAN_DIRECTIONS[phase]))
+        elif i > phase or block > trial:
+            count = 0
+        elif block < trial:
+            checker.add('order', n, '{0} {1} after {2}'.format(direction, block, trial))
+        phase, trial = max(phase, i), block
+
+        timestamp = to_float(timestamp)
+        if timestamp is None or timestamp <= 0:
+            checker.add('rt', n, 'response time {0!r}'.format(row[4]))
+        if len(row) > 5 and row[5]:
+            last = 0.0
+            for keystroke in row[5].split(' '):
+                t = to_float(keystroke.rpartition(':')[2])
+                if t is None or t < last:
+                    checker.add('rt', n, 'keystroke times {0!r}'.format(row[5]))
+                    break
+                last = t
+
+        sequence = [int(d) for d in expected.split('-')]
+        if direction == 'practice':
+            if session is not None and (block >= len(session['practice']) or session['practice'][block] != sequence):
+                checker.add('sequence', n, 'practice sequence {0} is not the scheduled one'.format(expected))
+        elif session is not None:
+            try:
+                scheduled = session['blocks'][direction][block]
+            except IndexError:
+                checker.add('sequence', n, 'no {0} block {1} in the schedule'.format(direction, block))
+            else:
+                if (direction, block) not in pools:
+                    pools[direction, block] = schedule.sequence_pools(scheduled)
+                if adaptive or count >= len(scheduled['preset']):
+                    if sequence not in pools[direction, block].get(len(sequence), ()) and \
+                            sequence not in scheduled['preset']:
+                        checker.add('sequence', n, '{0} sequence {1} is not in the schedule'.format(direction, expected))
+                elif scheduled['preset'][count] != sequence:
+                    checker.add('sequence', n, '{0} sequence {1} should be preset {2}'.format(
+                        direction, expected, '-'.join(str(d) for d in scheduled['preset'][count])))
+        elif not adaptive and count < len(schedule.SEQUENCES[direction]) and \
+                tuple(sequence) != schedule.SEQUENCES[direction][count]:
+            checker.add('sequence', n, '{0} sequence {1} should be preset {2}'.format(
+                direction, expected, '-'.join(str(d) for d in schedule.SEQUENCES[direction][count])))
+        count += 1
+        counts[direction] += 1
+        blocks[direction].add(block)
+        if current != (direction, block):
+            current, wrong = (direction, block), 0
+        wrong = wrong + 1 if actual != expected else 0
+        length = len(sequence)
+
+        answer = actual.split('-')
+        if len(answer) == len(sequence):
+            for digit, typed in zip(sequence, answer):
+                presented[digit] += 1
+                if typed != 'x' and int(typed) != digit:
+                    recalled[digit, int(typed)] += 1
+
+    if 'reverse' not in directions:
+        missing = [d for d in DIGITSPAN_DIRECTIONS if d not in directions]
+        checker.add('truncated', None, 'no {0} trials'.format(' or '.join(missing)))
+    practice = len(session['practice']) if session is not None else DIGITSPAN_PRACTICE_TRIALS
+    if counts['practice'] < practice:
+        checker.add('truncated', None, '{0} of {1} practice trials'.format(counts['practice'], practice))
+    for direction in DIGITSPAN_DIRECTIONS[1:]:
+        scheduled = len(session['blocks'][direction]) if session is not None else DIGITSPAN_BLOCKS
+        if direction in directions and len(blocks[direction]) < scheduled:
+            checker.add('truncated', None, '{0} of {1} {2} blocks'.format(len(blocks[direction]), scheduled, direction))
+    # only the last block can have been cut short. A standard block ends after
+    # DIGITSPAN_MAX_TRIALS_WRONG wrong answers in a row, or once it reaches
+    # the longest sequences in its schedule
+    if session is not None and not adaptive and current is not None and current[0] != 'practice':
+        direction, block = current
+        try:
+            longest = max(schedule.sequence_pools(session['blocks'][direction][block]))
+        except IndexError:
+            longest = None
+        if longest is not None and wrong < DIGITSPAN_MAX_TRIALS_WRONG and length < longest:
+            checker.add('truncated', None, '{0} block {1} stops at length {2} after {3} wrong'.format(
+                direction, block, length, wrong))
+    for (digit, typed), times in sorted(recalled.items()):
+        if presented[digit] >= SOUND_ORDER_MIN_PRESENTATIONS and times >= SOUND_ORDER_FRACTION * presented[digit]:
+            checker.add('sound_order', None, '{0} was recalled as {1} in {2} of {3} presentations'.format(
+                digit, typed, times, presented[digit]))
+
+
+def check_sart(checker, rows, session, max_rt=None):
+    """Checks the rows of a SART session; `session` is its schedule or None.
+    `max_rt` is the slowest possible press in each phase (see sart_max_rt())."""
+    max_rt = max_rt or sart_max_rt()
+    phases = dict((name, i) for i, name in enumerate(SART_PHASES))
+    notes = set(note for note in SART_NOTES if note)
+    phase = 0
+    target = None
+    counts = dict((name, 0) for name in SART_PHASES)
+
+    for n, row in rows:
+        if not row:
+            continue
+        columns = len(row)
+        if columns not in SART_COLUMNS:
+            checker.add('schema', n, '{0} columns, expected {1}'.format(
+                columns, ' or '.join(str(c) for c in SART_COLUMNS)))
+            continue
+        # inline rather than through to_int(): this loop runs for every row
+        # of every file
+        name, success, note = row[0], row[3], row[5]
+        try:
+            row_target, digit, rt = int(row[1]), int(row[2]), float(row[4])
+        except ValueError:
+            row_target = None
+        i = phases.get(name)
+        if i is None or row_target is None or success not in ('True', 'False') or note not in notes:
+            checker.add('schema', n, 'malformed row {0!r}'.format(','.join(row)))
+            continue
+
+        if i < phase:
+            checker.add('order', n, '{0} after {1}'.format(name, SART_PHASES[phase]))
+        else:
+            phase = i
+
+        if target is None:
+            target = row_target
+        elif row_target != target:
+            checker.add('consistency', n, 'target {0} after {1}'.format(row_target, target))
+        pressed = note != 'nopress'
+        if (success == 'True') != (pressed == (digit != row_target)):
+            checker.add('consistency', n, '{0} on digit {1} (target {2}) logged as success={3}'.format(
+                note, digit, row_target, success))
+
+        if rt != rt or rt < 0 or (pressed and not 0 < rt <= max_rt[name]):
+            checker.add('rt', n, '{0} with rt {1!r}'.format(note, row[4]))
+        elif pressed and columns > 6 and row[6]:
+            mask_rt = to_float(row[6])
+            if mask_rt is None or (note == 'press mask') != (mask_rt >= 0):
+                checker.add('rt', n, '{0} with mask_rt {1!r}'.format(note, row[6]))
+
+        if session is not None:
+            digits = session[name]['digits']
+            if counts[name] >= len(digits):
+                checker.add('sequence', n, 'more {0} trials than the {1} scheduled'.format(name, len(digits)))
+            elif digits[counts[name]] != digit:
+                checker.add('sequence', n, '{0} trial {1} shows {2}, scheduled {3}'.format(
+                    name, counts[name], digit, digits[counts[name]]))
+        counts[name] += 1
+
+    for name in SART_PHASES:
+        scheduled = len(session[name]['digits']) if session is not None else SART_TRIALS[name]
+        if counts[name] < scheduled:
+            checker.add('truncated', None, '{0} of {1} {2} trials'.format(counts[name], scheduled, name))
+
+
+def check_file(path, task=None, schedule_path=None, adaptive=False, max_rt=None):
+    """Returns the issues in one session file, and its task."""
+    checker = Checker(path)
+    session = None
+    if schedule_path is not None:
+        try:
+            session = schedule.load(schedule_path)
+        except (IOError, ValueError) as e:
+            checker.add('unreadable', None, 'schedule {0}: {1}'.format(os.path.basename(schedule_path), e))
+
+    try:
+        with open(path, 'rb') as f:
+            # (row number, row), skipping blank lines
+            rows = enumerate(csv.reader(f), 1)
+            first = next((row for row in rows if row[1]), None)
+            if first is None:
+                checker.add('truncated', None, 'no rows')
+                return checker.issues, task
+            task = task or detect_task(first[1])
+            if session is not None and session.get('task') != task:
+                checker.add('sequence', None, 'schedule is for {0}'.format(session.get('task')))
+                session = None
+            rows = itertools.chain([first], rows)
+            if task == 'sart':
+                check_sart(checker, rows, session, max_rt)
+            else:
+                check_digitspan(checker, rows, session, adaptive)
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                checker.add('truncated', None, 'the last row is incomplete')
+    except (IOError, csv.Error) as e:
+        checker.add('unreadable', None, str(e))
+    return checker.issues, task
+
+
+def check_chunk(args):
+    files, max_rt = args
+    return [(path,) + check_file(path, task, schedule_path, adaptive, max_rt)
+            for path, task, schedule_path, adaptive in files]
+
+
+def subject_key(subject):
+    """What a subject ID is likely to have meant: see near_duplicates()."""
+    key = ''.join(CONFUSABLE.get(c, c) for c in subject.upper() if c.isalnum())
+    return re.sub(r'(?<!\d)0+(?=\d)', '', key)
+
+
+def near_duplicates(subjects):
+    """Groups of distinct subject IDs with the same subject_key()."""
+    groups = collections.defaultdict(set)
+    for subject in subjects:
+        groups[subject_key(subject)].add(subject)
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+
+def scan(data_dir, task=None, adaptive=False):
+    """Lists (path, task, schedule path or None, adaptive) for the session
+    files in `data_dir`, and the issues with the directory itself."""
+    names = set(os.listdir(data_dir))
+    files = []
+    issues = []
+    for fn in sorted(names):
+        if fn.endswith('.csv'):
+            path = os.path.join(data_dir, fn)
+        elif fn.endswith('.csv.partial') and fn[:-len('.partial')] not in names:
+            path = os.path.join(data_dir, fn)
+            issues.append({'path': path, 'check': 'truncated', 'row': None,
+                           'message': 'the session was never closed'})
+        else:
+            if fn.endswith('.checkpoint.json'):
+                issues.append({'path': os.path.join(data_dir, fn), 'check': 'truncated', 'row': None,
+                               'message': 'an interrupted session can be resumed'})
+            continue
+        base = fn[:fn.index('.csv')]
+        schedule_name = base + '.schedule.json'
+        # only adaptive DigitSpan sessions save span estimates
+        files.append((path, task, os.path.join(data_dir, schedule_name) if schedule_name in names else None,
+                      adaptive or base + '.estimates.json' in names))
+    return files, issues
+
+
+def validate(data_dirs, task=None, adaptive=False, max_rt=None, processes=None, chunk_size=CHUNK_SIZE):
+    """Checks every session file in `data_dirs`. Returns the report as a dict.
+    `max_rt` is the slowest possible SART press in each phase (see sart_max_rt())."""
+    files = []
+    issues = []
+    for data_dir in data_dirs:
+        found, dir_issues = scan(data_dir, task, adaptive)
+        files.extend(found)
+        issues.extend(dir_issues)
+
+    chunks = [(files[i:i + chunk_size], max_rt) for i in range(0, len(files), chunk_size)]
+    if processes == 1 or len(chunks) <= 1:
+        results = map(check_chunk, chunks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(check_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    tasks = collections.defaultdict(int)
+    subjects = collections.defaultdict(list)
+    for chunk in results:
+        for path, file_issues, file_task in chunk:
+            issues.extend(file_issues)
+            tasks[file_task or 'unknown'] += 1
+            subject, test = split_name(path[:-len('.partial')] if path.endswith('.partial') else path)
+            subjects[subject].append(path)
+
+    for group in near_duplicates(subjects):
+        for subject in group:
+            for path in subjects[subject]:
+                issues.append({'path': path, 'check': 'near_duplicate', 'row': None,
+                               'message': 'subject {0} may be the same as {1}'.format(
+                                   subject, ', '.join(s for s in group if s != subject))})
+
+    issues.sort(key=lambda issue: (issue['path'], issue['row'] or 0))
+    return {
+        'version': REPORT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'data_dirs': list(data_dirs),
+        'files': len(files),
+        'tasks': dict(tasks),
+        'counts': dict(collections.Counter(issue['check'] for issue in issues)),
+        'issues': issues,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check DigitSpan and SART data directories for bad sessions.')
+    parser.add_argument('data_dirs', nargs='+', metavar='data_dir')
+    parser.add_argument('--task', choices=['digitspan', 'sart'], help='default: detected for each file')
+    parser.add_argument('--adaptive', action='store_true',
+                        help="DigitSpan sessions without a schedule used procedure='adaptive'")
+    parser.add_argument('--digit-display-time', type=float, default=SART_DIGIT_DISPLAY_TIME,
+                        help="the SART sessions' digit_display_time, in seconds")
+    parser.add_argument('--mask-time', type=float, default=SART_MASK_TIME,
+                        help="the SART sessions' mask_time, in seconds")
+    parser.add_argument('-o', '--output', help='JSON report to write (default: stdout)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    report = validate(args.data_dirs, args.task, args.adaptive,
+                      sart_max_rt(args.digit_display_time, args.mask_time), args.processes)
+    f = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(report, f, indent=1, sort_keys=True)
+        f.write('\n')
+    finally:
+        if args.output:
+            f.close()
+    print >> sys.stderr, '{0} files, {1} issues'.format(report['files'], len(report['issues']))
+    return 1 if report['issues'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
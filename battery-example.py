@@ -0,0 +1,16 @@
+from argentometry import battery
+import sys
+
+def main():
+    tasks = battery.Battery([
+        ('digitspan', dict(data_dir = "kelly_data_digitspan",
+                           sound_path = '/Users/localadmin/Desktop/argentometry/sounds')),
+        ('sart', dict(data_dir = "kelly_data_sart"))],
+        monitor_resolution = (1600, 900),
+        fullscreen = True)
+      # sound_init_samples = 44100
+    results, completed = tasks.run()
+    return 0 if completed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
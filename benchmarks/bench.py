@@ -0,0 +1,258 @@
+"""Benchmarks of the task hot paths and the data pipeline.
+
+The first group runs headless (see backends.py), so it works on a plain Linux
+box with no display, sound card or PsychoPy:
+
+    accept_sequence     seconds per iteration (frame) of the DigitSpan key loop,
+                        without the drawing and flipping (free when headless)
+    log.<n>             seconds to append n DigitSpan rows to a TrialLog and
+                        close it (write_data + quit serialization)
+    sound_bank.decode   seconds to decode and resample the digit sounds
+    sound_bank.cached   seconds to load them from the on-disk cache
+    import.<module>     cold import time (see import_time.py)
+
+The second group times PsychoPy itself, so it needs PsychoPy, a display and a
+sound card, and is skipped when PsychoPy can't be imported:
+
+    display_digit       seconds per SART displayDigit call, including its
+                        flip (which waits for the vertical blank)
+    stimulus_cache      seconds to build and prerender SART's stimulus cache
+    sound_bank.sounds   seconds to create the ten sound.Sound objects
+
+Every benchmark is repeated and its median kept. Results are written as JSON,
+with enough about the machine to know whether two files are comparable:
+
+    python benchmarks/bench.py run -o benchmarks/baselines/mine.json
+    python benchmarks/bench.py compare benchmarks/baselines/mine.json new.json --threshold 0.25
+
+compare lists every benchmark and exits with status 1 if any of them is
+slower than the baseline by more than `threshold` (a fraction).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy
+
+from argentometry.audio import SoundBank
+from argentometry.backends import HeadlessBackend, PsychoPyBackend, SyntheticParticipant
+from argentometry.datalog import TrialLog
+from argentometry.digitspan import DigitSpan
+from argentometry.sart import SART
+from argentometry.stimuli import StimulusCache
+import import_time
+
+SOUND_PATH = os.path.join(ROOT, 'argentometry', 'sounds')
+LOG_SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+
+def median_time(function, repeat, number=1):
+    """Median over `repeat` runs of the time of one call, each run timing
+    `number` calls (so sub-millisecond calls aren't lost in timer noise)."""
+    times = []
+    for i in range(repeat):
+        start = timeit.default_timer()
+        for j in range(number):
+            function()
+        times.append((timeit.default_timer() - start) / number)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def headless_task(cls, data_dir, **kwargs):
+    return cls(backend=HeadlessBackend(SyntheticParticipant(seed=0, error_rate=0)), subject_info=('BENCH', '1'),
+               data_dir=data_dir, hardware_profile_dir=None, sound_cache_dir=None, **kwargs)
+
+
+def psychopy_task(cls, data_dir, **kwargs):
+    return cls(backend=PsychoPyBackend(), subject_info=('BENCH', '1'), data_dir=data_dir,
+               hardware_profile_dir=None, fullscreen=False, **kwargs)
+
+
+def has_psychopy():
+    try:
+        import psychopy
+    except ImportError:
+        return False
+    return True
+
+
+def bench_accept_sequence(data_dir, repeat):
+    task = headless_task(DigitSpan, data_dir)
+    flip = task.window.flip
+    frames = [0]
+
+    def counted_flip(*args, **kwargs):
+        frames[0] += 1
+        return flip(*args, **kwargs)
+    task.window.flip = counted_flip
+
+    def run():
+        # the participant types back seven digits and return
+        task.backend.participant.heard = [3, 1, 4, 1, 5, 9, 2]
+        task.accept_sequence()
+    per_call = median_time(run, repeat, 20)
+    frames_per_call = frames[0] / (repeat * 20.0)
+    task.quit()
+    return per_call / frames_per_call
+
+
+def bench_sart_display(data_dir, repeat):
+    task = psychopy_task(SART, data_dir)
+    sizes = task.DIGIT_SIZES
+
+    calls = [0]
+
+    def run():
+        task.displayDigit(calls[0] % 10, sizes[calls[0] % len(sizes)])
+        calls[0] += 1
+    # each call flips, so this takes about a second per repeat at 60 Hz
+    per_call = median_time(run, repeat, 60)
+    build = median_time(lambda: StimulusCache(task.visual, task.window, range(10), sizes).prerender(), repeat, 10)
+    bank = SoundBank(SOUND_PATH, 'female', task.SOUND_INIT_SAMPLES, None)
+    sounds = median_time(lambda: [task.sound.Sound(value=bank.clips[d], sampleRate=bank.rate)
+                                  for d in range(10)], repeat, 10)
+    task.quit()
+    return per_call, build, sounds
+
+
+def bench_log(data_dir, rows, repeat):
+    row = ['forward', 3, '3-1-4-1-5-9-2', '3-1-4-1-5-9-2', 2.7183,
+           ' '.join('{0}:{1:.4f}'.format(d, 0.25 * i) for i, d in enumerate('3141592')) + ' return:2.0000', '']
+    path = os.path.join(data_dir, 'log.csv')
+
+    def run():
+        log = TrialLog(path, sync_rows=None, sync_interval=None)
+        for i in range(rows):
+            log.append(row)
+        log.close()
+    return median_time(run, repeat)
+
+
+def bench_sound_bank(data_dir, repeat):
+    cache = os.path.join(data_dir, 'sounds')
+    decode = median_time(lambda: SoundBank(SOUND_PATH, 'female', 48000, None), repeat, 10)
+    SoundBank(SOUND_PATH, 'female', 48000, cache)
+    cached = median_time(lambda: SoundBank(SOUND_PATH, 'female', 48000, cache), repeat, 100)
+    return decode, cached
+
+
+def run(repeat=7, max_rows=LOG_SIZES[-1], imports=True, psychopy=None):
+    """psychopy: whether to run the PsychoPy benchmarks; None: if it's installed."""
+    results = {}
+    data_dir = tempfile.mkdtemp(prefix='argentometry-bench-')
+    try:
+        results['accept_sequence'] = bench_accept_sequence(os.path.join(data_dir, 'digitspan'), repeat)
+        for rows in LOG_SIZES:
+            if rows <= max_rows:
+                # one pass is plenty at the larger sizes
+                results['log.{0}'.format(rows)] = bench_log(data_dir, rows, repeat if rows <= 10 ** 4 else 1)
+        results['sound_bank.decode'], results['sound_bank.cached'] = bench_sound_bank(data_dir, repeat)
+        if psychopy is None:
+            psychopy = has_psychopy()
+        if psychopy:
+            (results['display_digit'], results['stimulus_cache'],
+             results['sound_bank.sounds']) = bench_sart_display(os.path.join(data_dir, 'sart'), repeat)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    if imports:
+        for module in import_time.MODULES:
+            results['import.' + module] = import_time.import_time(module, repeat)[0]
+    return results
+
+
+def machine():
+    return {
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(baseline, current, threshold):
+    """Returns the lines of the comparison and the names that regressed."""
+    lines = ['{0:<40} {1:>12} {2:>12} {3:>8}'.format('benchmark', 'baseline', 'current', 'change')]
+    regressions = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            lines.append('{0:<40} {1:>12} {2:>12}'.format(
+                name, format_time(baseline.get(name)), format_time(current.get(name))))
+            continue
+        change = current[name] / baseline[name] - 1 if baseline[name] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        lines.append('{0:<40} {1:>12} {2:>12} {3:>+7.0%}{4}'.format(
+            name, format_time(baseline[name]), format_time(current[name]), change, flag))
+    return lines, regressions
+
+
+def format_time(secs):
+    if secs is None:
+        return '-'
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if secs >= scale:
+            return '{0:.3g} {1}'.format(secs / scale, unit)
+    return '{0:.3g} ns'.format(secs / 1e-9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run or compare the benchmarks.')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('-o', '--output', help='write the results here (default: stdout)')
+    run_parser.add_argument('--repeat', type=int, default=7)
+    run_parser.add_argument('--max-rows', type=int, default=LOG_SIZES[-1], help='largest log to write')
+    run_parser.add_argument('--no-imports', action='store_true', help='skip the import benchmarks')
+    run_parser.add_argument('--no-psychopy', action='store_true',
+                            help='skip the PsychoPy benchmarks even if it is installed')
+    compare_parser = commands.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.25,
+                                help='slowdown (as a fraction) that counts as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        report = {'machine': machine(), 'unit': 's',
+                  'results': run(args.repeat, args.max_rows, not args.no_imports,
+                                 False if args.no_psychopy else None)}
+        text = json.dumps(report, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print text
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline['machine']['host'] != current['machine']['host']:
+        print 'Warning: comparing results from different machines ({0} and {1})'.format(
+            baseline['machine']['host'], current['machine']['host'])
+    lines, regressions = compare(baseline['results'], current['results'], args.threshold)
+    print '\n'.join(lines)
+    if regressions:
+        print '{0} regression(s) over {1:.0%}'.format(len(regressions), args.threshold)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Cold import time of each argentometry module.
+
+Every module is imported in a fresh interpreter, `--repeat` times, and the
+median wall time is reported in milliseconds. The data-side modules must not
+pull in PsychoPy at all; importing the tasks must not either (the backend
+imports it on first use). Exits with status 1 if a module loads PsychoPy or,
+with --budget, takes longer than that many milliseconds.
+
+    python benchmarks/import_time.py [--repeat 5] [--budget 500] [--json out.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = [
+    'argentometry.adaptive',
+    'argentometry.analysis',
+    'argentometry.archive',
+    'argentometry.schedule',
+    'argentometry.schema',
+    'argentometry.datalog',
+    'argentometry.checkpoint',
+    'argentometry.index',
+    'argentometry.validate',
+    'argentometry.simulation',
+    'argentometry.monitor',
+    'argentometry.audio',
+    'argentometry.hardware',
+    'argentometry.backends',
+    'argentometry.digitspan',
+    'argentometry.sart',
+    'argentometry.battery',
+]
+
+PROBE = '''
+import sys, time
+start = time.time()
+import {0}
+print('%f %d' % (time.time() - start, any(m == 'psychopy' or m.startswith('psychopy.') for m in sys.modules)))
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time(module, repeat=5, python=sys.executable):
+    """Returns (median seconds, whether psychopy was imported)."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    times = []
+    psychopy = False
+    for i in range(repeat):
+        out = subprocess.check_output([python, '-c', PROBE.format(module)], env=env)
+        secs, loaded = out.split()
+        times.append(float(secs))
+        psychopy = psychopy or loaded == '1'
+    times.sort()
+    return times[len(times) // 2], psychopy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the cold import time of each module.')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=None, help='maximum milliseconds per module')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = False
+    for module in args.modules:
+        secs, psychopy = import_time(module, args.repeat)
+        over = args.budget is not None and secs * 1000 > args.budget
+        failed = failed or psychopy or over
+        results[module] = {'ms': round(secs * 1000, 2), 'psychopy': psychopy}
+        print '{0:<28} {1:8.1f} ms{2}{3}'.format(module, secs * 1000, '  imports psychopy' if psychopy else '',
+                                                 '  over budget' if over else '')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
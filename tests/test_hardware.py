@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from argentometry import hardware
+from argentometry.backends import HeadlessBackend
+
+
+class StationBackend(HeadlessBackend):
+    # a headless backend standing in for a real station
+    profiles = True
+
+
+class CalibrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def launch(self, backend, resolution, recalibrate=False):
+        """Whether a launch at `resolution` calibrated the display."""
+        calibration = hardware.calibration(backend, 'testMonitor', resolution, True, self.profile_dir, recalibrate)
+        calibrated = calibration.profile is None
+        calibration.init_sound(backend.sound)
+        calibration.measure_display(backend.visual.Window(resolution), backend.core)
+        return calibrated
+
+    def test_display_configurations_are_kept_apart(self):
+        backend = StationBackend()
+        launches = [self.launch(backend, resolution) for resolution in [(1024, 768), (1600, 900)] * 2]
+        self.assertEqual(launches, [True, True, False, False])
+
+    def test_recalibrating_keeps_audio_settings(self):
+        backend = StationBackend()
+        self.launch(backend, (1024, 768))
+        path = hardware.profile_path(self.profile_dir)
+        with open(path) as f:
+            saved = json.load(f)
+        saved['audio_rate'] = 44100
+        with open(path, 'w') as f:
+            json.dump(saved, f)
+        self.assertTrue(self.launch(backend, (1024, 768), recalibrate=True))
+        self.assertEqual(hardware.load_profiles(path)['audio_rate'], 44100)
+
+    def test_headless_never_writes_a_profile(self):
+        self.launch(HeadlessBackend(), (1024, 768))
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from argentometry import schedule
+from argentometry.backends import SyntheticParticipant, run_headless
+from argentometry.digitspan import DigitSpan
+from argentometry.sart import SART
+
+
+class DigitspanScheduleTest(unittest.TestCase):
+
+    def test_pools_cover_presets_longer_than_max(self):
+        session = schedule.digitspan_schedule(
+            1, sequence_range={'forward': {'min': 3, 'max': 6}, 'reverse': {'min': 2, 'max': 5}})
+        for direction in ('forward', 'reverse'):
+            pools = schedule.sequence_pools(session['blocks'][direction][0])
+            longest = max(len(s) for s in schedule.SEQUENCES[direction])
+            self.assertEqual(max(pools), longest)
+
+    def test_session_with_max_shorter_than_presets(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            # a participant who never errs gets through every preset
+            logs = run_headless(DigitSpan, 1, participant=lambda i: SyntheticParticipant(seed=i, span=20, error_rate=0),
+                                data_dir=data_dir, sound_cache_dir=None, forward_max=6, reverse_max=5)
+            with open(logs[0]) as f:
+                directions = set(line.split(',')[0] for line in f)
+            self.assertEqual(directions, set(['practice', 'forward', 'reverse']))
+        finally:
+            shutil.rmtree(data_dir)
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'S01_1.schedule.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_schedule_for_the_other_task(self):
+        schedule.save(schedule.digitspan_schedule(1), self.path)
+        self.assertRaises(ValueError, schedule.load, self.path, 'sart')
+        self.assertEqual(schedule.load(self.path, 'digitspan')['task'], 'digitspan')
+
+    def test_sart_sizes_the_task_cannot_draw(self):
+        schedule.save(schedule.sart_schedule(1, digit_sizes=(1.8, 6.0)), self.path)
+        self.assertRaises(ValueError, schedule.load, self.path, 'sart', (0, 9), (1.8, 2.7, 3.5, 3.8, 4.5))
+        self.assertRaises(ValueError, schedule.load, self.path, 'sart', (0, 4), (1.8, 6.0))
+        schedule.load(self.path, 'sart', (0, 9), (1.8, 6.0))
+
+    def test_session_with_a_mismatched_schedule_fails_before_logging(self):
+        schedule.save(schedule.sart_schedule(1, digit_sizes=(6.0,)), self.path)
+        self.assertRaises(ValueError, run_headless, SART, 1, data_dir=os.path.join(self.data_dir, 'sart'),
+                          sound_cache_dir=None, schedule_file=self.path)
+        self.assertEqual([fn for fn in os.listdir(os.path.join(self.data_dir, 'sart')) if '.csv' in fn], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from argentometry import schedule, validate
+from argentometry.backends import run_headless
+from argentometry.digitspan import DigitSpan
+from argentometry.sart import SART
+
+
+def sart_rows(session, phases=('practice', 'main'), rt=0.4):
+    # every non-target pressed, every target withheld
+    rows = []
+    for phase in phases:
+        for digit in session[phase]['digits']:
+            if digit == session['target']:
+                rows.append([phase, session['target'], digit, True, rt, 'nopress'])
+            else:
+                rows.append([phase, session['target'], digit, True, rt, 'press mask'])
+    return [(n, [str(v) for v in row]) for n, row in enumerate(rows, 1)]
+
+
+def check(function, rows, session, *args):
+    checker = validate.Checker('test.csv')
+    function(checker, rows, session, *args)
+    return [(issue['check'], issue['message']) for issue in checker.issues]
+
+
+class SartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = schedule.sart_schedule(1)
+
+    def test_practice_press_slower_than_a_main_trial(self):
+        rows = sart_rows(self.session)
+        rows[0][1][4] = '2.2'  # practice trials last 2 * (0.25 + 0.9) s
+        self.assertEqual(check(validate.check_sart, rows, self.session), [])
+
+    def test_main_press_after_the_trial(self):
+        rows = sart_rows(self.session)
+        press = [row for n, row in rows if row[0] == 'main' and row[5] != 'nopress'][-1]
+        press[4] = '2.2'
+        self.assertEqual([c for c, m in check(validate.check_sart, rows, self.session)], ['rt'])
+
+    def test_limits_follow_the_timing_settings(self):
+        # too slow for a main trial, not for a practice one
+        rows = sart_rows(self.session, rt=0.5)
+        presses = [n for n, row in rows if row[0] == 'main' and row[5] != 'nopress']
+        issues = check(validate.check_sart, rows, self.session, validate.sart_max_rt(0.1, 0.2))
+        self.assertEqual(issues, [('rt', "press mask with rt '0.5'")] * len(presses))
+
+    def test_practice_cut_short(self):
+        rows = sart_rows(self.session, phases=('practice',))[:5]
+        self.assertEqual(check(validate.check_sart, rows, self.session),
+                         [('truncated', '5 of 20 practice trials'), ('truncated', '0 of 250 main trials')])
+
+
+class DigitspanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def session(self, **kwargs):
+        path = run_headless(DigitSpan, 1, data_dir=os.path.join(self.data_dir, 'ds'),
+                            sound_cache_dir=None, **kwargs)[0]
+        with open(path) as f:
+            rows = [line.rstrip('\n').split(',') for line in f]
+        return list(enumerate(rows, 1)), schedule.load(path[:-len('.csv')] + '.schedule.json')
+
+    def test_complete_session(self):
+        rows, session = self.session(trial_blocks=2)
+        self.assertEqual(check(validate.check_digitspan, rows, session), [])
+
+    def test_missing_block(self):
+        rows, session = self.session(trial_blocks=2)
+        rows = [(n, row) for n, row in rows if not (row[0] == 'reverse' and row[1] == '1')]
+        self.assertEqual(check(validate.check_digitspan, rows, session),
+                         [('truncated', '1 of 2 reverse blocks')])
+
+    def test_block_cut_short(self):
+        rows, session = self.session()
+        # the last reverse trial that was recalled correctly
+        last = max(i for i, (n, row) in enumerate(rows) if row[0] == 'reverse' and row[2] == row[3])
+        self.assertEqual([c for c, m in check(validate.check_digitspan, rows[:last + 1], session)], ['truncated'])
+
+
+if __name__ == '__main__':
+    unittest.main()